@@ -7,6 +7,7 @@ import os
 import pickle
 import time
 import logging
+import threading
 import numpy as np
 
 token_dict = {'<Nnet>': 1, '</Nnet>': 2, '<!EndOfComponent>': 3,
@@ -37,6 +38,14 @@ def ReadData(fp, dtype=np.float32):
 #        print(data)
         return np.array(data, dtype=dtype)
 
+def SkipLength(frames, skip, skip_offset = 0):
+    '''
+    frames number of io_func.skip_frame(feature, skip, skip_offset)
+    '''
+    if skip <= 1:
+        return frames
+    return len(range(skip_offset, frames, skip))
+
 class Splice(object):
     def __init__(self, input_dim = None, output_dim = None):
         self.input_dim_ = input_dim
@@ -50,7 +59,57 @@ class Splice(object):
     def GetSplice(self):
         return self.data_
 
-    def Propagate(self, input_data):
+    def Context(self):
+        '''
+        return left and right edge frames padded before splice.
+        '''
+        return max(-int(np.min(self.data_)), 0), max(int(np.max(self.data_)), 0)
+
+    def Propagate(self, input_data, out = None, skip = 1, skip_offset = 0):
+        '''
+        edge pad input once and gather all context frames by a strided
+        window view, out is preallocated [frames, len(self.data_) * dim].
+        splice offsets needn't be contiguous.
+        skip, skip_offset: only splice frames skip_offset::skip.
+        '''
+        left, right = self.Context()
+        padded = np.pad(input_data, ((left, right), (0, 0)), mode='edge')
+        return self.PropagatePadded(padded, out, skip, skip_offset)
+
+    def PropagatePadded(self, padded, out = None, skip = 1, skip_offset = 0):
+        '''
+        padded has Context() edge frames, it's the same as Propagate.
+        '''
+        left, right = self.Context()
+        dim = padded.shape[1]
+        frames = len(padded) - left - right
+        out_frames = SkipLength(frames, skip, skip_offset)
+        if out is None:
+            out = np.empty((out_frames, len(self.data_) * dim), dtype=padded.dtype)
+        if out_frames == 0:
+            return out
+        low = int(np.min(self.data_))
+        high = int(np.max(self.data_))
+        # windows[t] = padded[t + left + low : t + left + high + 1]
+        stride = padded.strides[0]
+        windows = np.lib.stride_tricks.as_strided(padded[left + low:],
+                shape=(frames, high - low + 1, dim),
+                strides=(stride, stride, padded.strides[1]), writeable=False)
+        if skip > 1:
+            windows = windows[skip_offset::skip]
+        # set shape raise error if out can't be viewed as [frames, splice, dim]
+        out3 = out.view()
+        out3.shape = (out_frames, len(self.data_), dim)
+        if len(self.data_) == high - low + 1 and np.all(np.diff(self.data_) == 1):
+            out3[...] = windows
+        else:
+            np.take(windows, np.asarray(self.data_, dtype=np.intp) - low, axis=1, out=out3)
+        return out
+
+    def PropagateStack(self, input_data):
+        '''
+        the old splice by vstack and hstack, it's kept for benchmark.
+        '''
         # now self.data_ must be intervalles 1
         for x in range(len(self.data_)-1):
             assert self.data_[x+1] - self.data_[x] == 1
@@ -131,9 +190,61 @@ class Rescale(object):
     def GetInDim(self):
         return len(self.data_)
 
+class Affine(object):
+    '''
+    consecutive AddShift and Rescale folded to (x + offset_) * scale_ + bias_,
+    AddShift before the first Rescale is offset_, after it's bias_ in output space,
+    so AddShift then Rescale gives the same float32 result as unfolded.
+    '''
+    def __init__(self, dim):
+        self.offset_ = np.zeros(dim, dtype=np.float32)
+        self.scale_ = np.ones(dim, dtype=np.float32)
+        self.bias_ = np.zeros(dim, dtype=np.float32)
+        self.has_offset_ = False
+        self.has_scale_ = False
+        self.has_bias_ = False
+
+    def Fold(self, cal):
+        if cal.GetTypeStr() == 'AddShift':
+            if self.has_scale_:
+                self.bias_ += cal.data_
+                self.has_bias_ = True
+            else:
+                self.offset_ += cal.data_
+                self.has_offset_ = True
+        else:
+            self.scale_ *= cal.data_
+            self.bias_ *= cal.data_
+            self.has_scale_ = True
+
+    def Empty(self):
+        return not self.has_offset_ and not self.has_scale_ and not self.has_bias_
+
+    def Propagate(self, input_data, out):
+        '''
+        out can be input_data, it's done in place.
+        '''
+        if self.has_offset_:
+            np.add(input_data, self.offset_, out=out)
+        elif out is not input_data:
+            out[...] = input_data
+        if self.has_scale_:
+            np.multiply(out, self.scale_, out=out)
+        if self.has_bias_:
+            np.add(out, self.bias_, out=out)
+        return out
+
 class FeatureTransform(object):
     def __init__(self):
         self.trans_ = []
+        # compiled transform: affine -> splice -> affine
+        self.pre_affine_ = None
+        self.splice_ = None
+        self.post_affine_ = None
+        self.compiled_ = False
+        self.max_frames_ = 0
+        # scratch buffers of every thread, io processes have their own after fork
+        self.scratch_ = threading.local()
 
     def LoadTransform(self, file):
         fp = open(file,'r')
@@ -158,11 +269,112 @@ class FeatureTransform(object):
                     elif key == '</Nnet>':
                         return self.trans_
 
-    def Propagate(self, input_data):
-        res = input_data
+    def Compile(self, max_frames = 0):
+        '''
+        fold the transform to pre affine -> splice -> post affine.
+        post affine is moved before splice when it's the same for all
+        splice frames. max_frames is the scratch buffer frames, it grows
+        for longer utterance. return False if it can't be compiled.
+        '''
+        pre_affine = Affine(self.GetInDim())
+        splice = None
+        post_affine = None
         for cal in self.trans_:
-            res = cal.Propagate(res)
-        return res
+            if cal.GetTypeStr() == 'Splice':
+                if splice is not None:
+                    logging.info('more than one Splice, feature transform isn\'t compiled')
+                    return False
+                splice = cal
+                post_affine = Affine(cal.GetOutDim())
+            elif post_affine is not None:
+                post_affine.Fold(cal)
+            else:
+                pre_affine.Fold(cal)
+        if splice is not None and not post_affine.Empty() and pre_affine.Empty():
+            num = len(splice.GetSplice())
+            offset = post_affine.offset_.reshape(num, -1)
+            scale = post_affine.scale_.reshape(num, -1)
+            bias = post_affine.bias_.reshape(num, -1)
+            if (offset == offset[0]).all() and (scale == scale[0]).all() and (bias == bias[0]).all():
+                pre_affine.offset_ = offset[0].copy()
+                pre_affine.scale_ = scale[0].copy()
+                pre_affine.bias_ = bias[0].copy()
+                pre_affine.has_offset_ = post_affine.has_offset_
+                pre_affine.has_scale_ = post_affine.has_scale_
+                pre_affine.has_bias_ = post_affine.has_bias_
+                post_affine = None
+        self.pre_affine_ = None if pre_affine.Empty() else pre_affine
+        self.splice_ = splice
+        self.post_affine_ = None if post_affine is None or post_affine.Empty() else post_affine
+        self.max_frames_ = max_frames
+        self.compiled_ = True
+        return True
+
+    def Scratch(self, frames):
+        buf = getattr(self.scratch_, 'buf', None)
+        if buf is None or len(buf) < frames:
+            left, right = (0, 0) if self.splice_ is None else self.splice_.Context()
+            buf = np.empty((max(frames, self.max_frames_ + left + right), self.GetInDim()), dtype=np.float32)
+            self.scratch_.buf = buf
+        return buf[:frames]
+
+    def Propagate(self, input_data, out = None, skip = 1, skip_offset = 0):
+        '''
+        out is preallocated [SkipLength(frames), out_dim],
+        skip, skip_offset is the same as io_func.skip_frame.
+        '''
+        if not self.compiled_:
+            res = input_data
+            for cal in self.trans_:
+                res = cal.Propagate(res)
+            if skip > 1:
+                res = res[skip_offset::skip]
+            if out is None:
+                return res
+            out[...] = res
+            return out
+        frames = len(input_data)
+        if out is None:
+            out = np.empty((SkipLength(frames, skip, skip_offset), self.GetOutDim()), dtype=np.float32)
+        if frames == 0:
+            # no frame to splice or pad
+            return out
+        if self.splice_ is not None:
+            # affine result is written into padded scratch, then edge frames
+            left, right = self.splice_.Context()
+            padded = self.Scratch(left + frames + right)
+            res = padded[left : left + frames]
+            if self.pre_affine_ is not None:
+                self.pre_affine_.Propagate(input_data, res)
+            else:
+                res[...] = input_data
+            padded[:left] = res[0]
+            padded[left + frames:] = res[-1]
+            self.splice_.PropagatePadded(padded, out, skip, skip_offset)
+        else:
+            res = input_data
+            if self.pre_affine_ is not None:
+                res = self.pre_affine_.Propagate(input_data, self.Scratch(frames))
+            if skip > 1:
+                res = res[skip_offset::skip]
+            out[...] = res
+        if self.post_affine_ is not None:
+            self.post_affine_.Propagate(out, out)
+        return out
+
+    def PropagateBatch(self, input_list, out = None, skip = 1, skip_offset = 0):
+        '''
+        transform a list of utterances into zero padded time major
+        [max_frames, batch, out_dim] out, out can be bigger.
+        return out and frames of every utterance.
+        '''
+        length = [ SkipLength(len(x), skip, skip_offset) for x in input_list ]
+        if out is None:
+            out = np.zeros((max(length), len(input_list), self.GetOutDim()), dtype=np.float32)
+        for b, input_data in enumerate(input_list):
+            self.Propagate(input_data, out[:length[b], b, :], skip, skip_offset)
+            out[length[b]:, b, :] = 0
+        return out, length
 
     def GetSplice(self):
         for cal in self.trans_:
@@ -6,21 +6,33 @@ from fst.lattice_functions import *
 from fst.lattice import *
 from fst.convert_lattice_to_sparsematrix import *
 from fst.topsort import *
+from fst.fst_reader import *
+from fst.array_fst import ArrayFst
 
 def Fst2SparseMatrix(fst_file):
-    fst = Fst()
     fp = open(fst_file, 'rb')
-    fst.Read(fp)
+    fst_arrays = ReadFstArrays(fp)
     fp.close()
-    laststatesuperfinal = SuperFinalFst(fst)
-    indexs, in_labels, weights, statesinfo, start_state, shape = ConvertFstToSparseMatrix(fst)
-    num_state = shape[0]
+    indexs, in_labels, weights, statesinfo, num_state = SparseFstArrays(fst_arrays)
+    laststatesuperfinal = True
 
-    return indexs, in_labels, weights, statesinfo, num_state, start_state, laststatesuperfinal
+    return indexs, in_labels, weights, statesinfo, num_state, fst_arrays.start, laststatesuperfinal
 
 
-def PackageFst(fst_list):
-    max_time = 0
+def SparseFst(fst):
+    '''
+    super final and convert fst to sparse matrix,
+    return [indexs, in_labels, weights, statesinfo, num_states]
+    '''
+    laststatesuperfinal = SuperFinalFst(fst)
+    indexs, in_labels, weights, statesinfo, start_state, shape = ConvertFstToSparseMatrix(fst)
+    assert np.shape(statesinfo)[0] == shape[0]
+    return [indexs, in_labels, weights, statesinfo, shape[0]]
+
+def PackageSparseFst(sparse_list):
+    '''
+    sparse_list: [SparseFst(fst), ...]
+    '''
     max_arcs = 0
     max_states = 0
     # lattice struct
@@ -29,31 +41,18 @@ def PackageFst(fst_list):
     weights_list = []
     statesinfo_list = []
     statenum_list = []
-    # convert all lattice
-    for ifst in fst_list:
-        laststatesuperfinal = SuperFinalFst(ifst)
-        indexs, in_labels, weights, statesinfo, start_state, shape = ConvertFstToSparseMatrix(ifst)
-#        key, max_t, lattice = ReadLatticeScp(scp_line)
-#        time_list.append(max_t)
-
-#        indexs_info, pdf_values , lmweight_values, amweight_values, statesinfo, shape = ConvertLatticeToSparseMatrix(lattice)
-#        if map_pdf_phone is not None:
-#            pdf_values = AliToPdf(map_pdf_phone, pdf_values, offset = 1)
+    for indexs, in_labels, weights, statesinfo, state_n in sparse_list:
         arc_n = np.shape(indexs)[0]
-        state_n = shape[0]
-        assert np.shape(statesinfo)[0] == state_n
-        if np.shape(in_labels)[0] > max_arcs:
+        if arc_n > max_arcs:
             max_arcs = arc_n
-   #     if max_time < max_t:
-   #         max_time = max_t
-        if max_states < shape[0]:
+        if max_states < state_n:
             max_states = state_n
 
         indexs_info_list.append(indexs)
         inlabels_list.append(in_labels)
         weights_list.append(weights)
         statesinfo_list.append(statesinfo)
-        statenum_list.append(shape[0])
+        statenum_list.append(state_n)
     # package all sparse fst
 
     indexs_info_list = ListZeroFill(indexs_info_list, max_arcs)
@@ -62,7 +61,9 @@ def PackageFst(fst_list):
     statesinfo_list = ListZeroFill(statesinfo_list, max_states)
     
     return [indexs_info_list, inlabels_list, weights_list, statesinfo_list, statenum_list]
-    
+
+def PackageFst(fst_list):
+    return PackageSparseFst([ SparseFst(ifst) for ifst in fst_list ])
 
 
 
@@ -96,17 +97,27 @@ def ReadLatticeScp(scp_line):
     in     : lat.scp 
     out    : key, max_time, standered lattice ( super final lattice and top sort )
     '''
-    lattice = Lattice()
-    key = lattice.ReadScp(scp_line)
-    # convert standered lattice
-    lattice = ConvertLattice(lattice)
-    # super final lattice
-    SuperFinalFst(lattice)
-    # top sort lattice
-    TopSort(lattice)
+    return ReadLatticeScpList([scp_line])[0]
 
-    max_time, _ = LatticeStateTimes(lattice)
-    return key, max_time, lattice
+def ReadLatticeScpList(scp_lines):
+    '''
+    read kaldi lattices
+    in     : lat.scp lines
+    out    : [(key, max_time, standered lattice), ...]
+    lattices are ArrayFst, they are converted by columns,
+    top sorted and timed together, so they share the Kahn levels.
+    '''
+    keys = []
+    lattices = []
+    for scp_line in scp_lines:
+        key, arrays = ReadLatticeArraysScp(scp_line)
+        keys.append(key)
+        # convert standered lattice and super final lattice
+        lattices.append(ArrayFst.FromArrays(SuperFinalArrays(ConvertLatticeArrays(arrays))))
+    # top sort lattice
+    TopSortList(lattices)
+    state_times = LatticeStateTimesList(lattices)
+    return [ (key, max_time, lattice) for key, (max_time, _), lattice in zip(keys, state_times, lattices) ]
 
 # zero fill at end
 # now it depend fill_dim == -1 only
@@ -257,8 +268,7 @@ def PackageLattice(lat_scp_list, map_pdf_phone = None):
     statenum_list = []
     time_list = []
     # convert all lattice
-    for scp_line in lat_scp_list:
-        key, max_t, lattice = ReadLatticeScp(scp_line)
+    for key, max_t, lattice in ReadLatticeScpList(lat_scp_list):
         time_list.append(max_t)
 
         indexs_info, pdf_values , lmweight_values, amweight_values, statesinfo, shape = ConvertLatticeToSparseMatrix(lattice)
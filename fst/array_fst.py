@@ -0,0 +1,474 @@
+from __future__ import print_function
+import sys
+
+import numpy as np
+
+sys.path.extend(["../","./"])
+from fst.fst_base import *
+from fst.fst_reader import FstArrays, ReadFstArrays, ReorderCsr
+
+'''
+ArrayFst keeps arcs in the parallel columns of FstArrays,
+GetState/GetArcs/Final return views, so the callers of Fst work with it.
+a view reads (and writes) the columns it's made on, it's made only when it's used.
+AddState, AddArc, SetFinal and SetState make new columns, so the views made
+before them keep the old states, as State objects moved by Fst.SetState do.
+'''
+
+def WeightClass(arctype):
+    if arctype == 'standard':
+        return Weight
+    elif arctype == 'lattice4':
+        return LatticeWeightFloat
+    return CompactLatticeWeightFloat
+
+class WeightView(object):
+    '''
+    weight i of w1, w2 columns, Weight is _value (w1) and
+    LatticeWeightFloat is _value1, _value2, they are written in place.
+    '''
+    __slots__ = ('_w1', '_w2', '_i', '_wclass')
+
+    def __init__(self, w1, w2, i, wclass):
+        self._w1 = w1
+        self._w2 = w2
+        self._i = i
+        self._wclass = wclass
+
+    @property
+    def _value(self):
+        return float(self._w1[self._i])
+
+    @_value.setter
+    def _value(self, value):
+        self._w1[self._i] = value
+
+    @property
+    def _value1(self):
+        return float(self._w1[self._i])
+
+    @_value1.setter
+    def _value1(self, value):
+        self._w1[self._i] = value
+
+    @property
+    def _value2(self):
+        return float(self._w2[self._i])
+
+    @_value2.setter
+    def _value2(self, value):
+        self._w2[self._i] = value
+
+    def Value(self):
+        if self._wclass is Weight:
+            return self._value
+        return self._value1 + self._value2
+
+    def IsZero(self):
+        return self.Value() == float('inf')
+
+    def IsOne(self):
+        return self.Value() == float(0.0)
+
+    def Zero(self):
+        return self._wclass().Zero()
+
+    def One(self):
+        return self._wclass().One()
+
+    def __repr__(self):
+        if self._wclass is Weight:
+            return Weight(self._value).__repr__()
+        return LatticeWeightFloat(self._value1, self._value2).__repr__()
+
+class CompactWeightView(object):
+    '''
+    CompactLatticeWeightFloat of columns, _weight is written in place,
+    _string is a copy, string of ArrayFst is changed only by SetWeight.
+    '''
+    __slots__ = ('_weight', '_string')
+
+    def __init__(self, w1, w2, i, strings, string_offsets):
+        self._weight = WeightView(w1, w2, i, LatticeWeightFloat)
+        self._string = strings[string_offsets[i]:string_offsets[i + 1]].tolist()
+
+    def Value(self):
+        return self._weight.Value()
+
+    def IsZero(self):
+        return self._weight.IsZero()
+
+    def IsOne(self):
+        return self._weight.IsOne()
+
+    def Zero(self):
+        return CompactLatticeWeightFloat().Zero()
+
+    def One(self):
+        return CompactLatticeWeightFloat().One()
+
+    def __repr__(self):
+        weight = CompactLatticeWeightFloat()
+        weight._weight = LatticeWeightFloat(self._weight._value1, self._weight._value2)
+        weight._string = self._string
+        return weight.__repr__()
+
+def MakeWeightView(arrays, w1, w2, strings, string_offsets, i):
+    if strings is not None:
+        return CompactWeightView(w1, w2, i, strings, string_offsets)
+    return WeightView(w1, w2, i, WeightClass(arrays.arctype))
+
+class ArcView(object):
+    __slots__ = ('_columns', '_i')
+
+    def __init__(self, columns, i):
+        self._columns = columns
+        self._i = i
+
+    @property
+    def _ilabel(self):
+        return int(self._columns.ilabel[self._i])
+
+    @_ilabel.setter
+    def _ilabel(self, value):
+        self._columns.ilabel[self._i] = value
+
+    @property
+    def _olabel(self):
+        return int(self._columns.olabel[self._i])
+
+    @_olabel.setter
+    def _olabel(self, value):
+        self._columns.olabel[self._i] = value
+
+    @property
+    def _nextstate(self):
+        return int(self._columns.nextstate[self._i])
+
+    @_nextstate.setter
+    def _nextstate(self, value):
+        self._columns.nextstate[self._i] = value
+
+    @property
+    def _weight(self):
+        c = self._columns
+        return MakeWeightView(c, c.w1, c.w2, c.strings, c.string_offsets, self._i)
+
+    @_weight.setter
+    def _weight(self, weight):
+        self.SetWeight(weight)
+
+    def SetWeight(self, weight):
+        w1, w2, string = WeightValues(weight)
+        c = self._columns
+        if c.strings is not None:
+            old = c.strings[c.string_offsets[self._i]:c.string_offsets[self._i + 1]]
+            assert list(old) == string and 'arc string of ArrayFst is read only'
+        c.w1[self._i] = w1
+        c.w2[self._i] = w2
+
+    def __repr__(self):
+        pri = str(self._nextstate) + '\t'
+        pri += str(self._ilabel) + '\t'
+        pri += str(self._olabel) + '\t'
+        pri += self._weight.__repr__()
+        return pri
+
+class StateView(object):
+    '''
+    state s of the columns of fst when it's made,
+    AddArc and SetFinal of the view are seen by the view.
+    '''
+    __slots__ = ('_fst', '_s', '_columns')
+
+    def __init__(self, fst, s):
+        self._fst = fst
+        self._s = s
+        self._columns = fst.Columns()
+
+    @property
+    def _arcs(self):
+        return self.GetArcs()
+
+    @property
+    def _final(self):
+        return self.Final()
+
+    @_final.setter
+    def _final(self, weight):
+        self.SetFinal(weight)
+
+    def GetArcs(self):
+        c = self._columns
+        return [ ArcView(c, i) for i in range(c.state_offsets[self._s], c.state_offsets[self._s + 1]) ]
+
+    def NumArcs(self):
+        c = self._columns
+        return int(c.state_offsets[self._s + 1] - c.state_offsets[self._s])
+
+    def IsFinal(self):
+        return not self.Final().IsZero()
+
+    def Final(self):
+        c = self._columns
+        return MakeWeightView(c, c.final_w1, c.final_w2, c.final_strings, c.final_string_offsets, self._s)
+
+    def AddArc(self, arc):
+        self._fst.AddArc(self._s, arc)
+        self._columns = self._fst.Columns()
+
+    def SetFinal(self, weight):
+        self._fst.SetFinal(self._s, weight)
+        self._columns = self._fst.Columns()
+
+def WeightValues(weight):
+    '''
+    return w1, w2, string of Weight, LatticeWeightFloat, CompactLatticeWeightFloat or their views.
+    '''
+    if isinstance(weight, (CompactLatticeWeightFloat, CompactWeightView)):
+        return weight._weight._value1, weight._weight._value2, list(weight._string)
+    if isinstance(weight, Weight) or (isinstance(weight, WeightView) and weight._wclass is Weight):
+        return weight._value, 0.0, []
+    return weight._value1, weight._value2, []
+
+class ArrayFst(FstArrays):
+    '''
+    Fst of FstArrays columns, it's about ten times smaller than Fst.
+    AddState, AddArc and SetFinal are pending, they are merged in columns
+    by Flush before the fst is read, so the arcs of a state are contiguous
+    and building a fst is linear.
+    SetState replaces the arcs and final of a state in Flush too,
+    StateSort of ArrayFst permutes the columns without SetState.
+    '''
+    def __init__(self, arctype = 'standard'):
+        super(ArrayFst, self).__init__(arctype)
+        self.Clear()
+
+    def Clear(self):
+        self.start = kNoStateId
+        self.final_w1 = np.zeros(0, dtype=np.float32)
+        self.final_w2 = np.zeros(0, dtype=np.float32)
+        self.SetArcs(np.zeros(0, dtype=np.int64), [], [], [], [], [])
+        self.string_offsets = None
+        self.strings = None
+        self.final_string_offsets = None
+        self.final_strings = None
+        if self.arctype == 'compactlattice44':
+            self.string_offsets = np.zeros(1, dtype=np.int64)
+            self.strings = np.zeros(0, dtype=np.int32)
+            self.final_string_offsets = np.zeros(1, dtype=np.int64)
+            self.final_strings = np.zeros(0, dtype=np.int32)
+        self.ClearPending()
+
+    def ClearPending(self):
+        self.added_states = 0
+        # [[src, ilabel, olabel, w1, w2, nextstate, string], ...]
+        self.pending = []
+        # { state: (w1, w2, string) }
+        self.pending_finals = {}
+        # { state: number of pending arcs when SetState }, arcs of the state before it are dropped
+        self.pending_states = {}
+        # FstArrays of the columns the views are made on
+        self.columns = None
+
+    @property
+    def _wclass(self):
+        return WeightClass(self.arctype)
+
+    @property
+    def _states(self):
+        return self.GetStates()
+
+    @staticmethod
+    def FromArrays(arrays):
+        fst = ArrayFst(arrays.arctype)
+        fst.__dict__.update(arrays.__dict__)
+        fst.ClearPending()
+        return fst
+
+    @staticmethod
+    def FromFst(fst):
+        array_fst = ArrayFst(fst.ArcType())
+        for s in range(fst.NumStates()):
+            array_fst.AddState()
+        array_fst.SetStart(fst.Start())
+        for s in range(fst.NumStates()):
+            for arc in fst.GetArcs(s):
+                array_fst.AddArc(s, arc)
+            if fst.GetState(s).IsFinal():
+                array_fst.SetFinal(s, fst.Final(s))
+        array_fst.Flush()
+        return array_fst
+
+    def Read(self, fp):
+        self.ClearPending()
+        self.string_offsets = None
+        self.strings = None
+        self.final_string_offsets = None
+        self.final_strings = None
+        ReadFstArrays(fp, self)
+
+    def ToFst(self, fst = None):
+        self.Flush()
+        return super(ArrayFst, self).ToFst(fst)
+
+    def FstType(self):
+        return 'vector'
+
+    def ArcType(self):
+        return self.arctype
+
+    def SetArcType(self, arctype):
+        assert self.NumStates() == 0 and 'set arc type of empty ArrayFst'
+        self.arctype = arctype
+        self.Clear()
+        return True
+
+    def Start(self):
+        return self.start
+
+    def SetStart(self, start):
+        self.start = start
+
+    def NumStates(self):
+        return len(self.final_w1) + self.added_states
+
+    def NumArcs(self):
+        if len(self.pending_states) != 0:
+            self.Flush()
+        return len(self.ilabel) + len(self.pending)
+
+    def SetNumStates(self, numstates):
+        assert numstates == self.NumStates()
+
+    def SetNumArcs(self, numarcs):
+        assert numarcs == self.NumArcs()
+
+    def AddState(self):
+        self.added_states += 1
+        return self.NumStates() - 1
+
+    def AddArc(self, s, arc):
+        assert s < self.NumStates()
+        w1, w2, string = WeightValues(arc._weight)
+        self.pending.append([s, arc._ilabel, arc._olabel, w1, w2, arc._nextstate, string])
+
+    def SetFinal(self, s, weight):
+        assert s < self.NumStates()
+        self.pending_finals[s] = WeightValues(weight)
+
+    def Flush(self):
+        '''
+        merge pending states, finals and arcs to columns.
+        '''
+        if self.added_states > 0:
+            added = self.added_states
+            self.added_states = 0
+            unfinal_w2 = 0.0 if self.arctype == 'standard' else np.inf
+            self.final_w1 = np.concatenate([self.final_w1, np.full(added, np.inf, dtype=np.float32)])
+            self.final_w2 = np.concatenate([self.final_w2, np.full(added, unfinal_w2, dtype=np.float32)])
+            self.state_offsets = np.concatenate([self.state_offsets,
+                np.full(added, self.state_offsets[-1], dtype=np.int64)])
+            if self.final_string_offsets is not None:
+                self.final_string_offsets = np.concatenate([self.final_string_offsets,
+                    np.full(added, self.final_string_offsets[-1], dtype=np.int64)])
+        if len(self.pending_finals) != 0:
+            pending_finals = self.pending_finals
+            self.pending_finals = {}
+            # new columns, views made before keep the old finals
+            self.final_w1 = self.final_w1.copy()
+            self.final_w2 = self.final_w2.copy()
+            for s, (w1, w2, string) in pending_finals.items():
+                self.final_w1[s] = w1
+                self.final_w2[s] = w2
+            if self.final_strings is not None:
+                strings = [ self.final_strings[self.final_string_offsets[s]:self.final_string_offsets[s + 1]]
+                        for s in range(self.NumStates()) ]
+                for s, (w1, w2, string) in pending_finals.items():
+                    strings[s] = np.array(string, dtype=np.int32)
+                self.final_string_offsets = np.zeros(self.NumStates() + 1, dtype=np.int64)
+                np.cumsum([ len(x) for x in strings ], out=self.final_string_offsets[1:])
+                self.final_strings = np.concatenate(strings + [np.zeros(0, dtype=np.int32)]).astype(np.int32)
+        if len(self.pending_states) != 0:
+            pending_states = self.pending_states
+            self.pending_states = {}
+            self.pending = [ arc for n, arc in enumerate(self.pending)
+                    if n >= pending_states.get(arc[0], 0) ]
+            replaced = np.zeros(self.NumStates(), dtype=bool)
+            replaced[list(pending_states.keys())] = True
+            self.KeepArcs(np.flatnonzero(~replaced[self.src]))
+        if len(self.pending) == 0:
+            return
+        pending = list(zip(*self.pending))
+        self.pending = []
+        src = np.concatenate([self.src, np.array(pending[0], dtype=np.int32)])
+        # pending arcs are after the arcs of the state
+        order = np.argsort(src, kind='stable')
+        if self.strings is not None:
+            offsets = np.zeros(len(pending[6]) + 1, dtype=np.int64)
+            np.cumsum([ len(x) for x in pending[6] ], out=offsets[1:])
+            strings = np.array([ x for string in pending[6] for x in string ], dtype=np.int32)
+            self.string_offsets, self.strings = ReorderCsr(
+                    np.concatenate([self.string_offsets, offsets[1:] + self.string_offsets[-1]]),
+                    np.concatenate([self.strings, strings]), order)
+        columns = []
+        for old, new, dtype in zip([self.ilabel, self.olabel, self.w1, self.w2, self.nextstate],
+                pending[1:6], [np.int32, np.int32, np.float32, np.float32, np.int32]):
+            columns.append(np.concatenate([old, np.array(new, dtype=dtype)])[order])
+        self.SetArcs(np.bincount(src, minlength=self.NumStates()), *columns)
+
+    def KeepArcs(self, arc_ids):
+        '''
+        keep arcs of arc_ids, they are sorted by src.
+        '''
+        if self.strings is not None:
+            self.string_offsets, self.strings = ReorderCsr(self.string_offsets, self.strings, arc_ids)
+        self.SetArcs(np.bincount(self.src[arc_ids], minlength=self.NumStates()),
+                self.ilabel[arc_ids], self.olabel[arc_ids], self.w1[arc_ids], self.w2[arc_ids],
+                self.nextstate[arc_ids])
+
+    def Columns(self):
+        '''
+        FstArrays of the current columns, it's the same object until the columns are changed.
+        '''
+        self.Flush()
+        columns = self.columns
+        if columns is None or any(value is not self.__dict__[key]
+                for key, value in columns.__dict__.items()):
+            columns = FstArrays(self.arctype)
+            for key in columns.__dict__:
+                columns.__dict__[key] = self.__dict__[key]
+            self.columns = columns
+        return columns
+
+    def Final(self, s):
+        assert s < self.NumStates()
+        return self.GetState(s).Final()
+
+    def IsFinal(self, s):
+        self.Flush()
+        return self.final_w1[s] + self.final_w2[s] != np.inf
+
+    def GetState(self, s):
+        assert s < self.NumStates()
+        return StateView(self, s)
+
+    def GetStates(self):
+        return [ StateView(self, s) for s in range(self.NumStates()) ]
+
+    def GetArcs(self, s):
+        return self.GetState(s).GetArcs()
+
+    def SetState(self, s, state):
+        '''
+        arcs and final of s are replaced by state (State or StateView) in Flush,
+        the arcs added to s before are dropped.
+        '''
+        assert s < self.NumStates()
+        self.pending_states[s] = len(self.pending)
+        for arc in state.GetArcs():
+            self.AddArc(s, arc)
+        self.SetFinal(s, state.Final())
+
+    def Write(self, fp = None):
+        self.ToFst().Write(fp)
@@ -5,6 +5,7 @@ import sys
 
 sys.path.extend(["../","./"])
 from fst.lattice import *
+from fst.fst_reader import FstArrays, SparseLatticeArrays, ConvertArraysToSparseMatrix
 
 
 def ConvertLatticeToSparseMatrix(lat):
@@ -20,6 +21,10 @@ def ConvertLatticeToSparseMatrix(lat):
     amweight_values = []      # arc am weight
     statesinfo = []           # state in indexs offset and length [offset, len]
 
+    if isinstance(lat, FstArrays):
+        lat.Flush()
+        return SparseLatticeArrays(lat)
+
     num_states = lat.NumStates()
     start_state = lat.Start()
 
@@ -47,6 +52,23 @@ def ConvertLatticeToSparseMatrix(lat):
     
     return np.array(indexs, dtype=np.int32), np.array(pdf_values, dtype=np.int32), np.array(lmweight_values, dtype=np.float32), np.array(amweight_values, dtype=np.float32), np.array(statesinfo, dtype=np.int32), shape
 
+def ConvertLatticeFinalsToSparseMatrix(lat):
+    '''
+    (input) lat : lattice of ConvertLatticeToSparseMatrix
+
+    return      : final_weights [num_states, 2] (lm weight, am weight), it's inf if state isn't final
+
+    '''
+    if isinstance(lat, FstArrays):
+        lat.Flush()
+        return np.stack([lat.final_w1, lat.final_w2], axis=1).astype(np.float32)
+
+    final_weights = []
+    for s in range(lat.NumStates()):
+        final = lat.Final(s)
+        final_weights.append([final._value1, final._value2])
+    return np.array(final_weights, dtype=np.float32).reshape(-1, 2)
+
 def ConvertFstToSparseMatrix(fst):
     '''
     (input) fst : must be topsort and have super final
@@ -59,6 +81,10 @@ def ConvertFstToSparseMatrix(fst):
     weights = []              # arc weight
     statesinfo = []           # state in indexs offset and length [offset, len]
 
+    if isinstance(fst, FstArrays):
+        fst.Flush()
+        return ConvertArraysToSparseMatrix(fst)
+
     num_states = fst.NumStates()
     start_state = fst.Start()
 
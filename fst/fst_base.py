@@ -194,6 +194,30 @@ class Fst(FstHeader, object):
             self._states.append(State(self._wclass).Read(fp, self._wclass))
             nstate += 1
 
+    def Skip(self, fp):
+        '''
+        read header and seek over states, states aren't read.
+        compactlattice44 arcs aren't fixed size, they are read.
+        '''
+        FstHeader.Read(self, fp)
+        if self.ArcType() == 'standard':
+            final_size, arc_size = 4, 16
+        elif self.ArcType() == 'lattice4':
+            final_size, arc_size = 8, 20
+        else:
+            self.SetArcType(self.ArcType())
+            nstate = 0
+            while nstate < self.NumStates():
+                State(self._wclass).Read(fp, self._wclass)
+                nstate += 1
+            return
+        nstate = 0
+        while nstate < self.NumStates():
+            fp.seek(final_size, 1)
+            arcs_num = struct.unpack(str('<q'), fp.read(8))[0]
+            fp.seek(arcs_num * arc_size, 1)
+            nstate += 1
+
     def Write(self, fp = None):
         FstHeader.Write(self, fp)
         if fp is None:
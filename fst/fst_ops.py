@@ -2,12 +2,17 @@
 import sys
 sys.path.extend(["../","./"])
 from fst.fst_base import *
+from fst.fst_reader import FstArrays, SuperFinalArrays
 
 def SuperFinalFst(fst):
     '''Convert only one final fst and the final is last.
     fst (input) : fst
     fst (output): bool
     '''
+    if isinstance(fst, FstArrays) and fst.ArcType() != 'compactlattice44':
+        fst.Flush()
+        fst.Assign(SuperFinalArrays(fst))
+        return True
     num_states = fst.NumStates()
     final_state_list = []
     for s in range(num_states):
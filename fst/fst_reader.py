@@ -0,0 +1,496 @@
+from __future__ import print_function
+import struct
+import sys
+
+import numpy as np
+
+sys.path.extend(["../","./"])
+from fst.fst_base import *
+
+'''
+vectorized reader of openfst vector fst binary body.
+the arcs of one state are read in one block and all the blocks are parsed by
+np.frombuffer with structured dtypes, it's no Arc and weight objects.
+FstArrays is CSR: the arcs of state s are [state_offsets[s], state_offsets[s+1]).
+Fst object is made by ToFst only when it's needed.
+TopSort, StateSort and LatticeStateTimes of FstArrays are Kahn levels and column permutations,
+ConvertLattice and SuperFinalFst of FstArrays are column operations too.
+'''
+
+# final weight + int64 arcs number
+STATE_DTYPE = {
+        'standard' : np.dtype([('w1', '<f4'), ('narcs', '<i8')]),
+        'lattice4' : np.dtype([('w1', '<f4'), ('w2', '<f4'), ('narcs', '<i8')]),
+        }
+
+ARC_DTYPE = {
+        'standard' : np.dtype([('ilabel', '<i4'), ('olabel', '<i4'), ('w1', '<f4'), ('nextstate', '<i4')]),
+        'lattice4' : np.dtype([('ilabel', '<i4'), ('olabel', '<i4'), ('w1', '<f4'), ('w2', '<f4'), ('nextstate', '<i4')]),
+        }
+
+class FstArrays(object):
+    '''
+    arctype       : standard, lattice4 or compactlattice44
+    start         : start state
+    final_w1/w2   : [num_states] float32 final weight, standard w2 is 0
+    state_offsets : [num_states + 1] int64
+    src, ilabel, olabel, nextstate : [num_arcs] int32
+    w1, w2        : [num_arcs] float32 arc weight, standard w2 is 0
+    compactlattice44 strings are CSR too, string of arc i is
+    strings[string_offsets[i]:string_offsets[i+1]], final strings are the same.
+    '''
+    def __init__(self, arctype):
+        self.arctype = arctype
+        self.start = -1
+        self.final_w1 = None
+        self.final_w2 = None
+        self.state_offsets = None
+        self.src = None
+        self.ilabel = None
+        self.olabel = None
+        self.w1 = None
+        self.w2 = None
+        self.nextstate = None
+        self.string_offsets = None
+        self.strings = None
+        self.final_string_offsets = None
+        self.final_strings = None
+
+    def NumStates(self):
+        return len(self.final_w1)
+
+    def Flush(self):
+        # ArrayFst merges pending changes
+        pass
+
+    def Assign(self, arrays):
+        self.__dict__.update(arrays.__dict__)
+
+    def NumArcs(self):
+        return len(self.ilabel)
+
+    def SetArcs(self, narcs, ilabel, olabel, w1, w2, nextstate):
+        self.state_offsets = np.zeros(len(narcs) + 1, dtype=np.int64)
+        np.cumsum(narcs, out=self.state_offsets[1:])
+        self.src = np.repeat(np.arange(len(narcs), dtype=np.int32), narcs)
+        self.ilabel = np.ascontiguousarray(ilabel, dtype=np.int32)
+        self.olabel = np.ascontiguousarray(olabel, dtype=np.int32)
+        self.w1 = np.ascontiguousarray(w1, dtype=np.float32)
+        self.w2 = np.ascontiguousarray(w2, dtype=np.float32)
+        self.nextstate = np.ascontiguousarray(nextstate, dtype=np.int32)
+
+    def ToFst(self, fst = None):
+        '''
+        make Fst (or fill fst, e.g. Lattice) of the arrays.
+        '''
+        if fst is None:
+            fst = Fst()
+        fst.SetFstType('vector')
+        fst.SetArcType(self.arctype)
+        wclass = fst._wclass
+        fst._states = []
+        for s in range(self.NumStates()):
+            state = State(wclass)
+            state._final = self.MakeWeight(wclass, self.final_w1[s], self.final_w2[s],
+                    self.final_strings, self.final_string_offsets, s)
+            for i in range(self.state_offsets[s], self.state_offsets[s + 1]):
+                arc = Arc(wclass, int(self.ilabel[i]), int(self.olabel[i]), int(self.nextstate[i]))
+                arc._weight = self.MakeWeight(wclass, self.w1[i], self.w2[i],
+                        self.strings, self.string_offsets, i)
+                state._arcs.append(arc)
+            fst._states.append(state)
+        fst.SetStart(self.start)
+        fst.SetNumStates(self.NumStates())
+        fst.SetNumArcs(self.NumArcs())
+        return fst
+
+    def MakeWeight(self, wclass, w1, w2, strings, string_offsets, i):
+        if wclass is Weight:
+            return Weight(float(w1))
+        if wclass is LatticeWeightFloat:
+            return LatticeWeightFloat(float(w1), float(w2))
+        weight = CompactLatticeWeightFloat()
+        weight._weight = LatticeWeightFloat(float(w1), float(w2))
+        weight._string = strings[string_offsets[i]:string_offsets[i + 1]].tolist()
+        return weight
+
+def ReadFixedArcs(fp, arrays, num_states):
+    '''
+    standard and lattice4, arcs of one state is one read.
+    '''
+    state_dtype = STATE_DTYPE[arrays.arctype]
+    arc_dtype = ARC_DTYPE[arrays.arctype]
+    state_size = state_dtype.itemsize
+    arc_size = arc_dtype.itemsize
+    unpack_narcs = struct.Struct('<q').unpack_from
+    state_blocks = []
+    arc_blocks = []
+    for s in range(num_states):
+        block = fp.read(state_size)
+        state_blocks.append(block)
+        narcs = unpack_narcs(block, state_size - 8)[0]
+        if narcs > 0:
+            arc_blocks.append(fp.read(narcs * arc_size))
+    states = np.frombuffer(b''.join(state_blocks), dtype=state_dtype)
+    arcs = np.frombuffer(b''.join(arc_blocks), dtype=arc_dtype)
+    arrays.final_w1 = np.array(states['w1'], dtype=np.float32)
+    if 'w2' in arc_dtype.names:
+        arrays.final_w2 = np.array(states['w2'], dtype=np.float32)
+        w2 = arcs['w2']
+    else:
+        arrays.final_w2 = np.zeros(num_states, dtype=np.float32)
+        w2 = np.zeros(len(arcs), dtype=np.float32)
+    arrays.SetArcs(states['narcs'], arcs['ilabel'], arcs['olabel'], arcs['w1'], w2, arcs['nextstate'])
+
+def ReadCompactLatticeArcs(fp, arrays, num_states):
+    '''
+    compactlattice44, weight string isn't fixed size, one read per arc.
+    '''
+    unpack_weight = struct.Struct('<ffi').unpack
+    unpack_narcs = struct.Struct('<q').unpack
+    unpack_arc = struct.Struct('<iiffi').unpack
+    unpack_int = struct.Struct('<i').unpack
+    narcs_list = []
+    finals = []
+    final_strings = []
+    arcs = []
+    strings = []
+    for s in range(num_states):
+        w1, w2, sz = unpack_weight(fp.read(12))
+        finals.append((w1, w2, sz))
+        if sz > 0:
+            final_strings.append(fp.read(4 * sz))
+        narcs = unpack_narcs(fp.read(8))[0]
+        narcs_list.append(narcs)
+        for n in range(narcs):
+            ilabel, olabel, w1, w2, sz = unpack_arc(fp.read(20))
+            # string and nextstate
+            block = fp.read(4 * sz + 4)
+            if sz > 0:
+                strings.append(block[:-4])
+            arcs.append((ilabel, olabel, w1, w2, sz, unpack_int(block[-4:])[0]))
+    finals = np.array(finals, dtype=np.float64).reshape(-1, 3)
+    arcs = np.array(arcs, dtype=np.float64).reshape(-1, 6)
+    arrays.final_w1 = finals[:, 0].astype(np.float32)
+    arrays.final_w2 = finals[:, 1].astype(np.float32)
+    arrays.final_string_offsets = np.zeros(num_states + 1, dtype=np.int64)
+    np.cumsum(finals[:, 2].astype(np.int64), out=arrays.final_string_offsets[1:])
+    arrays.final_strings = np.frombuffer(b''.join(final_strings), dtype='<i4').astype(np.int32)
+    arrays.string_offsets = np.zeros(len(arcs) + 1, dtype=np.int64)
+    np.cumsum(arcs[:, 4].astype(np.int64), out=arrays.string_offsets[1:])
+    arrays.strings = np.frombuffer(b''.join(strings), dtype='<i4').astype(np.int32)
+    arrays.SetArcs(np.array(narcs_list, dtype=np.int64), arcs[:, 0], arcs[:, 1],
+            arcs[:, 2], arcs[:, 3], arcs[:, 5])
+
+def ReadFstArrays(fp, arrays = None):
+    '''
+    read one fst(header and body) from fp to arrays, return FstArrays.
+    '''
+    header = FstHeader()
+    header.Read(fp)
+    if arrays is None:
+        arrays = FstArrays(header.ArcType())
+    arrays.arctype = header.ArcType()
+    arrays.start = header.Start()
+    if arrays.arctype in ARC_DTYPE:
+        ReadFixedArcs(fp, arrays, header.NumStates())
+    elif arrays.arctype == 'compactlattice44':
+        ReadCompactLatticeArcs(fp, arrays, header.NumStates())
+    else:
+        assert 'no this arc type' and False
+    return arrays
+
+def ReorderCsr(offsets, values, order):
+    '''
+    return offsets and values of CSR rows in order.
+    '''
+    lengths = np.diff(offsets)[order]
+    new_offsets = np.zeros(len(order) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=new_offsets[1:])
+    index = np.repeat(offsets[:-1][order] - new_offsets[:-1], lengths) + np.arange(new_offsets[-1])
+    return new_offsets, values[index]
+
+def CsrRows(statesinfo, states):
+    '''
+    return arc ids of states, in states order.
+    '''
+    info = statesinfo[states].astype(np.int64)
+    ends = np.cumsum(info[:, 1])
+    return np.repeat(info[:, 0] + info[:, 1] - ends, info[:, 1]) + np.arange(ends[-1] if len(ends) else 0)
+
+def KahnLevels(statesinfo, nextstate, num_states):
+    '''
+    Kahn topological levels of CSR arcs, statesinfo [num_states, 2] is (arc offset, arc number).
+    return levels [num_states] and level_arcs, level of the states in or after a cycle is -1,
+    level_arcs is [arc ids of level 0 states, arc ids of level 1 states, ...].
+    '''
+    num_arcs = int(statesinfo[:num_states, 1].sum())
+    nextstate = nextstate[:num_arcs]
+    indegree = np.bincount(nextstate, minlength=num_states)
+    levels = np.full(num_states, -1, dtype=np.int64)
+    frontier = np.flatnonzero(indegree == 0)
+    level_arcs = []
+    level = 0
+    while len(frontier) != 0:
+        levels[frontier] = level
+        arcs = CsrRows(statesinfo, frontier)
+        level_arcs.append(arcs)
+        level += 1
+        if len(arcs) == 0:
+            break
+        targets = np.sort(nextstate[arcs])
+        last = np.empty(len(targets), dtype=bool)
+        np.not_equal(targets[1:], targets[:-1], out=last[:-1])
+        last[-1] = True
+        ends = np.flatnonzero(last)
+        states = targets[ends]
+        indegree[states] -= np.diff(ends, prepend=-1)
+        frontier = states[indegree[states] == 0]
+    return levels, level_arcs
+
+def ConcatArrays(arrays_list):
+    '''
+    the fsts are one graph, state s of fst i is state_offsets[i] + s.
+    return state_offsets, statesinfo, src, nextstate, ilabel of the graph.
+    '''
+    num_states = [ arrays.NumStates() for arrays in arrays_list ]
+    num_arcs = [ arrays.NumArcs() for arrays in arrays_list ]
+    state_offsets = np.zeros(len(arrays_list) + 1, dtype=np.int64)
+    np.cumsum(num_states, out=state_offsets[1:])
+    arc_offsets = np.zeros(len(arrays_list) + 1, dtype=np.int64)
+    np.cumsum(num_arcs, out=arc_offsets[1:])
+    shift = np.repeat(state_offsets[:-1], num_arcs)
+    src = np.concatenate([ arrays.src for arrays in arrays_list ] + [[]]).astype(np.int64) + shift
+    nextstate = np.concatenate([ arrays.nextstate for arrays in arrays_list ] + [[]]).astype(np.int64) + shift
+    ilabel = np.concatenate([ arrays.ilabel for arrays in arrays_list ] + [[]]).astype(np.int64)
+    offsets = np.concatenate([ arrays.state_offsets[:-1] for arrays in arrays_list ] + [[]]).astype(np.int64)
+    offsets += np.repeat(arc_offsets[:-1], num_states)
+    narcs = np.concatenate([ np.diff(arrays.state_offsets) for arrays in arrays_list ] + [[]]).astype(np.int64)
+    return state_offsets, np.stack([offsets, narcs], axis=1), src, nextstate, ilabel
+
+def TopSortArraysList(arrays_list):
+    '''
+    Kahn topological sort of all the fsts together, so they share the levels,
+    the start state is the first state of level 0.
+    return [(order, acyclic), ...], order[s] is the new state id of s, it's None if the fst is cyclic.
+    '''
+    state_offsets, statesinfo, src, nextstate, ilabel = ConcatArrays(arrays_list)
+    num_states = int(state_offsets[-1])
+    levels, level_arcs = KahnLevels(statesinfo, nextstate, num_states)
+    fst_ids = np.repeat(np.arange(len(arrays_list)), np.diff(state_offsets))
+    cyclic = np.bincount(fst_ids, weights=levels < 0, minlength=len(arrays_list)) > 0
+    starts = state_offsets[:-1] + [ arrays.start for arrays in arrays_list ]
+    states = np.arange(num_states)
+    sorted_states = np.lexsort((states, states != starts[fst_ids], levels, fst_ids))
+    order = np.empty(num_states, dtype=np.int64)
+    order[sorted_states] = states
+    order -= state_offsets[fst_ids]
+    return [ (None, False) if cyclic[i] else (order[state_offsets[i]:state_offsets[i + 1]], True)
+            for i in range(len(arrays_list)) ]
+
+def TopSortArrays(arrays):
+    '''
+    return order and acyclic of one fst, see TopSortArraysList.
+    '''
+    return TopSortArraysList([arrays])[0]
+
+def StateSortArrays(arrays, order):
+    '''
+    the same as StateSort, state s is order[s] in the new FstArrays,
+    the columns are permuted, return new FstArrays.
+    '''
+    order = np.asarray(order, dtype=np.int64)
+    num_states = arrays.NumStates()
+    inv = np.empty(num_states, dtype=np.int64)
+    inv[order] = np.arange(num_states)
+    new = FstArrays(arrays.arctype)
+    new.start = int(order[arrays.start])
+    new.final_w1 = arrays.final_w1[inv]
+    new.final_w2 = arrays.final_w2[inv]
+    # arcs of new state n are the arcs of inv[n]
+    offsets, arc_ids = ReorderCsr(arrays.state_offsets, np.arange(arrays.NumArcs()), inv)
+    new.SetArcs(np.diff(offsets), arrays.ilabel[arc_ids], arrays.olabel[arc_ids],
+            arrays.w1[arc_ids], arrays.w2[arc_ids], order[arrays.nextstate[arc_ids]])
+    if arrays.strings is not None:
+        new.string_offsets, new.strings = ReorderCsr(arrays.string_offsets, arrays.strings, arc_ids)
+    if arrays.final_strings is not None:
+        new.final_string_offsets, new.final_strings = ReorderCsr(arrays.final_string_offsets,
+                arrays.final_strings, inv)
+    return new
+
+def LatticeStateTimesArraysList(arrays_list):
+    '''
+    the same as LatticeStateTimes of top sorted lattice arrays, start state is 0,
+    all the lattices are one graph, so they share the levels.
+    return [(max_time, times [num_states]), ...]
+    '''
+    state_offsets, statesinfo, src, nextstate, ilabel = ConcatArrays(arrays_list)
+    num_states = int(state_offsets[-1])
+    levels, level_arcs = KahnLevels(statesinfo, nextstate, num_states)
+    assert (levels >= 0).all() and 'lattice is cyclic'
+    times = np.full(num_states, -1, dtype=np.int64)
+    times[state_offsets[:-1][np.diff(state_offsets) > 0]] = 0
+    for arcs in level_arcs:
+        # the states which aren't reached from start state keep -1
+        arcs = arcs[times[src[arcs]] >= 0]
+        # input label 0 is epsilon, it's the same time
+        times[nextstate[arcs]] = times[src[arcs]] + (ilabel[arcs] != 0)
+    reached = times[src] >= 0
+    arc_times = times[src[reached]] + (ilabel[reached] != 0)
+    assert (times[nextstate[reached]] == arc_times).all() and 'lattice state times are inconsistent'
+    fst_ids = np.repeat(np.arange(len(arrays_list)), np.diff(state_offsets))
+    max_times = np.zeros(len(arrays_list), dtype=np.int64)
+    np.maximum.at(max_times, fst_ids, times)
+    return [ (int(max_times[i]), times[state_offsets[i]:state_offsets[i + 1]])
+            for i in range(len(arrays_list)) ]
+
+def LatticeStateTimesArrays(arrays):
+    '''
+    return max_time, times of one lattice, see LatticeStateTimesArraysList.
+    '''
+    return LatticeStateTimesArraysList([arrays])[0]
+
+def ExclusiveCumsum(values):
+    offsets = np.zeros(len(values) + 1, dtype=np.int64)
+    np.cumsum(values, out=offsets[1:])
+    return offsets
+
+def ConvertLatticeArrays(arrays):
+    '''
+    the same as ConvertLattice, compactlattice44 arrays to lattice4 arrays,
+    the string of an arc or a final weight is a chain of arcs through new states,
+    new states are numbered in the same order, return new FstArrays.
+    '''
+    if arrays.arctype != 'compactlattice44':
+        return arrays
+    num_states = arrays.NumStates()
+    num_arcs = arrays.NumArcs()
+    is_final = arrays.final_w1 + arrays.final_w2 != np.inf
+    final_len = np.where(is_final, np.diff(arrays.final_string_offsets), 0)
+    arc_len = np.diff(arrays.string_offsets)
+    # arc of string length n is n arcs (1 if it's epsilon), n - 1 new states
+    arc_chain = np.maximum(arc_len, 1)
+    arc_new = ExclusiveCumsum(arc_chain - 1)
+    # new states of state s: final string states, then new states of its arcs
+    state_new = final_len + arc_new[arrays.state_offsets[1:]] - arc_new[arrays.state_offsets[:-1]]
+    block = num_states + ExclusiveCumsum(state_new)
+
+    # final string chain
+    final_src = np.repeat(np.arange(num_states, dtype=np.int64), final_len)
+    j = np.arange(len(final_src)) - np.repeat(ExclusiveCumsum(final_len)[:-1], final_len)
+    final_base = block[final_src]
+    final_ilabel = arrays.final_strings[arrays.final_string_offsets[final_src] + j]
+    first = j == 0
+    final_w1 = np.where(first, arrays.final_w1[final_src], 0.0)
+    final_w2 = np.where(first, arrays.final_w2[final_src], 0.0)
+    final_nextstate = final_base + j
+    final_src = np.where(first, final_src, final_base + j - 1)
+
+    # arc string chain
+    arc_ids = np.repeat(np.arange(num_arcs, dtype=np.int64), arc_chain)
+    j = np.arange(len(arc_ids)) - np.repeat(ExclusiveCumsum(arc_chain)[:-1], arc_chain)
+    src = arrays.src[arc_ids].astype(np.int64)
+    base = block[src] + final_len[src] + arc_new[arc_ids] - arc_new[arrays.state_offsets[src]]
+    ilabel = np.zeros(len(arc_ids), dtype=np.int32)
+    has_string = arc_len[arc_ids] > 0
+    ilabel[has_string] = arrays.strings[arrays.string_offsets[arc_ids[has_string]] + j[has_string]]
+    first = j == 0
+    olabel = np.where(first, arrays.ilabel[arc_ids], 0)
+    w1 = np.where(first, arrays.w1[arc_ids], 0.0)
+    w2 = np.where(first, arrays.w2[arc_ids], 0.0)
+    last = j == arc_chain[arc_ids] - 1
+    nextstate = np.where(last, arrays.nextstate[arc_ids], base + j)
+    src = np.where(first, src, base + j - 1)
+
+    new_num_states = int(block[-1])
+    new = FstArrays('lattice4')
+    new.start = arrays.start
+    new.final_w1 = np.full(new_num_states, np.inf, dtype=np.float32)
+    new.final_w2 = np.full(new_num_states, np.inf, dtype=np.float32)
+    keep = is_final & (final_len == 0)
+    new.final_w1[:num_states][keep] = arrays.final_w1[keep]
+    new.final_w2[:num_states][keep] = arrays.final_w2[keep]
+    # the end of final string is final with One weight
+    chain_final = block[:-1][final_len > 0] + final_len[final_len > 0] - 1
+    new.final_w1[chain_final] = 0.0
+    new.final_w2[chain_final] = 0.0
+    # arcs of a state: final string arc first, then its arcs
+    all_src = np.concatenate([final_src, src])
+    order = np.argsort(all_src, kind='stable')
+    new.SetArcs(np.bincount(all_src, minlength=new_num_states),
+            np.concatenate([final_ilabel, ilabel])[order],
+            np.concatenate([np.zeros(len(final_src), dtype=np.int32), olabel])[order],
+            np.concatenate([final_w1, w1])[order],
+            np.concatenate([final_w2, w2])[order],
+            np.concatenate([final_nextstate, nextstate])[order])
+    return new
+
+def SuperFinalArrays(arrays):
+    '''
+    the same as SuperFinalFst, one final state with One weight,
+    return new FstArrays of standard or lattice4 arrays.
+    '''
+    final = arrays.final_w1 + arrays.final_w2
+    final_states = np.nonzero(final != np.inf)[0]
+    if len(final_states) == 1 and final[final_states[0]] == 0.0:
+        return arrays
+    one_states = final_states[final[final_states] == 0.0]
+    num_states = arrays.NumStates()
+    if len(one_states) != 0:
+        super_final = one_states[0]
+    else:
+        super_final = num_states
+        num_states += 1
+    final_states = final_states[final_states != super_final]
+    new = FstArrays(arrays.arctype)
+    new.start = arrays.start
+    new.final_w1 = np.full(num_states, np.inf, dtype=np.float32)
+    new.final_w2 = np.full(num_states, np.inf, dtype=np.float32)
+    if arrays.arctype == 'standard':
+        new.final_w2[:] = 0.0
+    new.final_w1[super_final] = 0.0
+    new.final_w2[super_final] = 0.0
+    # arcs to super final are after the arcs of the state
+    src = np.concatenate([arrays.src, final_states.astype(np.int32)])
+    order = np.argsort(src, kind='stable')
+    zeros = np.zeros(len(final_states), dtype=np.int32)
+    narcs = np.bincount(src, minlength=num_states)
+    new.SetArcs(narcs,
+            np.concatenate([arrays.ilabel, zeros])[order],
+            np.concatenate([arrays.olabel, zeros])[order],
+            np.concatenate([arrays.w1, arrays.final_w1[final_states]])[order],
+            np.concatenate([arrays.w2, arrays.final_w2[final_states]])[order],
+            np.concatenate([arrays.nextstate, np.full(len(final_states), super_final, dtype=np.int32)])[order])
+    return new
+
+def ConvertArraysToSparseMatrix(arrays):
+    '''
+    the same as ConvertFstToSparseMatrix,
+    return indexs, in_labels, weights, statesinfo, start_state, shape
+    '''
+    num_states = arrays.NumStates()
+    indexs = np.stack([arrays.src, arrays.nextstate], axis=1)
+    statesinfo = np.stack([arrays.state_offsets[:-1], np.diff(arrays.state_offsets)],
+            axis=1).astype(np.int32)
+    weights = arrays.w1 if arrays.arctype == 'standard' else arrays.w1 + arrays.w2
+    return indexs, arrays.ilabel, weights, statesinfo, arrays.start, [num_states, num_states]
+
+def SparseFstArrays(arrays):
+    '''
+    the same as SparseFst, return [indexs, in_labels, weights, statesinfo, num_states].
+    '''
+    indexs, in_labels, weights, statesinfo, start_state, shape = ConvertArraysToSparseMatrix(
+            SuperFinalArrays(arrays))
+    return [indexs, in_labels, weights, statesinfo, shape[0]]
+
+def SparseLatticeArrays(arrays):
+    '''
+    lattice4 which is top sorted and super final, the same as ConvertLatticeToSparseMatrix,
+    return indexs, pdf_values, lmweight_values, amweight_values, statesinfo, shape.
+    '''
+    assert arrays.arctype == 'lattice4' and arrays.start == 0
+    num_states = arrays.NumStates()
+    indexs = np.stack([arrays.src, arrays.nextstate], axis=1)
+    statesinfo = np.stack([arrays.state_offsets[:-1], np.diff(arrays.state_offsets)],
+            axis=1).astype(np.int32)
+    return indexs, arrays.ilabel, arrays.w1, arrays.w2, statesinfo, [num_states, num_states]
@@ -7,8 +7,10 @@ from fst.fst_ops import *
 
 from fst.lattice_functions import *
 from fst.convert_lattice_to_sparsematrix import *
+from fst.fst_reader import ReadFstArrays
 from io_func import smart_open
 from io_func.matio import read_token
+from io_func.file_pool import PoolOpen
 
 class Lattice(Fst, object):
     def __init__(self, key = None, wclass = Weight):
@@ -33,15 +35,25 @@ class Lattice(Fst, object):
             return None
         self._key, path_pos = scp_line.replace('\n','').split(' ')
         path, pos = path_pos.split(':')
-        latfp = smart_open(path, 'rb')
-        latfp.seek(int(pos),0)
-        Fst.Read(self, latfp)
-        latfp.close()
+        with PoolOpen(path) as latfp:
+            latfp.seek(int(pos),0)
+            Fst.Read(self, latfp)
         return self._key
 
     def SetKey(self, key):
         self._key = key
 
+def ReadLatticeArraysScp(scp_line):
+    '''
+    read lattice of scp line to FstArrays columns, return key and arrays.
+    '''
+    key, path_pos = scp_line.replace('\n','').split(' ')
+    path, pos = path_pos.split(':')
+    with PoolOpen(path) as latfp:
+        latfp.seek(int(pos),0)
+        arrays = ReadFstArrays(latfp)
+    return key, arrays
+
 def ConvertLattice(compactlat):
     '''
     convert compact lattice to fst lattice
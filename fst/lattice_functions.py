@@ -5,10 +5,14 @@ import math
 import sys
 sys.path.extend(["../","./"])
 from fst.fst_math import *
+from fst.fst_reader import FstArrays, LatticeStateTimesArrays, LatticeStateTimesArraysList
 
 def LatticeStateTimes(lat):
     # top sort lat
     # check top sort
+    if isinstance(lat, FstArrays):
+        lat.Flush()
+        return LatticeStateTimesArrays(lat)
     num_states = lat.NumStates()
     times = [ -1 for x in range(num_states) ]
     times[0] = 0
@@ -32,6 +36,23 @@ def LatticeStateTimes(lat):
 
     return max_time, times
 
+def LatticeStateTimesList(lat_list):
+    '''
+    LatticeStateTimes of every lattice, FstArrays of the list are processed together.
+    return [(max_time, times), ...]
+    '''
+    results = [ None for x in range(len(lat_list)) ]
+    arrays_ids = []
+    for i, lat in enumerate(lat_list):
+        if isinstance(lat, FstArrays):
+            lat.Flush()
+            arrays_ids.append(i)
+        else:
+            results[i] = LatticeStateTimes(lat)
+    for i, result in zip(arrays_ids, LatticeStateTimesArraysList([ lat_list[i] for i in arrays_ids ])):
+        results[i] = result
+    return results
+
 
 def LatticeForwardBackward(lat):
     acoustic_like_sum = 0.0
@@ -1,10 +1,18 @@
-
 import logging
 import sys
 import numpy as np
 sys.path.extend(["../","./"])
 from fst.lattice_functions import *
 from fst.posterior import *
+from fst.convert_lattice_to_sparsematrix import ConvertLatticeToSparseMatrix, ConvertLatticeFinalsToSparseMatrix
+from fst.sparse_lattice import SparseLatticeBatch
+
+'''
+cpu mmi and mpe(smbr, mpfe) loss, it's the same as fst/cc (tensorflow_py_api mmi and mpe),
+the lattices of a minibatch are processed together by SparseLatticeBatch.
+nnet_out is (times, sentences, dim) if time_major is True, else (sentences, times, dim).
+gradient is the same shape as nnet_out.
+'''
 
 def LatticeAcousticRescore(nnet_out, state_times, lat):
     # lat must be top sort and ilabel = pdf+1
@@ -21,49 +29,65 @@ def LatticeAcousticRescore(nnet_out, state_times, lat):
 
 def LatticeAcousticRescore3D(nnet_out, state_times, lat, sentence, time_major = True):
     # lat must be top sort and ilabel = pdf+1
+    arcs = []
+    times = []
+    pdfs = []
     for s in range(lat.NumStates()):
-        state = lat.GetState(s)
-        t = state_times[s]
-        for arc in state.GetArcs():
+        for arc in lat.GetState(s).GetArcs():
             if arc._ilabel != 0:
-                pdf = arc._ilabel - 1
-                if time_major is True:
-                    arc._weight._value2 -= nnet_out[t][sentence][pdf]
-                else:
-                    arc._weight._value2 -= nnet_out[sentence][t][pdf]
-
-def MMILoss2D(nnet_out, lat, ali, sentence, acoustic_scale, lm_scale, time_major = False):
-    max_time, state_times = LatticeStateTimes()
-    # rescore the latice
-    LatticeAcousticRescore3D(nnet_out, state_times, lat, sentence, time_major)
-    if acoustic_scale != 1.0 or lm_scale != 1.0:
-        ScaleLattice(lat, lm_scale, acoustic_scale)
-
-    # get the posteriors
-    tot_backward_prob, acoustic_like_sum, post = LatticeForwardBackward(lat)
-
-    # convert the Posterior to a matrix
-    d1, d2, d3 = np.shape(nnet_out)
+                arcs.append(arc)
+                times.append(state_times[s])
+                pdfs.append(arc._ilabel - 1)
+    # one gather of all the arcs
     if time_major is True:
-        nnet_diff_h = np.zeros(d1 * d3, dtype=np.float32).reshape(d1,d3)
+        like = nnet_out[times, sentence, pdfs]
     else:
-        nnet_diff_h = np.zeros(d2 * d3, dtype=np.float32).reshape(d2,d3)
-    
-    PosteriorToPdfMatrix(post, nnet_diff_h)
+        like = nnet_out[sentence, times, pdfs]
+    for arc, value in zip(arcs, like.tolist()):
+        arc._weight._value2 -= value
+
+def TimeMajor(nnet_out, time_major):
+    if time_major is True:
+        return nnet_out
+    return np.transpose(nnet_out, (1, 0, 2))
+
+def CheckNumFrames(lattices, sequence_length):
+    for b in range(lattices.batch_size):
+        assert lattices.max_times[b] == sequence_length[b] and 'lattice max time must be num frames'
+
+def NumPosterior(labels, sequence_length, num_frames, num_pdfs):
+    '''
+    numerator posterior of the alignment, labels is (sentences, times),
+    return (times, sentences, dim).
+    '''
+    num_post = np.zeros((num_frames, len(sequence_length), num_pdfs), dtype=np.float32)
+    for b, length in enumerate(sequence_length):
+        num_post[np.arange(length), b, labels[b][:length]] = 1.0
+    return num_post
+
+def MMIBatch(lattices, nnet_out, labels, sequence_length, acoustic_scale = 1.0, drop_frames = True):
+    '''
+    lattices : SparseLatticeBatch which is rescored.
+    nnet_out : (times, sentences, dim)
+    labels   : (sentences, times), it may be a list of alignments
+    return loss (sentences), it's den posterior on ali, and gradient (times, sentences, dim).
+    '''
+    num_frames, batch_size, num_pdfs = np.shape(nnet_out)
+    tot_backward_prob = lattices.ForwardBackward()
+    den_post = lattices.PdfMatrix(lattices.ArcPosterior(), num_frames, num_pdfs)
+    num_post = NumPosterior(labels, sequence_length, num_frames, num_pdfs)
+    # mask of the frames of every sentence
+    mask = np.arange(num_frames)[:, None] < np.asarray(sequence_length)[None, :]
+    ali = np.zeros((num_frames, batch_size), dtype=np.int64)
+    for b, length in enumerate(sequence_length):
+        ali[:length, b] = labels[b][:length]
+    frames = np.arange(num_frames)[:, None]
+    sentences = np.arange(batch_size)[None, :]
 
     # Calculate the MMI-objective function
     # Calculate the likelihood of correct path from acoustic score,
     # the denominator likelihood is the total likelihood of the lattice.
-    path_ac_like = 0.0
-    if time_major is True:
-        for t in range(len(ali)):
-            pdf = ali[t]
-            path_ac_like += nnet_out[t][sentence][pdf]
-    else:
-        for t in range(len(ali)):
-            pdf = ali[t]
-            path_ac_like += nnet_out[sentence][t][pdf]
-
+    path_ac_like = (nnet_out[frames, sentences, ali] * mask).sum(axis=0, dtype=np.float64)
     path_ac_like *= acoustic_scale
     mmi_obj = path_ac_like - tot_backward_prob
 
@@ -74,59 +98,152 @@ def MMILoss2D(nnet_out, lat, ali, sentence, acoustic_scale, lm_scale, time_major
     # so it does not change accross epochs.
 
     # Sum the den-posteriors under the correct path,
-    post_on_ali = 0.0
-    for t in range(len(ali)):
-        pdf = ali[t]
-        post_on_ali += nnet_diff_h[t][pdf]
-
-    # Report,
-    logging.info("Lattice #" + str(sentence) + " processed ("  )
-
-    logging.info("Utterance " + str(utt) + ": Average MMI obj. value = " +
-            str(mmi_obj/num_frames) + " over " + str(num_frames) + " frames." +
-            " (Avg. den-posterior on ali " + str(post_on_ali / num_frames) + ")")
-    
-    # Search for the frames with num/den mismatch,
-    frm_drop = 0
-    frm_drop_vec = []
-    for t in range(len(ali)):
-        pdf = ali[t]
-        posterior = nnet_diff_h[t][pdf]
-        if posterior < 1e-20:
-            frm_drop += 1
-            frm_drop_vec.append(t)
-
-    # 8. subtract the pdf-Viterbi-path
-    for t in range(len(ali)):
-        pdf = ali[t]
-        nnet_diff_h[t][pdf] -= 1.0
-
-
-    # 9. Drop mismatched frames from the training by zeroing the derivative,
-    if drop_frames is True:
-        for i in frm_drop_vec:
-            nnet_diff_h[i] = 0.0
-
-    # Report the frame dropping
-    if frm_drop > 0:
-
+    den_post_on_ali = den_post[frames, sentences, ali]
+    post_on_ali = (den_post_on_ali * mask).sum(axis=0, dtype=np.float64)
 
+    # Search for the frames with num/den mismatch,
+    frm_drop = (den_post_on_ali < 1e-20) & mask
 
+    # subtract the pdf-Viterbi-path
+    gradient = den_post - num_post
 
+    # Drop mismatched frames from the training by zeroing the derivative,
+    if drop_frames is True:
+        gradient[frm_drop] = 0.0
 
+    for b, length in enumerate(sequence_length):
+        # Report,
+        logging.info("Utterance " + str(b) + ": Average MMI obj. value = " +
+                str(mmi_obj[b] / length) + " over " + str(length) + " frames." +
+                " (Avg. den-posterior on ali " + str(post_on_ali[b] / length) + ")")
+    # Report the frame dropping
+    if frm_drop.any():
+        logging.info("Frames dropped (num/den mismatch) " + str(int(frm_drop.sum())) +
+                " of " + str(int(mask.sum())) + (" (dropped)" if drop_frames else " (not dropped)"))
+    return post_on_ali, gradient
+
+def MMILoss(nnet_out, sequence_length, labels,
+        indexs, pdf_values, lm_ws, am_ws, statesinfo, num_states,
+        old_acoustic_scale = 0.0, acoustic_scale = 1.0, drop_frames = True, time_major = True):
+    '''
+    the same as mmi of fst/cc, the lattices are the outputs of PackageLattice.
+    return loss (sentences) and gradient.
+    '''
+    nnet_out = TimeMajor(nnet_out, time_major)
+    lattices = SparseLatticeBatch(indexs, pdf_values, lm_ws, am_ws, statesinfo, num_states)
+    CheckNumFrames(lattices, sequence_length)
+    lattices.AcousticRescore(nnet_out, old_acoustic_scale, acoustic_scale)
+    loss, gradient = MMIBatch(lattices, nnet_out, labels, sequence_length,
+            acoustic_scale, drop_frames)
+    return loss, TimeMajor(gradient, time_major)
+
+def FrameAcc(lattices, labels, silence_phones, pdf_to_phone, one_silence_class, criterion):
+    '''
+    frame accuracy of every arc, the same as LatticeForwardBackwardMpeVariants of fst/cc.
+    pdf_to_phone : [pdf, phone] of every pdf.
+    '''
+    assert criterion == 'mpfe' or criterion == 'smbr'
+    pdf_to_phone = np.asarray(pdf_to_phone)
+    emitting = lattices.emitting
+    times = lattices.times[lattices.src[emitting]]
+    batch = lattices.batch[emitting]
+    pdf = lattices.pdf_values[emitting] - 1
+    ref_pdf = np.asarray(labels)[batch, times]
+    phone = pdf_to_phone[pdf, 1]
+    ref_phone = pdf_to_phone[ref_pdf, 1]
+    phone_is_sil = np.isin(phone, silence_phones)
+    ref_phone_is_sil = np.isin(ref_phone, silence_phones)
+    both_sil = phone_is_sil & ref_phone_is_sil
+    if criterion == 'smbr':
+        same = pdf == ref_pdf
+    else:
+        same = phone == ref_phone
+    if not one_silence_class: # old behavior
+        acc = same & ~phone_is_sil
+    else:
+        acc = same | both_sil
+    arc_acc = np.zeros(len(lattices.pdf_values))
+    arc_acc[emitting] = acc
+    return arc_acc
 
-def MMILoss3D(nnet_out, lat, time_major = False):
+def MPEBatch(lattices, nnet_out, labels, silence_phones, pdf_to_phone,
+        one_silence_class = True, criterion = 'smbr'):
+    '''
+    lattices : SparseLatticeBatch which is rescored.
+    return loss (sentences), it's frame accuracy, and gradient (times, sentences, dim).
+    '''
+    num_frames, batch_size, num_pdfs = np.shape(nnet_out)
+    lattices.ForwardBackward()
+    arc_acc = FrameAcc(lattices, labels, silence_phones, pdf_to_phone, one_silence_class, criterion)
+    utt_frame_acc = lattices.AccForwardBackward(arc_acc)
+    gradient = -lattices.PdfMatrix(lattices.AccPosterior(arc_acc), num_frames, num_pdfs)
+    return utt_frame_acc, gradient
+
+def MPELoss(nnet_out, sequence_length, labels,
+        indexs, pdf_values, lm_ws, am_ws, statesinfo, num_states,
+        silence_phones = [-1], pdf_to_phone = [[0, 0]],
+        one_silence_class = True, criterion = 'smbr',
+        old_acoustic_scale = 0.0, acoustic_scale = 1.0, time_major = True):
+    '''
+    the same as mpe of fst/cc, criterion is 'smbr' or 'mpfe'.
+    return loss (sentences) and gradient.
+    '''
+    nnet_out = TimeMajor(nnet_out, time_major)
+    lattices = SparseLatticeBatch(indexs, pdf_values, lm_ws, am_ws, statesinfo, num_states)
+    CheckNumFrames(lattices, sequence_length)
+    lattices.AcousticRescore(nnet_out, old_acoustic_scale, acoustic_scale)
+    loss, gradient = MPEBatch(lattices, nnet_out, labels, silence_phones, pdf_to_phone,
+            one_silence_class, criterion)
+    for b, num_frames in enumerate(sequence_length):
+        logging.info("Utterance " + str(b) + ": Average frame accuracy = " +
+                str(loss[b] / num_frames) + " over " + str(num_frames) + " frames.")
+    return loss, TimeMajor(gradient, time_major)
+
+def MMILoss3D(nnet_out, lat, ali, acoustic_scale = 1.0, lm_scale = 1.0,
+        time_major = False, drop_frames = True):
     '''
        nnet_out : it's numpy matrix if time_major is False (sentences, times, dim),else (times, sentences, dim)
-       lat      : lattice list
+       lat      : lattice list, top sort (ReadLatticeScp)
+       ali      : pdf alignment list of every sentence
        time_major: nnet_out major axis
+       return loss list and gradient, it's the same shape as nnet_out.
     '''
     if time_major is False:
         assert np.shape(nnet_out)[0] == len(lat)
     else:
         assert np.shape(nnet_out)[1] == len(lat)
-    
-    mmiloss = []
-    for loss in range(len(lat)):
-
-        
+    nnet_out = TimeMajor(nnet_out, time_major)
+    sparse = [ ConvertLatticeToSparseMatrix(x) + (ConvertLatticeFinalsToSparseMatrix(x),) for x in lat ]
+    max_arcs = max([ len(x[1]) for x in sparse ])
+    max_states = max([ x[5][0] for x in sparse ])
+    def Pad(i, length):
+        shape = (len(sparse), length) + np.shape(sparse[0][i])[1:]
+        values = np.zeros(shape, dtype=sparse[0][i].dtype)
+        for b, x in enumerate(sparse):
+            values[b, :len(x[i])] = x[i]
+        return values
+    lattices = SparseLatticeBatch(Pad(0, max_arcs), Pad(1, max_arcs), Pad(2, max_arcs),
+            Pad(3, max_arcs), Pad(4, max_states), [ x[5][0] for x in sparse ], Pad(6, max_states))
+    sequence_length = [ len(x) for x in ali ]
+    CheckNumFrames(lattices, sequence_length)
+    # rescore the latice, the old am weights are kept
+    lattices.AcousticRescore(nnet_out, 1.0, acoustic_scale)
+    lattices.ScaleLm(lm_scale)
+    loss, gradient = MMIBatch(lattices, nnet_out, ali, sequence_length,
+            acoustic_scale, drop_frames)
+    return loss, TimeMajor(gradient, time_major)
+
+def MMILoss2D(nnet_out, lat, ali, sentence, acoustic_scale, lm_scale,
+        time_major = False, drop_frames = True):
+    '''
+    mmi of one sentence of nnet_out, return loss and gradient (times, dim).
+    '''
+    if time_major is True:
+        nnet_out = nnet_out[:, sentence:sentence + 1]
+    else:
+        nnet_out = nnet_out[sentence:sentence + 1]
+    loss, gradient = MMILoss3D(nnet_out, [lat], [ali], acoustic_scale, lm_scale,
+            time_major, drop_frames)
+    if time_major is True:
+        return loss[0], gradient[:, 0]
+    return loss[0], gradient[0]
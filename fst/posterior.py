@@ -1,11 +1,10 @@
-
-
-def PosteriorToPdfMatrix(post, nnet_diff_h):
+def PosteriorToPdfMatrix(post, nnet_diff_h, offset = 1):
     '''
-    post is [ {pdf1:post2,pdf2:post2,...}, ... ]
+    post is [ {pdf1:post2,pdf2:post2,...}, ... ], pdf is ilabel of lattice,
+    posterior of pdf at time t is added to nnet_diff_h[t][pdf - offset].
     '''
     for t in range(len(post)):
-        for key in post.keys():
-            nnet_diff_h[t][k] = post[key]
+        for key, value in post[t].items():
+            nnet_diff_h[t][key - offset] += value
 
 
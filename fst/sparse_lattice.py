@@ -0,0 +1,357 @@
+from __future__ import print_function
+import logging
+import sys
+
+import numpy as np
+
+sys.path.extend(["../","./"])
+from fst.fst_math import *
+from fst.fst_reader import CsrRows, KahnLevels
+
+'''
+vectorized lattice functions over the sparse lattice of ConvertLatticeToSparseMatrix:
+indexs [arcs, 2] (state, nextstate), pdf_values, lmweight_values, amweight_values,
+statesinfo [states, 2] (arc offset, arc number), final_weights [states, 2] (lm, am) of
+ConvertLatticeFinalsToSparseMatrix, it's inf if state isn't final. without final_weights
+the lattice is super final like fst/cc, the states without arcs are final and final weight is One.
+lattice is processed by topological levels, a level is the states whose
+predecessors are all in lower levels, so every level is a few numpy operations.
+lattices of a minibatch are one graph, so they share the levels.
+'''
+
+def LevelSegments(keys, levels, num_levels):
+    '''
+    keys and levels of arcs, arcs are sorted by (level, key).
+    return order, level bounds of order, segment starts of the same (level, key)
+    and segment bounds of every level.
+    '''
+    order = np.lexsort((keys, levels))
+    sorted_levels = levels[order]
+    sorted_keys = keys[order]
+    bounds = np.searchsorted(sorted_levels, np.arange(num_levels + 1))
+    change = np.r_[True, (sorted_keys[1:] != sorted_keys[:-1]) | (sorted_levels[1:] != sorted_levels[:-1])]
+    seg_starts = np.flatnonzero(change)
+    seg_bounds = np.searchsorted(seg_starts, bounds)
+    return order, bounds, seg_starts, seg_bounds
+
+def SparseLatticeLevels(indexs, pdf_values, statesinfo, num_states):
+    '''
+    Kahn topological levels and state times,
+    return levels [num_states], times [num_states], level_arcs.
+    level_arcs is [arc ids of level 0 states, arc ids of level 1 states, ...].
+    '''
+    num_arcs = int(statesinfo[:num_states, 1].sum())
+    nextstate = indexs[:num_arcs, 1]
+    levels, level_arcs = KahnLevels(statesinfo, nextstate, num_states)
+    assert (levels >= 0).all() and 'lattice is cyclic'
+    times = np.full(num_states, -1, dtype=np.int64)
+    times[levels == 0] = 0
+    for arcs in level_arcs:
+        # input label 0 is epsilon, it's the same time
+        times[nextstate[arcs]] = times[indexs[arcs, 0]] + (pdf_values[arcs] != 0)
+    arc_times = times[indexs[:num_arcs, 0]] + (pdf_values[:num_arcs] != 0)
+    assert (times[nextstate] == arc_times).all() and 'lattice state times are inconsistent'
+    return levels, times, level_arcs
+
+class SparseLatticeBatch(object):
+    '''
+    lattices of PackageLattice (padded indexs, pdf_values, lmweight_values, amweight_values,
+    statesinfo [B, ...] and num_states [B]) are flattened to one graph,
+    state s of lattice b is state_offsets[b] + s, so the levels of all the lattices are
+    processed together. lattices are top sorted, ilabel is pdf+1.
+    final_weights [B, states, 2] is padded like statesinfo, None is super final.
+    '''
+    def __init__(self, indexs, pdf_values, lmweight_values, amweight_values, statesinfo, num_states,
+            final_weights = None):
+        num_states = np.asarray(num_states, dtype=np.int64)
+        statesinfo = np.asarray(statesinfo)
+        indexs = np.asarray(indexs)
+        self.batch_size = len(num_states)
+        state_mask = np.arange(statesinfo.shape[1]) < num_states[:, None]
+        num_arcs = np.where(state_mask, statesinfo[:, :, 1], 0).sum(axis=1)
+        arc_mask = np.arange(indexs.shape[1]) < num_arcs[:, None]
+        self.state_offsets = np.zeros(self.batch_size + 1, dtype=np.int64)
+        np.cumsum(num_states, out=self.state_offsets[1:])
+        arc_offsets = np.zeros(self.batch_size + 1, dtype=np.int64)
+        np.cumsum(num_arcs, out=arc_offsets[1:])
+        # lattice of arcs
+        self.batch = np.nonzero(arc_mask)[0]
+        shift = self.state_offsets[self.batch]
+        self.src = indexs[:, :, 0][arc_mask] + shift
+        self.nextstate = indexs[:, :, 1][arc_mask] + shift
+        self.pdf_values = np.asarray(pdf_values)[arc_mask]
+        self.lmweight_values = np.asarray(lmweight_values)[arc_mask].astype(np.float64)
+        self.amweight_values = np.asarray(amweight_values)[arc_mask].astype(np.float64)
+        self.statesinfo = statesinfo[state_mask].astype(np.int64)
+        self.statesinfo[:, 0] += arc_offsets[np.nonzero(state_mask)[0]]
+        self.num_states = int(self.state_offsets[-1])
+        self.emitting = self.pdf_values != 0
+
+        self.levels, self.times, level_arcs = SparseLatticeLevels(
+                np.stack([self.src, self.nextstate], axis=1), self.pdf_values,
+                self.statesinfo, self.num_states)
+        self.num_levels = len(level_arcs)
+        if final_weights is None:
+            # super final, it's the same as IsFinal of fst/cc
+            self.final_states = np.flatnonzero(self.statesinfo[:, 1] == 0)
+            self.final_lmweight_values = np.zeros(len(self.final_states))
+            self.final_amweight_values = np.zeros(len(self.final_states))
+        else:
+            final_weights = np.asarray(final_weights)[state_mask].astype(np.float64)
+            self.final_states = np.flatnonzero(final_weights.sum(axis=1) != np.inf)
+            self.final_lmweight_values = final_weights[self.final_states, 0]
+            self.final_amweight_values = final_weights[self.final_states, 1]
+        # final states are sorted, so they are grouped by lattice
+        final_bounds = np.searchsorted(self.final_states, self.state_offsets)
+        assert (np.diff(final_bounds) > 0).all() and 'lattice has no final state'
+        self.final_starts = final_bounds[:-1]
+        self.final_batch = np.repeat(np.arange(self.batch_size), np.diff(final_bounds))
+        final_times = self.times[self.final_states]
+        self.max_times = np.maximum.reduceat(final_times, self.final_starts)
+        assert (np.minimum.reduceat(final_times, self.final_starts) == self.max_times).all() and \
+                'Lattice is inconsistent (final-prob not at max_time)'
+        self.forward_segments = None
+        self.backward_segments = None
+        self.alpha = None
+        self.beta = None
+        self.tot_forward_prob = None
+        self.alpha_acc = None
+        self.beta_acc = None
+        self.tot_forward_score = None
+
+    def ArcTimes(self):
+        return self.times[self.src]
+
+    def AcousticRescore(self, nnet_out, old_acoustic_scale = 1.0, acoustic_scale = 1.0):
+        '''
+        the same as LatticeAcousticRescore of MMILoss in fst/cc,
+        nnet_out [T, B, D] is time major, arc of pdf at time t is rescored by nnet_out[t, b, pdf].
+        '''
+        assert np.shape(nnet_out)[1] == self.batch_size
+        assert (self.max_times <= np.shape(nnet_out)[0]).all()
+        if old_acoustic_scale != 1.0:
+            self.amweight_values *= old_acoustic_scale
+            self.final_amweight_values *= old_acoustic_scale
+        emitting = self.emitting
+        self.amweight_values[emitting] -= nnet_out[self.times[self.src[emitting]],
+                self.batch[emitting], self.pdf_values[emitting] - 1]
+        if acoustic_scale != 1.0:
+            self.amweight_values *= acoustic_scale
+            self.final_amweight_values *= acoustic_scale
+
+    def ScaleLm(self, lm_scale):
+        self.lmweight_values *= lm_scale
+        self.final_lmweight_values *= lm_scale
+
+    def ArcLike(self):
+        return -(self.lmweight_values + self.amweight_values)
+
+    def FinalLike(self):
+        return -(self.final_lmweight_values + self.final_amweight_values)
+
+    def ForwardSegments(self):
+        # arcs of a level are grouped by nextstate
+        if self.forward_segments is None:
+            order, bounds, seg_starts, seg_bounds = LevelSegments(self.nextstate,
+                    self.levels[self.src], self.num_levels)
+            self.forward_segments = (order, bounds, seg_starts, seg_bounds,
+                    self.nextstate[order][seg_starts])
+        return self.forward_segments
+
+    def BackwardSegments(self):
+        # arcs of a level are grouped by state
+        if self.backward_segments is None:
+            order, bounds, seg_starts, seg_bounds = LevelSegments(self.src,
+                    self.levels[self.src], self.num_levels)
+            self.backward_segments = (order, bounds, seg_starts, seg_bounds,
+                    self.src[order][seg_starts])
+        return self.backward_segments
+
+    def ForwardBackward(self):
+        '''
+        alpha and beta of all the lattices, return tot_backward_prob [B].
+        '''
+        arc_like = self.ArcLike()
+        alpha = np.full(self.num_states, kLogZero)
+        # start state is 0
+        alpha[self.state_offsets[:-1]] = 0.0
+        order, bounds, seg_starts, seg_bounds, seg_states = self.ForwardSegments()
+        order_src = self.src[order]
+        order_like = arc_like[order]
+        for level in range(self.num_levels):
+            start, end = bounds[level], bounds[level + 1]
+            if start == end:
+                continue
+            segs = slice(seg_bounds[level], seg_bounds[level + 1])
+            like = np.logaddexp.reduceat(alpha[order_src[start:end]] + order_like[start:end],
+                    seg_starts[segs] - start)
+            states = seg_states[segs]
+            alpha[states] = np.logaddexp(alpha[states], like)
+        final_like = self.FinalLike()
+        tot_forward_prob = np.logaddexp.reduceat(alpha[self.final_states] + final_like, self.final_starts)
+
+        beta = np.full(self.num_states, kLogZero)
+        beta[self.final_states] = final_like
+        order, bounds, seg_starts, seg_bounds, seg_states = self.BackwardSegments()
+        order_next = self.nextstate[order]
+        order_like = arc_like[order]
+        for level in range(self.num_levels - 1, -1, -1):
+            start, end = bounds[level], bounds[level + 1]
+            if start == end:
+                continue
+            segs = slice(seg_bounds[level], seg_bounds[level + 1])
+            states = seg_states[segs]
+            # final state may have arcs
+            beta[states] = np.logaddexp(beta[states], np.logaddexp.reduceat(
+                beta[order_next[start:end]] + order_like[start:end], seg_starts[segs] - start))
+        tot_backward_prob = beta[self.state_offsets[:-1]]
+        for b in np.flatnonzero(np.abs(tot_forward_prob - tot_backward_prob) > 1e-8):
+            logging.info('Lattice %d total forward probability over lattice = %f, while total backward probability = %f' % (b, tot_forward_prob[b], tot_backward_prob[b]))
+        self.alpha = alpha
+        self.beta = beta
+        self.tot_forward_prob = tot_forward_prob
+        return tot_backward_prob
+
+    def AccForwardBackward(self, arc_acc):
+        '''
+        the second pass of LatticeForwardBackwardMpeVariants in fst/cc,
+        forward and backward of the expected accuracy, arc_acc is the frame accuracy of arcs.
+        ForwardBackward must be called before, return tot_forward_score [B],
+        alpha_acc and beta_acc are kept for AccPosterior.
+        '''
+        arc_like = self.ArcLike()
+        alpha, beta = self.alpha, self.beta
+        alpha_acc = np.zeros(self.num_states)
+        order, bounds, seg_starts, seg_bounds, seg_states = self.ForwardSegments()
+        order_src = self.src[order]
+        with np.errstate(invalid='ignore'):
+            order_scale = np.exp(alpha[order_src] + arc_like[order] - alpha[self.nextstate[order]])
+        # states which aren't reachable from the start state
+        order_scale[np.isnan(order_scale)] = 0.0
+        order_acc = arc_acc[order]
+        for level in range(self.num_levels):
+            start, end = bounds[level], bounds[level + 1]
+            if start == end:
+                continue
+            segs = slice(seg_bounds[level], seg_bounds[level + 1])
+            alpha_acc[seg_states[segs]] += np.add.reduceat(order_scale[start:end] *
+                    (alpha_acc[order_src[start:end]] + order_acc[start:end]), seg_starts[segs] - start)
+        final_scale = np.exp(alpha[self.final_states] + self.FinalLike()
+                - self.tot_forward_prob[self.final_batch])
+        tot_forward_score = np.add.reduceat(final_scale * alpha_acc[self.final_states], self.final_starts)
+
+        beta_acc = np.zeros(self.num_states)
+        order, bounds, seg_starts, seg_bounds, seg_states = self.BackwardSegments()
+        order_next = self.nextstate[order]
+        with np.errstate(invalid='ignore'):
+            order_scale = np.exp(beta[order_next] + arc_like[order] - beta[self.src[order]])
+        # this is to prevent partial paths in lattices,
+        # i.e., paths don't survive to the final state
+        order_scale[np.isnan(order_scale)] = 0.0
+        order_acc = arc_acc[order]
+        for level in range(self.num_levels - 1, -1, -1):
+            start, end = bounds[level], bounds[level + 1]
+            if start == end:
+                continue
+            segs = slice(seg_bounds[level], seg_bounds[level + 1])
+            beta_acc[seg_states[segs]] = np.add.reduceat(order_scale[start:end] *
+                    (beta_acc[order_next[start:end]] + order_acc[start:end]), seg_starts[segs] - start)
+        tot_backward_score = beta_acc[self.state_offsets[:-1]]
+        for b in np.flatnonzero(np.abs(tot_forward_score - tot_backward_score) > 1e-4):
+            logging.info('Lattice %d total forward score over lattice = %f, while total backward score = %f' % (b, tot_forward_score[b], tot_backward_score[b]))
+        self.alpha_acc = alpha_acc
+        self.beta_acc = beta_acc
+        self.tot_forward_score = tot_forward_score
+        return tot_forward_score
+
+    def AccPosterior(self, arc_acc):
+        '''
+        posterior of arcs times the accuracy difference (the MPE posterior),
+        AccForwardBackward must be called before.
+        '''
+        acc_diff = (self.alpha_acc[self.src] + arc_acc + self.beta_acc[self.nextstate]
+                - self.tot_forward_score[self.batch])
+        return self.ArcPosterior() * acc_diff
+
+    def ArcPosterior(self):
+        '''
+        posterior of every arc, ForwardBackward must be called before.
+        '''
+        return np.exp(self.alpha[self.src] + self.ArcLike() + self.beta[self.nextstate]
+                - self.tot_forward_prob[self.batch])
+
+    def FinalPosterior(self):
+        return np.exp(self.alpha[self.final_states] + self.FinalLike()
+                - self.tot_forward_prob[self.final_batch])
+
+    def AcousticLikeSum(self, posterior):
+        emitting = self.emitting
+        return -(np.bincount(self.batch[emitting],
+                weights = posterior[emitting] * self.amweight_values[emitting],
+                minlength = self.batch_size) +
+            np.bincount(self.final_batch, weights = self.FinalPosterior() * self.final_amweight_values,
+                minlength = self.batch_size))
+
+    def PdfMatrix(self, values, num_frames, num_pdfs, offset = 1, dtype = np.float32):
+        '''
+        sum values of emitting arcs to [num_frames, B, num_pdfs] matrix,
+        value of pdf arc at time t is added to [t, b, pdf - offset].
+        '''
+        emitting = self.emitting
+        keys = ((self.times[self.src[emitting]] * self.batch_size + self.batch[emitting])
+                * num_pdfs + self.pdf_values[emitting] - offset)
+        order = np.argsort(keys, kind='stable')
+        keys = keys[order]
+        starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+        matrix = np.zeros((num_frames, self.batch_size, num_pdfs), dtype=dtype)
+        if len(keys) != 0:
+            # sum in float64, the same as posterior of LatticeForwardBackward
+            matrix.flat[keys[starts]] = np.add.reduceat(values[emitting][order], starts)
+        return matrix
+
+def BatchLatticeForwardBackward(indexs, pdf_values, lmweight_values, amweight_values,
+        statesinfo, num_states, nnet_out = None, old_acoustic_scale = 1.0, acoustic_scale = 1.0,
+        final_weights = None):
+    '''
+    forward-backward of all the lattices of PackageLattice together.
+    nnet_out [T, B, D]: rescore the lattices like MMILoss of fst/cc, None keep the am weights.
+    return tot_backward_prob [B], acoustic_like_sum [B], post [T, B, D] float32,
+    post[t, b, pdf] is posterior of arcs which ilabel is pdf+1.
+    '''
+    lattices = SparseLatticeBatch(indexs, pdf_values, lmweight_values, amweight_values,
+            statesinfo, num_states, final_weights)
+    if nnet_out is not None:
+        lattices.AcousticRescore(nnet_out, old_acoustic_scale, acoustic_scale)
+        num_frames, num_pdfs = np.shape(nnet_out)[0], np.shape(nnet_out)[2]
+    else:
+        num_frames = int(lattices.max_times.max())
+        num_pdfs = int(lattices.pdf_values.max()) if len(lattices.pdf_values) else 1
+    tot_backward_prob = lattices.ForwardBackward()
+    posterior = lattices.ArcPosterior()
+    acoustic_like_sum = lattices.AcousticLikeSum(posterior)
+    post = lattices.PdfMatrix(posterior, num_frames, num_pdfs)
+    return tot_backward_prob, acoustic_like_sum, post
+
+def SparseLatticeForwardBackward(indexs, pdf_values, lmweight_values, amweight_values,
+        statesinfo, num_states, num_pdfs = None, final_weights = None):
+    '''
+    the same as LatticeForwardBackward, it's the lattice of ConvertLatticeToSparseMatrix
+    and final_weights of ConvertLatticeFinalsToSparseMatrix, None is super final.
+    return tot_backward_prob, acoustic_like_sum, post [max_time, num_pdfs],
+    post[t, pdf] is posterior of arcs which input label is pdf.
+    every level is a few numpy calls, so one lattice of many frames and few arcs
+    (e.g. test.lat.ark) is slower than LatticeForwardBackward, which is still used.
+    '''
+    num_arcs = int(statesinfo[:num_states, 1].sum())
+    if final_weights is not None:
+        final_weights = np.asarray(final_weights)[None, :num_states]
+    lattices = SparseLatticeBatch(indexs[None, :num_arcs], pdf_values[None, :num_arcs],
+            lmweight_values[None, :num_arcs], amweight_values[None, :num_arcs],
+            statesinfo[None, :num_states], [num_states], final_weights)
+    tot_backward_prob = lattices.ForwardBackward()
+    posterior = lattices.ArcPosterior()
+    if num_pdfs is None:
+        num_pdfs = int(lattices.pdf_values.max()) + 1 if num_arcs > 0 else 1
+    post = lattices.PdfMatrix(posterior, int(lattices.max_times[0]), num_pdfs,
+            offset = 0, dtype = np.float64)
+    return tot_backward_prob[0], lattices.AcousticLikeSum(posterior)[0], post[:, 0]
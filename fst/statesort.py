@@ -3,6 +3,7 @@ import logging
 import sys
 sys.path.extend(["../","./"])
 from fst.fst_base import *
+from fst.fst_reader import FstArrays, StateSortArrays
 
 def StateSort(fst, order):
     if len(order) != fst.NumStates():
@@ -11,6 +12,11 @@ def StateSort(fst, order):
 
     if fst.Start() == kNoStateId:
         return
+    if isinstance(fst, FstArrays):
+        # permute the columns, no State is moved
+        fst.Flush()
+        fst.Assign(StateSortArrays(fst, order))
+        return
     done = [ False for x in range(len(order))]
     arcsa = []
     arcsb = []
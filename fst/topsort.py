@@ -3,6 +3,7 @@ sys.path.extend(["../","./"])
 from fst.dfs_visit import DfsVisit
 from fst.statesort import StateSort
 from fst.fst_base import *
+from fst.fst_reader import FstArrays, TopSortArrays, TopSortArraysList
 
 class TopOrderVisitor(object):
     def __init__(self, order, acyclic):
@@ -36,6 +37,13 @@ class TopOrderVisitor(object):
         self._order = tmp_order
 
 def TopSort(fst):
+    if isinstance(fst, FstArrays):
+        # Kahn over the arc columns
+        fst.Flush()
+        order, acyclic = TopSortArrays(fst)
+        if acyclic:
+            StateSort(fst, order)
+        return acyclic
     top_order_visitor = TopOrderVisitor(list(), acyclic = True)
     DfsVisit(fst, top_order_visitor)
 
@@ -44,4 +52,22 @@ def TopSort(fst):
 
     return top_order_visitor._acyclic
 
-
+def TopSortList(fst_list):
+    '''
+    TopSort of every fst, FstArrays of the list are sorted together,
+    they share the Kahn levels. return acyclic list.
+    '''
+    acyclic = [ None for x in range(len(fst_list)) ]
+    arrays_ids = []
+    for i, fst in enumerate(fst_list):
+        if isinstance(fst, FstArrays):
+            fst.Flush()
+            arrays_ids.append(i)
+        else:
+            acyclic[i] = TopSort(fst)
+    results = TopSortArraysList([ fst_list[i] for i in arrays_ids ])
+    for i, (order, fst_acyclic) in zip(arrays_ids, results):
+        if fst_acyclic:
+            StateSort(fst_list[i], order)
+        acyclic[i] = fst_acyclic
+    return acyclic
@@ -54,37 +54,34 @@ def make_context(feature, left, right):
     '''
     if left==0 and right == 0:
         return feature
-    feature = [feature]
-    for i in range(left):
-        feature.append(numpy.vstack((feature[-1][0], feature[-1][:-1])))
-    feature.reverse()
-    for i in range(right):
-        feature.append(numpy.vstack((feature[-1][1:], feature[-1][-1])))
-    return numpy.hstack(feature)
+    # edge pad once, row t of windows is padded[t : t + left + right + 1]
+    padded = numpy.pad(feature, ((left, right), (0, 0)), mode='edge')
+    frames, dim = feature.shape
+    windows = numpy.lib.stride_tricks.as_strided(padded,
+            shape=(frames, left + right + 1, dim),
+            strides=(padded.strides[0], padded.strides[0], padded.strides[1]))
+    return windows.reshape(frames, (left + right + 1) * dim)
 
 def skip_frame(feature, skip, offset = 0):
     '''
+    return frames offset, offset + skip, ..., it's a view of feature.
     '''
     if skip == 1 or skip == 0:
         return feature
-    skip_feature=[]
-    for i in range(feature.shape[0]):
-        if i % skip == offset:
-            skip_feature.append(feature[i])
-
-    return numpy.vstack(skip_feature)
+    assert 0 <= offset < skip
+    return feature[offset::skip]
 
 # block_num = (feature_dim - block_size)/block_skip + 1
 # block_size = 8
 def grid_block(feature, block_size, block_skip=1):
     block_num = int((feature.shape[-1] - block_size) / block_skip) + 1
-    block_feat = []
-    for i in range(feature.shape[0]):
-        one_block = []
-        for b in range(0, block_num, block_skip):
-            one_block.append(feature[i][b : b+block_size])
-        block_feat.append(numpy.hstack(one_block))
-    return numpy.vstack(block_feat)
+    # all blocks of a frame are windows[i][b] = feature[i][b : b+block_size]
+    frames, dim = feature.shape
+    windows = numpy.lib.stride_tricks.as_strided(feature,
+            shape=(frames, dim - block_size + 1, block_size),
+            strides=(feature.strides[0], feature.strides[1], feature.strides[1]))
+    block_feat = windows[:, 0:block_num:block_skip]
+    return block_feat.reshape(frames, -1)
 
 def nstream_feature(kaldireader, num_streams):
     nfeature = []
@@ -0,0 +1,133 @@
+import os
+import sys
+import logging
+
+import numpy
+
+sys.path.extend(["../","./"])
+from io_func import smart_open
+
+'''
+binary cache of text alignment file.
+    ali_file.cache.data.npy  : int32 all alignment concatenate
+    ali_file.cache.index.npy : int64 [[offset, length], ...]
+    ali_file.cache.keys      : utt_id per line, the same order as index
+    ali_file.cache.meta      : ali_file size and mtime, check cache is valid
+'''
+
+def AlignmentCachePrefix(ali_file):
+    return ali_file + '.cache'
+
+def AliFileStat(ali_file):
+    st = os.stat(ali_file)
+    return '%d %d' % (st.st_size, int(st.st_mtime))
+
+def AlignmentCacheValid(ali_file, prefix = None):
+    if prefix is None:
+        prefix = AlignmentCachePrefix(ali_file)
+    for ext in ('.data.npy', '.index.npy', '.keys', '.meta'):
+        if not os.path.exists(prefix + ext):
+            return False
+    with open(prefix + '.meta', 'r') as meta_fp:
+        meta = meta_fp.read().strip()
+    return meta == AliFileStat(ali_file)
+
+def BuildAlignmentCache(ali_file, prefix = None):
+    '''
+    convert text alignment to binary cache, it's done once.
+    '''
+    if prefix is None:
+        prefix = AlignmentCachePrefix(ali_file)
+    stat = AliFileStat(ali_file)
+    keys = []
+    index = []
+    data = []
+    offset = 0
+    f_read = smart_open(ali_file, 'r')
+    for line in f_read:
+        line = line.replace('\n','').strip()
+        if len(line) < 1: # this is an empty line, skip
+            continue
+        [utt_id, utt_ali] = line.split(' ', 1)
+        # this utterance has empty alignment, skip
+        if len(utt_ali) < 1:
+            continue
+        ali = numpy.fromstring(utt_ali, dtype=numpy.int32, sep=' ')
+        keys.append(utt_id)
+        index.append([offset, len(ali)])
+        data.append(ali)
+        offset += len(ali)
+    f_read.close()
+
+    if len(data) == 0:
+        data = numpy.zeros(0, dtype=numpy.int32)
+    else:
+        data = numpy.concatenate(data)
+    index = numpy.array(index, dtype=numpy.int64).reshape(-1, 2)
+    # write tmp file and rename, other process never read half cache.
+    tmp = prefix + '.tmp.%d' % os.getpid()
+    numpy.save(tmp + '.data.npy', data)
+    numpy.save(tmp + '.index.npy', index)
+    with open(tmp + '.keys', 'w') as keys_fp:
+        keys_fp.write('\n'.join(keys) + '\n')
+    with open(tmp + '.meta', 'w') as meta_fp:
+        meta_fp.write(stat + '\n')
+    # meta is the last, it makes cache valid
+    for ext in ('.data.npy', '.index.npy', '.keys', '.meta'):
+        os.rename(tmp + ext, prefix + ext)
+    logging.info('build alignment cache %s, %d utterances, %d frames' %
+            (prefix, len(keys), len(data)))
+    return prefix
+
+class AlignmentCache(object):
+    '''
+    dict like alignment, alignment is mmap and read when it's used.
+    ali[utt_id] return int32 numpy view, KeyError if no alignment.
+    '''
+    def __init__(self, prefix):
+        self.prefix = prefix
+        self.data = None
+        self.index = None
+        self.key_to_id = None
+
+    def Load(self):
+        if self.data is not None:
+            return
+        self.data = numpy.load(self.prefix + '.data.npy', mmap_mode='r')
+        self.index = numpy.load(self.prefix + '.index.npy')
+        key_to_id = {}
+        with open(self.prefix + '.keys', 'r') as keys_fp:
+            for i, line in enumerate(keys_fp):
+                key_to_id[line.rstrip('\n')] = i
+        self.key_to_id = key_to_id
+
+    def __getitem__(self, utt_id):
+        self.Load()
+        offset, length = self.index[self.key_to_id[utt_id]]
+        return self.data[offset : offset + length].view(numpy.ndarray)
+
+    def __contains__(self, utt_id):
+        self.Load()
+        return utt_id in self.key_to_id
+
+    def __len__(self):
+        self.Load()
+        return len(self.key_to_id)
+
+    def keys(self):
+        self.Load()
+        return self.key_to_id.keys()
+
+def LoadAlignment(ali_file):
+    '''
+    return AlignmentCache of ali_file, build cache if it's not valid.
+    return None if cache can't be written.
+    '''
+    prefix = AlignmentCachePrefix(ali_file)
+    try:
+        if not AlignmentCacheValid(ali_file, prefix):
+            BuildAlignmentCache(ali_file, prefix)
+    except (IOError, OSError) as e:
+        logging.info('alignment cache %s can\'t be used: %s' % (prefix, str(e)))
+        return None
+    return AlignmentCache(prefix)
@@ -0,0 +1,84 @@
+import sys
+import logging
+import collections
+
+import numpy
+
+sys.path.extend(["../","./"])
+from feat_process.feature_transform import SkipLength
+
+class BatchAssembler(object):
+    '''
+    assemble utterances of one package into one zero padded time major
+    [max_frames, batch, dim] float32 array, every utterance is copied
+    (or transformed) directly into its stream column.
+    use_pool  :reuse the array of the same shape, the batch must be copied
+               (shared memory transport) before the next one is assembled.
+    pool_size :max number of shapes kept in pool.
+    '''
+    def __init__(self, use_pool = False, pool_size = 8):
+        self.use_pool = use_pool
+        self.pool_size = pool_size
+        # self.pool = { shape: array }, order is LRU -> MRU
+        self.pool = collections.OrderedDict()
+
+    def Allocate(self, max_frames, batch, dim):
+        '''
+        return [max_frames, batch, dim] float32 array,
+        pool array isn't zero, the caller zero fills padding.
+        '''
+        shape = (max_frames, batch, dim)
+        if not self.use_pool:
+            return numpy.zeros(shape, dtype=numpy.float32)
+        array = self.pool.pop(shape, None)
+        if array is None:
+            array = numpy.empty(shape, dtype=numpy.float32)
+            if len(self.pool) >= self.pool_size:
+                self.pool.popitem(last = False)
+        self.pool[shape] = array
+        return array
+
+    def BatchFrames(self, length, round_frames = 1, head_frames = 0, tail_frames = 0):
+        max_frames = max(length)
+        if max_frames % round_frames != 0:
+            max_frames = round_frames * (int(max_frames / round_frames) + 1)
+        return max_frames + head_frames + tail_frames
+
+    def FillHeadTail(self, feat, head_frames, tail_frames):
+        '''
+        repeat the first and the last padded frame, it's tdnn context.
+        '''
+        if head_frames > 0:
+            feat[:head_frames] = feat[head_frames]
+        if tail_frames > 0:
+            feat[len(feat) - tail_frames:] = feat[len(feat) - tail_frames - 1]
+
+    def Assemble(self, mats, round_frames = 1, head_frames = 0, tail_frames = 0):
+        '''
+        mats: [[frames, dim], ...] of one package.
+        round_frames: max frames is rounded up to multiple of round_frames.
+        head_frames, tail_frames: repeat the first and last frame.
+        return feat [max_frames, batch, dim] and length.
+        '''
+        length = [ len(mat) for mat in mats ]
+        max_frames = self.BatchFrames(length, round_frames, head_frames, tail_frames)
+        feat = self.Allocate(max_frames, len(mats), numpy.shape(mats[0])[1])
+        for b, mat in enumerate(mats):
+            feat[head_frames : head_frames + length[b], b, :] = mat
+            if self.use_pool:
+                feat[head_frames + length[b]:, b, :] = 0
+        self.FillHeadTail(feat, head_frames, tail_frames)
+        return feat, numpy.array(length)
+
+    def AssembleTransform(self, feature_transform, mats, skip = 1, skip_offset = 0,
+            round_frames = 1, head_frames = 0, tail_frames = 0):
+        '''
+        the same as Assemble(transformed and skipped mats), but
+        feature_transform writes into the batch array.
+        '''
+        length = [ SkipLength(len(mat), skip, skip_offset) for mat in mats ]
+        max_frames = self.BatchFrames(length, round_frames, head_frames, tail_frames)
+        feat = self.Allocate(max_frames, len(mats), feature_transform.GetOutDim())
+        feature_transform.PropagateBatch(mats, feat[head_frames:], skip, skip_offset)
+        self.FillHeadTail(feat, head_frames, tail_frames)
+        return feat, numpy.array(length)
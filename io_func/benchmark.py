@@ -0,0 +1,708 @@
+'''
+io and feature processing speed benchmark, old implementations are the base.
+python io_func/benchmark.py [ark ...]
+'''
+from __future__ import print_function
+
+import sys
+import time
+from io import BytesIO
+
+import numpy as np
+
+sys.path.extend(["../","./"])
+from io_func.compression_header import *
+from io_func.matio import read_matrix_or_vector
+
+def Timeit(func, repeat = 20):
+    '''
+    return best time(ms) of repeat calls
+    '''
+    best = None
+    for i in range(repeat):
+        start = time.time()
+        func()
+        cost = (time.time() - start) * 1000.0
+        if best is None or cost < best:
+            best = cost
+    return best
+
+def Report(name, base_ms, new_ms):
+    print('%-40s base %8.3f ms  new %8.3f ms  speedup %6.2fx' %
+            (name, base_ms, new_ms, base_ms / max(new_ms, 1e-6)))
+
+def CompressMatrix(array, compression_method):
+    '''
+    return kaldi binary compressed matrix bytes(with '\\0B')
+    '''
+    fd = BytesIO()
+    fd.write(b'\0B')
+    global_header = GlobalHeader.compute(array, compression_method)
+    global_header.write(fd)
+    if global_header.type == 'CM':
+        per_col_header = PerColHeader.compute(array, global_header)
+        per_col_header.write(fd, global_header)
+        fd.write(per_col_header.float_to_char(array.T).tobytes())
+    else:
+        fd.write(global_header.float_to_uint(array).tobytes())
+    return fd.getvalue()
+
+def BenchCompressedMatrix(rows = 1000, cols = 40, repeat = 20):
+    array = (np.random.randn(rows, cols) * 3.0).astype(np.float32)
+    for method in (kSpeechFeature, kTwoByteAuto, kOneByteAuto):
+        buf = CompressMatrix(array, method)
+        fd = BytesIO(buf)
+        fd.read(2)
+        mtype = fd.read(4).split(b' ')[0].decode()
+        fd.seek(2 + len(mtype) + 1)
+        global_header = GlobalHeader.read(fd, mtype)
+        if mtype == 'CM':
+            per_col_header = PerColHeader.read(fd, global_header)
+            data = np.frombuffer(fd.read(rows * cols), dtype=np.uint8).reshape(cols, rows)
+            out = np.empty((rows, cols), dtype=np.float32)
+            base = lambda: per_col_header.char_to_float(data)
+            new = lambda: per_col_header.char_to_float_lut(data, out=out.T)
+        else:
+            dtype = np.uint16 if mtype == 'CM2' else np.uint8
+            data = np.frombuffer(fd.read(), dtype=dtype).reshape(rows, cols)
+            out = np.empty((rows, cols), dtype=np.float32)
+            base = lambda: global_header.uint_to_float(data)
+            new = lambda: global_header.uint_to_float(data, out=out)
+        assert np.array_equal(base(), new())
+        Report('%s decompress %dx%d' % (mtype, rows, cols),
+                Timeit(base, repeat), Timeit(new, repeat))
+        read = lambda: read_matrix_or_vector(BytesIO(buf), out=out)
+        if mtype == 'CM':
+            assert np.array_equal(read(), base().T)
+        else:
+            assert np.array_equal(read(), base())
+        print('%-40s %8.3f ms' % ('%s read_matrix_or_vector' % mtype, Timeit(read, repeat)))
+
+def BenchArk(ark_file, repeat = 3):
+    '''
+    read a whole ark, it's the real CM/CM2/CM3 data.
+    '''
+    from io_func.matio import read_ark
+    cost = Timeit(lambda: read_ark(ark_file), repeat)
+    print('%-40s %8.3f ms' % ('read_ark ' + ark_file, cost))
+
+def BenchEgs(scp_file = 'source/3766_chain_source/test.scp', repeat = 50):
+    '''
+    chain egs read speed(egs/s) of buffered read_token and
+    the one byte a time read_token.
+    '''
+    from io_func import matio, kaldi_io_egs
+    from io_func.kaldi_io_egs import NnetChainExample
+    scp_lines = open(scp_file, 'r').readlines()
+    def ReadAll():
+        for i in range(repeat):
+            for scp_line in scp_lines:
+                NnetChainExample().ReadScp(scp_line)
+    num_egs = repeat * len(scp_lines)
+    new_ms = Timeit(ReadAll, 3)
+    # swap to old read_token
+    read_token = matio.read_token
+    matio.read_token = kaldi_io_egs.read_token = matio.read_token_bytewise
+    try:
+        base_ms = Timeit(ReadAll, 3)
+    finally:
+        matio.read_token = kaldi_io_egs.read_token = read_token
+    print('%-40s base %8.1f egs/s  new %8.1f egs/s  speedup %6.2fx' %
+            ('egs ' + scp_file, num_egs * 1000.0 / base_ms,
+                num_egs * 1000.0 / new_ms, base_ms / max(new_ms, 1e-6)))
+
+def BenchPackedEgs(scp_file = 'source/3766_chain_source/test.scp', repeat = 50):
+    '''
+    read egs and SparseFst of the supervision, packed egs and egs scp.
+    '''
+    import os
+    import shutil
+    import tempfile
+    from io_func.kaldi_io_egs import NnetChainExample
+    from io_func.egs_pack import PackEgs, ReadChainExample
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        PackEgs(scp_file, os.path.join(tmp_dir, 'egs'))
+        scp_lines = open(scp_file, 'r').readlines()
+        pack_lines = open(os.path.join(tmp_dir, 'egs.pack.scp'), 'r').readlines()
+        def Read(lines):
+            egs = []
+            for scp_line in lines:
+                chain_example = ReadChainExample(scp_line)
+                for iput, oput in zip(chain_example.Input(), chain_example.Output()):
+                    egs.append([iput.GetFeat(), oput.GetSparseFst(), oput.GetDerivWeights()])
+            return egs
+        for base, new in zip(Read(scp_lines), Read(pack_lines)):
+            assert np.array_equal(base[0], new[0])
+            for x, y in zip(base[1], new[1]):
+                assert np.array_equal(np.reshape(x, np.shape(y)), y)
+            assert (base[2] is None) == (new[2] is None)
+        def ReadAll(lines):
+            for i in range(repeat):
+                Read(lines)
+        Report('packed egs %d egs x %d' % (len(scp_lines), repeat),
+                Timeit(lambda: ReadAll(scp_lines), 3), Timeit(lambda: ReadAll(pack_lines), 3))
+    finally:
+        shutil.rmtree(tmp_dir)
+
+def BenchSparseFstCache(scp_file = 'source/3766_chain_source/test.scp', repeat = 50):
+    '''
+    read egs and SparseFst of the supervision, the next epoch of SparseFstCache
+    skips fst reading and converting.
+    '''
+    import shutil
+    import tempfile
+    from io_func.egs_pack import ReadChainExample
+    from io_func.sparse_fst_cache import SparseFstCache
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        scp_lines = open(scp_file, 'r').readlines()
+        def Read(cache):
+            fsts = []
+            for scp_line in scp_lines:
+                for oput in ReadChainExample(scp_line, cache).Output():
+                    fsts.append(oput.GetSparseFst())
+            return fsts
+        # the first epoch writes cache_dir
+        cache = SparseFstCache(len(scp_lines), tmp_dir)
+        base_fsts = Read(cache)
+        cache.Close()
+        # the next epoch is a new io process
+        cache = SparseFstCache(len(scp_lines), tmp_dir)
+        for base, new in zip(base_fsts, Read(cache)):
+            for x, y in zip(base, new):
+                assert np.array_equal(x, y)
+        def ReadAll(cache):
+            for i in range(repeat):
+                Read(cache)
+        Report('sparse fst cache %d egs x %d' % (len(scp_lines), repeat),
+                Timeit(lambda: ReadAll(None), 3),
+                Timeit(lambda: ReadAll(SparseFstCache(len(scp_lines), tmp_dir)), 3))
+    finally:
+        shutil.rmtree(tmp_dir)
+
+def BenchFstReader(fst_file = 'source/3766_chain_source/den.fst',
+        lat_scp = 'source/6293_dt_source/test.lat.scp', repeat = 5):
+    '''
+    Fst.Read + SparseFst and ReadFstArrays + SparseFstArrays,
+    Fst.Read and ReadFstArrays of compact lattices.
+    '''
+    from fst import Fst, SparseFst
+    from fst.fst_reader import ReadFstArrays, SparseFstArrays
+    from io_func.file_pool import PoolOpen
+    def ReadFst():
+        fst = Fst()
+        with open(fst_file, 'rb') as fp:
+            fst.Read(fp)
+        return SparseFst(fst)
+    def ReadArrays():
+        with open(fst_file, 'rb') as fp:
+            return SparseFstArrays(ReadFstArrays(fp))
+    for x, y in zip(ReadFst(), ReadArrays()):
+        assert np.array_equal(x, y)
+    Report('fst reader ' + fst_file, Timeit(ReadFst, repeat), Timeit(ReadArrays, repeat))
+    scp_lines = open(lat_scp, 'r').readlines()
+    def ReadLattices(read):
+        for scp_line in scp_lines:
+            path, pos = scp_line.split()[1].rsplit(':', 1)
+            with PoolOpen(path) as fp:
+                fp.seek(int(pos))
+                read(fp)
+    Report('lattice reader %d lattices' % len(scp_lines),
+            Timeit(lambda: ReadLattices(lambda fp: Fst().Read(fp)), repeat),
+            Timeit(lambda: ReadLattices(ReadFstArrays), repeat))
+
+def BenchArrayFst(fst_file = 'source/3766_chain_source/den.fst', repeat = 3):
+    '''
+    memory and SuperFinalFst + ConvertFstToSparseMatrix of Fst and ArrayFst.
+    '''
+    import tracemalloc
+    from fst import Fst, SuperFinalFst, ConvertFstToSparseMatrix
+    from fst.array_fst import ArrayFst
+    def Read(fst):
+        with open(fst_file, 'rb') as fp:
+            fst.Read(fp)
+        return fst
+    memory = []
+    for fst_class in [Fst, ArrayFst]:
+        tracemalloc.start()
+        fst = Read(fst_class())
+        memory.append(tracemalloc.get_traced_memory()[0])
+        tracemalloc.stop()
+        del fst
+    print('%-40s base %8.1f MB  new %8.1f MB  smaller %6.2fx' % ('array fst memory',
+        memory[0] / 1048576.0, memory[1] / 1048576.0, float(memory[0]) / memory[1]))
+    def Convert(fst):
+        SuperFinalFst(fst)
+        return ConvertFstToSparseMatrix(fst)
+    base = Convert(Read(Fst()))
+    new = Convert(Read(ArrayFst()))
+    for x, y in zip(base[:4], new[:4]):
+        assert np.array_equal(x, y)
+    assert base[4] == new[4] and base[5] == new[5]
+    Report('array fst super final + sparse', Timeit(lambda: Convert(Read(Fst())), repeat),
+            Timeit(lambda: Convert(Read(ArrayFst())), repeat))
+
+def RandomLattice(frames, width, num_pdfs, rng, super_final = True):
+    '''
+    lattice of frames x width states, it's top sorted and super final.
+    some arcs in a frame are epsilon.
+    if super_final is False, the last frame states are final and some of them
+    have epsilon arcs, and there is a dead end state which isn't final.
+    '''
+    from fst import Lattice, Arc, LatticeWeightFloat, SuperFinalFst, TopSort
+    def Weight(scale):
+        return LatticeWeightFloat(float(np.float32(rng.rand() * scale)),
+                float(np.float32(rng.rand() * scale)))
+    lat = Lattice()
+    lat.SetArcType('lattice4')
+    states = [[lat.AddState()]] + [ [ lat.AddState() for w in range(width) ] for t in range(frames) ]
+    lat.SetStart(0)
+    for t in range(frames):
+        for w, s in enumerate(states[t]):
+            for n, nextstate in enumerate(states[t + 1]):
+                # every state has one arc in at least
+                if rng.rand() < 0.6 or w == n % len(states[t]):
+                    arc = Arc(LatticeWeightFloat, int(rng.randint(1, num_pdfs)), 0, nextstate)
+                    arc._weight = Weight(3.0)
+                    lat.AddArc(s, arc)
+            if w + 1 < len(states[t]) and rng.rand() < 0.3:
+                arc = Arc(LatticeWeightFloat, 0, 1, states[t][w + 1])
+                arc._weight = Weight(1.0)
+                lat.AddArc(s, arc)
+    for w, s in enumerate(states[frames]):
+        lat.SetFinal(s, Weight(1.0))
+        if not super_final and w + 1 < len(states[frames]) and rng.rand() < 0.5:
+            arc = Arc(LatticeWeightFloat, 0, 1, states[frames][w + 1])
+            arc._weight = Weight(1.0)
+            lat.AddArc(s, arc)
+    if super_final:
+        SuperFinalFst(lat)
+    else:
+        dead_end = lat.AddState()
+        arc = Arc(LatticeWeightFloat, int(rng.randint(1, num_pdfs)), 0, dead_end)
+        arc._weight = Weight(3.0)
+        lat.AddArc(states[frames // 2][0], arc)
+    TopSort(lat)
+    return lat
+
+def BenchLatticeForwardBackward(lat_scp = 'source/6293_dt_source/test.lat.scp', repeat = 5):
+    '''
+    LatticeForwardBackward and SparseLatticeForwardBackward of lattices,
+    test lattices and a wide random lattice.
+    '''
+    from fst import Lattice, ConvertLattice, SuperFinalFst, TopSort
+    from fst import LatticeForwardBackward, ConvertLatticeToSparseMatrix, ConvertLatticeFinalsToSparseMatrix
+    from fst.sparse_lattice import SparseLatticeForwardBackward
+    lattices = []
+    for scp_line in open(lat_scp, 'r'):
+        lat = Lattice()
+        lat.ReadScp(scp_line)
+        lat = ConvertLattice(lat)
+        SuperFinalFst(lat)
+        TopSort(lat)
+        lattices.append(('lattice forward-backward %s' % scp_line.split()[0], lat))
+    lattices.append(('lattice forward-backward random 300x20',
+        RandomLattice(300, 20, 500, np.random.RandomState(0))))
+    lattices.append(('lattice forward-backward random 300x20 final arcs and dead end',
+        RandomLattice(300, 20, 500, np.random.RandomState(1), super_final = False)))
+    for name, lat in lattices:
+        indexs, pdf_values, lm_values, am_values, statesinfo, shape = ConvertLatticeToSparseMatrix(lat)
+        final_weights = ConvertLatticeFinalsToSparseMatrix(lat)
+        def Sparse():
+            return SparseLatticeForwardBackward(indexs, pdf_values, lm_values, am_values,
+                    statesinfo, shape[0], final_weights = final_weights)
+        tot, acoustic_like_sum, post = LatticeForwardBackward(lat)
+        new_tot, new_acoustic_like_sum, new_post = Sparse()
+        dense = np.zeros_like(new_post)
+        for t, frame in enumerate(post):
+            for pdf, value in frame.items():
+                dense[t, pdf] += value
+        assert abs(tot - new_tot) < 1e-6 and abs(acoustic_like_sum - new_acoustic_like_sum) < 1e-6
+        assert np.allclose(dense, new_post, atol=1e-8)
+        Report(name, Timeit(lambda: LatticeForwardBackward(lat), repeat), Timeit(Sparse, repeat))
+
+def BenchBatchLatticeForwardBackward(batch = 16, num_pdfs = 200, repeat = 3):
+    '''
+    LatticeForwardBackward of every rescored lattice and BatchLatticeForwardBackward
+    (rescore included) of the PackageLattice arrays.
+    '''
+    from fst import LatticeStateTimes, LatticeForwardBackward, ConvertLatticeToSparseMatrix
+    from fst import ListZeroFill
+    from fst.sparse_lattice import BatchLatticeForwardBackward
+    rng = np.random.RandomState(0)
+    lattices = [ RandomLattice(int(rng.randint(100, 200)), 8, num_pdfs, rng) for b in range(batch) ]
+    max_time = max([ LatticeStateTimes(lat)[0] for lat in lattices ])
+    nnet_out = rng.randn(max_time, batch, num_pdfs).astype(np.float32)
+    sparse = [ ConvertLatticeToSparseMatrix(lat) for lat in lattices ]
+    packed = [ ListZeroFill([ x[i] for x in sparse ]) for i in range(5) ] + [[ x[5][0] for x in sparse ]]
+    for b, lat in enumerate(lattices):
+        state_times = LatticeStateTimes(lat)[1]
+        for s in range(lat.NumStates()):
+            for arc in lat.GetArcs(s):
+                if arc._ilabel != 0:
+                    arc._weight._value2 -= float(nnet_out[state_times[s], b, arc._ilabel - 1])
+    def Base():
+        return [ LatticeForwardBackward(lat) for lat in lattices ]
+    def Batch():
+        return BatchLatticeForwardBackward(*packed, nnet_out = nnet_out)
+    tot, acoustic_like_sum, post = Batch()
+    for b, (base_tot, base_acoustic_like_sum, base_post) in enumerate(Base()):
+        dense = np.zeros((max_time, num_pdfs))
+        for t, frame in enumerate(base_post):
+            for pdf, value in frame.items():
+                dense[t, pdf - 1] += value
+        assert abs(base_tot - tot[b]) < 1e-6 and abs(base_acoustic_like_sum - acoustic_like_sum[b]) < 1e-5
+        assert np.allclose(dense, post[:, b], atol=1e-6)
+    Report('batch lattice forward-backward %d' % batch, Timeit(Base, repeat), Timeit(Batch, repeat))
+
+def BenchTopSort(lat_scp = 'source/6293_dt_source/test.lat.scp', num_lattices = 2000):
+    '''
+    TopSort + LatticeStateTimes of every Lattice, and TopSortList + LatticeStateTimesList
+    of ArrayFst, the lattices are the test lattices whose states are shuffled.
+    '''
+    from fst import Lattice, ConvertLattice, SuperFinalFst, TopSort
+    from fst import LatticeStateTimes, LatticeForwardBackward, TopSortList, LatticeStateTimesList
+    from fst.array_fst import ArrayFst
+    from fst.fst_reader import StateSortArrays
+    rng = np.random.RandomState(0)
+    sources = []
+    for scp_line in open(lat_scp, 'r'):
+        lat = Lattice()
+        lat.ReadScp(scp_line)
+        lat = ConvertLattice(lat)
+        SuperFinalFst(lat)
+        sources.append(lat)
+    array_fsts = [ ArrayFst.FromFst(lat) for lat in sources ]
+    shuffled = []
+    for i in range(num_lattices):
+        arrays = array_fsts[i % len(sources)]
+        shuffled.append(StateSortArrays(arrays, rng.permutation(arrays.NumStates())))
+    def Sort(fsts):
+        return [ (TopSort(fst), LatticeStateTimes(fst)[0]) for fst in fsts ]
+    def SortList(fsts):
+        return list(zip(TopSortList(fsts), [ x[0] for x in LatticeStateTimesList(fsts) ]))
+    # lattices are sorted in place
+    base_lattices = [ arrays.ToFst(Lattice()) for arrays in shuffled ]
+    start = time.time()
+    base_result = Sort(base_lattices)
+    base_ms = (time.time() - start) * 1000.0
+    new_lattices = [ ArrayFst.FromArrays(arrays) for arrays in shuffled ]
+    start = time.time()
+    new_result = SortList(new_lattices)
+    new_ms = (time.time() - start) * 1000.0
+    assert base_result == new_result
+    for base, new in zip(base_lattices[:10], new_lattices[:10]):
+        assert new.Start() == 0 and (new.nextstate > new.src).all()
+        base_tot, base_acoustic_like_sum, base_post = LatticeForwardBackward(base)
+        new_tot, new_acoustic_like_sum, new_post = LatticeForwardBackward(new)
+        assert abs(base_tot - new_tot) < 1e-6 and abs(base_acoustic_like_sum - new_acoustic_like_sum) < 1e-6
+    Report('top sort + state times %d lattices' % num_lattices, base_ms, new_ms)
+
+def BenchReadLattice(lat_scp = 'source/6293_dt_source/test.lat.scp', batch = 16, repeat = 3):
+    '''
+    ReadLatticeScp of Lattice objects (ConvertLattice, SuperFinalFst, TopSort and
+    LatticeStateTimes of every lattice) and ReadLatticeScpList of ArrayFst, a batch of test lattices.
+    '''
+    from fst import Lattice, ConvertLattice, SuperFinalFst, TopSort, LatticeStateTimes
+    from fst import LatticeForwardBackward, ReadLatticeScpList
+    def ReadLatticeScp(scp_line):
+        lattice = Lattice()
+        key = lattice.ReadScp(scp_line)
+        lattice = ConvertLattice(lattice)
+        SuperFinalFst(lattice)
+        TopSort(lattice)
+        max_time, _ = LatticeStateTimes(lattice)
+        return key, max_time, lattice
+    scp_lines = [ line for line in open(lat_scp, 'r') ]
+    scp_lines = [ scp_lines[i % len(scp_lines)] for i in range(batch) ]
+    base = lambda: [ ReadLatticeScp(line) for line in scp_lines ]
+    new = lambda: ReadLatticeScpList(scp_lines)
+    for (base_key, base_time, base_lat), (key, max_time, lat) in zip(base(), new()):
+        assert base_key == key and base_time == max_time
+        assert lat.Start() == 0 and (lat.nextstate > lat.src).all()
+        base_tot, base_acoustic_like_sum, base_post = LatticeForwardBackward(base_lat)
+        tot, acoustic_like_sum, post = LatticeForwardBackward(lat)
+        assert abs(base_tot - tot) < 1e-6 and abs(base_acoustic_like_sum - acoustic_like_sum) < 1e-6
+        for base_frame, frame in zip(base_post, post):
+            assert base_frame.keys() == frame.keys()
+            assert all(abs(base_frame[pdf] - frame[pdf]) < 1e-9 for pdf in frame)
+    Report('read lattice scp %d lattices' % batch, Timeit(base, repeat), Timeit(new, repeat))
+
+def BenchSplice(frames = 1000, dim = 40, context = 5, repeat = 20):
+    '''
+    strided Splice and the old vstack/hstack Splice, 40-dim x 11 frames.
+    '''
+    from feat_process.feature_transform import Splice
+    splice = Splice()
+    splice.data_ = np.arange(-context, context + 1, dtype=np.int32)
+    feat = np.random.randn(frames, dim).astype(np.float32)
+    out = np.empty((frames, dim * len(splice.data_)), dtype=np.float32)
+    base = lambda: splice.PropagateStack(feat)
+    new = lambda: splice.Propagate(feat, out=out)
+    assert np.array_equal(base(), new())
+    # short utterance and non-contiguous splice
+    assert np.array_equal(splice.PropagateStack(feat[:context + 1]), splice.Propagate(feat[:context + 1]))
+    sparse_splice = Splice()
+    sparse_splice.data_ = np.array([-6, -3, 0, 3, 6], dtype=np.int32)
+    index = np.clip(np.arange(frames)[:, None] + sparse_splice.data_, 0, frames - 1)
+    assert np.array_equal(sparse_splice.Propagate(feat), feat[index].reshape(frames, -1))
+    Report('splice %dx%d context %d' % (frames, dim, 2 * context + 1),
+            Timeit(base, repeat), Timeit(new, repeat))
+
+def BenchFeatureTransform(frames = 1000, dim = 40, context = 5, repeat = 20):
+    '''
+    Splice -> AddShift -> Rescale and skip 3 frames, one array per step
+    and the compiled transform writing into padded [time, batch, dim].
+    the compiled transform is checked against the uncompiled Propagate chain,
+    with a Rescale of zero entries and AddShift after Rescale.
+    '''
+    from io_func import skip_frame
+    from feat_process.feature_transform import FeatureTransform, Splice, AddShift, Rescale
+    out_dim = dim * (2 * context + 1)
+    def Component(cls, dim, zeros = False):
+        cal = cls()
+        cal.data_ = np.random.randn(dim).astype(np.float32)
+        if zeros:
+            cal.data_[::7] = 0.0
+        return cal
+    transform = FeatureTransform()
+    splice = Splice(dim, out_dim)
+    splice.data_ = np.arange(-context, context + 1, dtype=np.int32)
+    add_shift = Component(AddShift, out_dim)
+    rescale = Component(Rescale, out_dim)
+    transform.trans_ = [splice, add_shift, rescale]
+    feats = [ np.random.randn(frames - i * 50, dim).astype(np.float32) for i in range(8) ]
+    def Base():
+        return [ skip_frame(rescale.Propagate(add_shift.Propagate(splice.PropagateStack(feat))), 3, 1)
+                for feat in feats ]
+    out = np.zeros((len(range(1, frames, 3)), len(feats), out_dim), dtype=np.float32)
+    transform.Compile(frames)
+    new = lambda: transform.PropagateBatch(feats, out=out, skip = 3, skip_offset = 1)
+    new_out, length = new()
+    for b, base in enumerate(Base()):
+        assert length[b] == len(base) and np.array_equal(base, new_out[:length[b], b])
+    Report('feature transform batch 8x%dx%d' % (frames, dim), Timeit(Base, repeat), Timeit(new, repeat))
+
+    # affine before and after splice, zero scales, shift after scale
+    for trans in ([ Component(AddShift, dim), Component(Rescale, dim, True), Component(AddShift, dim),
+                splice, Component(Rescale, out_dim, True), Component(AddShift, out_dim) ],
+            [ splice, Component(AddShift, out_dim), Component(Rescale, out_dim, True),
+                Component(AddShift, out_dim), Component(Rescale, out_dim) ]):
+        transform = FeatureTransform()
+        transform.trans_ = trans
+        compiled = FeatureTransform()
+        compiled.trans_ = trans
+        compiled.Compile()
+        for skip, skip_offset in ((1, 0), (3, 0), (3, 2)):
+            for feat in feats[:2] + [ feats[0][:1] ]:
+                base = transform.Propagate(feat, skip = skip, skip_offset = skip_offset)
+                res = compiled.Propagate(feat, skip = skip, skip_offset = skip_offset)
+                assert np.isfinite(res).all() and np.allclose(base, res, rtol=1e-5, atol=1e-5)
+            assert compiled.Propagate(feats[0][:0], skip = skip, skip_offset = skip_offset).shape == (0, out_dim)
+
+def BenchBatchAssemble(batch = 16, dim = 440, repeat = 20):
+    '''
+    zero pad by vstack then hstack/reshape and the batch assembler.
+    '''
+    from io_func.batch_assembler import BatchAssembler
+    feats = [ np.random.randn(np.random.randint(200, 800), dim).astype(np.float32) for i in range(batch) ]
+    def Base():
+        max_frame_num = max([ len(feat) for feat in feats ])
+        feat_mat = []
+        for feat in feats:
+            feat_mat.append(np.vstack((feat, np.zeros((max_frame_num - len(feat), dim), dtype=np.float32))))
+        return np.hstack(feat_mat).reshape(-1, batch, dim)
+    for use_pool in (False, True):
+        assembler = BatchAssembler(use_pool = use_pool)
+        new = lambda: assembler.Assemble(feats)[0]
+        assert np.array_equal(Base(), new())
+        Report('assemble batch %d dim %d%s' % (batch, dim, ' pool' if use_pool else ''),
+                Timeit(Base, repeat), Timeit(new, repeat))
+
+def SliceLabelLoop(label, max_frame_num, num_frames_batch, overlap = 0):
+    '''
+    the old label slice of SliceLoadNextNstreams, frame by frame.
+    '''
+    array_label = []
+    array_length = []
+    for nbatch in range(int(max_frame_num / num_frames_batch)):
+        array_label.append([])
+        tmp_length = []
+        offset_n = nbatch * num_frames_batch
+        for i in range(len(label)):
+            tmp_label = []
+            j = 0
+            while j < num_frames_batch :
+                if j < len(label[i])-offset_n:
+                    tmp_label.append(label[i][j+offset_n])
+                else:
+                    tmp_label.append(0)
+                j += 1
+            if len(label[i])-offset_n > 0:
+                if j + overlap > len(label[i])-offset_n:
+                    tmp_length.append(len(label[i])-offset_n)
+                else:
+                    tmp_length.append(j + overlap)
+            else:
+                tmp_length.append(0)
+            array_label[nbatch].append(tmp_label)
+        array_length.append(np.vstack(tmp_length).reshape(-1))
+    return array_label, array_length
+
+def BenchSliceLabel(batch = 16, num_frames_batch = 20, repeat = 10):
+    '''
+    label slice of ce truncated BPTT, 16 streams of 200-1500 frames.
+    '''
+    from io_func.kaldi_io_parallel import SliceLabel
+    label = [ np.random.randint(0, 5000, np.random.randint(200, 1500)).astype(np.int32)
+            for i in range(batch) ]
+    max_frame_num = max([ len(lab) for lab in label ])
+    max_frame_num = num_frames_batch * (int(max_frame_num / num_frames_batch) + 1)
+    for overlap in (0, 5):
+        base_label, base_length = SliceLabelLoop(label, max_frame_num, num_frames_batch, overlap)
+        new_label, new_length = SliceLabel(label, max_frame_num, num_frames_batch, overlap)
+        assert np.array_equal(np.array(base_label), new_label)
+        assert np.array_equal(np.array(base_length), new_length)
+    base_ms = Timeit(lambda: SliceLabelLoop(label, max_frame_num, num_frames_batch), repeat)
+    new_ms = Timeit(lambda: SliceLabel(label, max_frame_num, num_frames_batch), repeat)
+    frames = sum([ len(lab) for lab in label ])
+    print('%-40s base %8.1f kframes/s  new %8.1f kframes/s  speedup %6.2fx' %
+            ('slice label %dx%d' % (batch, max_frame_num), frames / base_ms,
+                frames / new_ms, base_ms / max(new_ms, 1e-6)))
+
+def MakeContextLoop(feature, left, right):
+    '''
+    the old io_func.make_context, one vstack per context frame.
+    '''
+    if left==0 and right == 0:
+        return feature
+    feature = [feature]
+    for i in range(left):
+        feature.append(np.vstack((feature[-1][0], feature[-1][:-1])))
+    feature.reverse()
+    for i in range(right):
+        feature.append(np.vstack((feature[-1][1:], feature[-1][-1])))
+    return np.hstack(feature)
+
+def SkipFrameLoop(feature, skip, offset = 0):
+    '''
+    the old io_func.skip_frame, frame by frame.
+    '''
+    if skip == 1 or skip == 0:
+        return feature
+    skip_feature=[]
+    for i in range(feature.shape[0]):
+        if i % skip == offset:
+            skip_feature.append(feature[i])
+    return np.vstack(skip_feature)
+
+def GridBlockLoop(feature, block_size, block_skip=1):
+    '''
+    the old io_func.grid_block, frame by frame and block by block.
+    '''
+    block_num = int((feature.shape[-1] - block_size) / block_skip) + 1
+    block_feat = []
+    for i in range(feature.shape[0]):
+        one_block = []
+        for b in range(0, block_num, block_skip):
+            one_block.append(feature[i][b : b+block_size])
+        block_feat.append(np.hstack(one_block))
+    return np.vstack(block_feat)
+
+def BenchFeatureOps(frames = 1000, dim = 40, repeat = 10):
+    '''
+    io_func skip_frame(LFR 3), grid_block and make_context(5, 5)
+    of a 1000 frames x 40-dim utterance and a short one.
+    '''
+    from io_func import make_context, skip_frame, grid_block
+    for num in (frames, 7):
+        feat = np.random.randn(num, dim).astype(np.float32)
+        for offset in range(3):
+            assert np.array_equal(SkipFrameLoop(feat, 3, offset), skip_frame(feat, 3, offset))
+        for block_size, block_skip in ((8, 1), (8, 2), (8, 3)):
+            assert np.array_equal(GridBlockLoop(feat, block_size, block_skip),
+                    grid_block(feat, block_size, block_skip))
+        assert np.array_equal(MakeContextLoop(feat, 5, 5), make_context(feat, 5, 5))
+        assert np.array_equal(MakeContextLoop(feat, 0, 3), make_context(feat, 0, 3))
+    feat = np.random.randn(frames, dim).astype(np.float32)
+    Report('skip_frame %dx%d skip 3' % (frames, dim),
+            Timeit(lambda: SkipFrameLoop(feat, 3, 1), repeat), Timeit(lambda: skip_frame(feat, 3, 1), repeat))
+    Report('grid_block %dx%d block 8' % (frames, dim),
+            Timeit(lambda: GridBlockLoop(feat, 8, 1), repeat), Timeit(lambda: grid_block(feat, 8, 1), repeat))
+    Report('make_context %dx%d context 5,5' % (frames, dim),
+            Timeit(lambda: MakeContextLoop(feat, 5, 5), repeat), Timeit(lambda: make_context(feat, 5, 5), repeat))
+
+def ClaimWorker(claim, counter):
+    num = 0
+    while len(claim()) != 0:
+        num += 1
+    counter.value += num
+
+def BenchClaim(num_packages = 20000, workers = (1, 4, 16), nstreams = 16):
+    '''
+    package claims per second of io processes,
+    Manager().list() with polling and SharedPackageList.
+    '''
+    import ctypes
+    import multiprocessing
+    from io_func.package_list import SharedPackageList
+    packages = [ [ [ 'utt%d-%d ark:feats.ark:%d\n' % (i, n, i * 1000 + n) for n in range(nstreams) ],
+        [ np.arange(300, dtype=np.int32) for n in range(nstreams) ] ] for i in range(num_packages) ]
+    manager = multiprocessing.Manager()
+    manager_list = manager.list(packages)
+    read_offset = multiprocessing.Value(ctypes.c_int, 0, lock=True)
+    lock = multiprocessing.Lock()
+    def ManagerClaim():
+        # the same as the old ClaimPackages
+        lock.acquire()
+        if read_offset.value >= len(manager_list):
+            lock.release()
+            return []
+        package = manager_list[read_offset.value : read_offset.value + 1]
+        read_offset.value += 1
+        lock.release()
+        return package
+    shared_list = SharedPackageList()
+    shared_list.extend(packages)
+    shared_list.End()
+    for num_workers in workers:
+        result = []
+        for reset, claim in ((lambda: setattr(read_offset, 'value', 0), ManagerClaim),
+                (shared_list.Reset, shared_list.Claim)):
+            reset()
+            counter = multiprocessing.Value(ctypes.c_long, 0, lock=True)
+            procs = [ multiprocessing.Process(target=ClaimWorker, args=(claim, counter))
+                    for i in range(num_workers) ]
+            start = time.time()
+            for proc in procs:
+                proc.start()
+            for proc in procs:
+                proc.join()
+            cost = time.time() - start
+            assert counter.value == num_packages
+            result.append(num_packages / cost)
+        print('%-40s base %8.1f claims/s  new %8.1f claims/s  speedup %6.2fx' %
+                ('claim packages, %d io processes' % num_workers,
+                    result[0], result[1], result[1] / result[0]))
+    manager.shutdown()
+
+if __name__ == '__main__':
+    BenchCompressedMatrix()
+    BenchEgs()
+    BenchPackedEgs()
+    BenchSparseFstCache()
+    BenchFstReader()
+    BenchArrayFst()
+    BenchLatticeForwardBackward()
+    BenchBatchLatticeForwardBackward()
+    BenchTopSort()
+    BenchReadLattice()
+    BenchSplice()
+    BenchFeatureTransform()
+    BenchBatchAssemble()
+    BenchSliceLabel()
+    BenchFeatureOps()
+    BenchClaim()
+    for ark_file in sys.argv[1:]:
+        BenchArk(ark_file)
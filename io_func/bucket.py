@@ -0,0 +1,105 @@
+import sys
+import bisect
+import random
+import logging
+
+sys.path.extend(["../","./"])
+
+def PaddingRatio(length_lists):
+    '''
+    length_lists: [[len1, len2, ...], ...] every package utterance length.
+    return zero padding frames / all frames of zero padding packages.
+    '''
+    total = 0
+    valid = 0
+    for lengths in length_lists:
+        if len(lengths) == 0:
+            continue
+        total += max(lengths) * len(lengths)
+        valid += sum(lengths)
+    if total == 0:
+        return 0.0
+    return float(total - valid) / total
+
+class BucketPacker(object):
+    '''
+    group utterances of similar length to packages, so zero padding is less.
+    nstreams      :utterances number of one package
+    boundaries    :bucket length boundaries, e.g. [200, 400, 800],
+                   None or [] is one bucket.
+    frames_budget :if > 0, package isn't fixed nstreams, it's as many
+                   utterances as max length * number <= frames_budget.
+    shuffle       :shuffle utterances in bucket. across buckets the
+                   packages are shuffled by KaldiDataReadParallel.
+    buckets are kept, Packages is called again when the reader is reset
+    with shuffle, so utterances of a package change every epoch.
+    skip_frame    :length is divided by skip_frame.
+    '''
+    def __init__(self, nstreams, boundaries = None, frames_budget = 0,
+            shuffle = False, skip_frame = 1):
+        self.nstreams = nstreams
+        self.boundaries = sorted(boundaries) if boundaries else []
+        self.frames_budget = frames_budget
+        self.shuffle = shuffle
+        self.skip_frame = max(skip_frame, 1)
+        # self.buckets = [[[length, item], ...], ...]
+        self.buckets = [ [] for x in range(len(self.boundaries) + 1) ]
+        # length in input order, for compare padding with no bucket
+        self.input_length = []
+        self.padding_ratio = 0.0
+        self.input_padding_ratio = 0.0
+
+    def Add(self, utt_len, item):
+        length = int((utt_len + self.skip_frame - 1) / self.skip_frame)
+        self.buckets[bisect.bisect_left(self.boundaries, length)].append([length, item])
+        self.input_length.append(length)
+
+    def Split(self, bucket):
+        '''
+        split one bucket to packages of [[length, item], ...]
+        '''
+        packages = []
+        if self.frames_budget <= 0:
+            for start in range(0, len(bucket), self.nstreams):
+                package = bucket[start : start + self.nstreams]
+                # fill to nstreams
+                while len(package) < self.nstreams:
+                    package.append(package[0])
+                packages.append(package)
+            return packages
+        package = []
+        max_len = 0
+        for length, item in bucket:
+            if len(package) != 0 and max(max_len, length) * (len(package) + 1) > self.frames_budget:
+                packages.append(package)
+                package = []
+                max_len = 0
+            package.append([length, item])
+            max_len = max(max_len, length)
+        if len(package) != 0:
+            packages.append(package)
+        return packages
+
+    def Packages(self):
+        '''
+        return packages, every package is [[item[0], ...], [item[1], ...], ...]
+        '''
+        packages = []
+        for bucket in self.buckets:
+            if len(bucket) == 0:
+                continue
+            if self.shuffle and len(self.boundaries) != 0:
+                random.shuffle(bucket)
+            else:
+                bucket.sort(key = lambda x: x[0])
+            packages.extend(self.Split(bucket))
+
+        self.padding_ratio = PaddingRatio(
+                [ [ x[0] for x in package ] for package in packages ])
+        step = self.nstreams
+        self.input_padding_ratio = PaddingRatio(
+                [ self.input_length[i : i + step] for i in range(0, len(self.input_length), step) ])
+        logging.info('bucket package number %d, padding ratio %f (no bucket %f)' %
+                (len(packages), self.padding_ratio, self.input_padding_ratio))
+
+        return [ [ list(x) for x in zip(*[ x[1] for x in package ]) ] for package in packages ]
@@ -108,9 +108,15 @@ class GlobalHeader(object):
         array = ((array - self.min_value) / self.range * self.c + 0.499)
         return array.astype(np.dtype(dtype))
 
-    def uint_to_float(self, array):
-        array = array.astype(np.float32)
-        return self.min_value + array * self.range / self.c
+    def uint_to_float(self, array, out=None):
+        if out is None:
+            array = array.astype(np.float32)
+            return self.min_value + array * self.range / self.c
+        # same operation order as above, write into out
+        np.multiply(array, np.float32(self.range), out=out)
+        np.divide(out, np.float32(self.c), out=out)
+        np.add(out, np.float32(self.min_value), out=out)
+        return out
 
 
 class PerColHeader(object):
@@ -219,6 +225,31 @@ class PerColHeader(object):
         array = np.where(ma1, tmp, np.where(ma2, tmp2, tmp3))
         return array.astype(np.dtype(self.endian + 'u1'))
 
+    def lookup_table(self):
+        """(cols, 256) float value of all byte codes of every column,
+        it's the same as char_to_float of codes 0..255."""
+        p0, p25, p75, p100 = self.p0, self.p25, self.p75, self.p100
+        codes = np.arange(256, dtype=np.float32)
+        lut = np.empty((p0.shape[0], 256), dtype=np.float32)
+        lut[:, :65] = p0 + (p25 - p0) * codes[:65] * (1 / 64.)
+        lut[:, 65:193] = p25 + (p75 - p25) * (codes[65:193] - 64.) * (1 / 128.)
+        lut[:, 193:] = p75 + (p100 - p75) * (codes[193:] - 192.) * (1 / 63.)
+        return lut
+
+    def char_to_float_lut(self, array, out=None):
+        """Same as char_to_float, decode by one gather from lookup table
+
+        Args:
+            array (np.ndarray): (cols, rows) uint8
+            out (np.ndarray): (cols, rows) float32, it can be
+                transposed view of (rows, cols) matrix.
+        """
+        cols = array.shape[0]
+        lut = self.lookup_table().reshape(-1)
+        # index of column c code x is c * 256 + x
+        index = array + (np.arange(cols, dtype=np.intp) * 256)[:, None]
+        return np.take(lut, index, out=out, mode='clip')
+
     def char_to_float(self, array):
         array = array.astype(np.float32)
         p0, p25, p75, p100 = self.p0, self.p25, self.p75, self.p100
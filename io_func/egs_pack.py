@@ -0,0 +1,233 @@
+import os
+import sys
+import logging
+
+import numpy
+
+sys.path.extend(["../","./"])
+from io_func.file_pool import GetMmap
+from io_func.kaldi_io_egs import NnetChainExample
+
+'''
+packed chain egs, it's converted from egs scp offline by PackEgs.
+prefix.pack           : records, one record is one (input, output) of an example,
+                        all the arrays of a record are contiguous and 64 bytes aligned.
+prefix.pack.index.npy : PACK_INDEX_DTYPE array, one row per record.
+prefix.pack.scp       : "key prefix.pack:row", row is the first record of the example.
+the supervision fst is saved after SparseFst, so reading it is only array views.
+'''
+
+ALIGN = 64
+
+PACK_INDEX_DTYPE = numpy.dtype([
+    ('example', '<i8'),      # example number, records of one example are adjacent
+    ('offset', '<i8'),       # record offset in .pack
+    ('size', '<i8'),         # record bytes
+    ('rows', '<i4'),         # input feature [rows, cols] float32
+    ('cols', '<i4'),
+    ('in_indexes', '<i4'),   # input indexes [in_indexes, 3] int32
+    ('out_indexes', '<i4'),  # output indexes [out_indexes, 3] int32
+    ('deriv_weights', '<i4'),# deriv weights float32, -1 is None
+    ('num_arcs', '<i4'),     # indexs [num_arcs, 2] int32, in_labels int32, weights float32
+    ('num_states', '<i4'),   # statesinfo [num_states, 2] int32
+    ('isize', '<i4'),
+    ('osize', '<i4'),
+    ])
+
+def AlignSize(nbytes):
+    return (nbytes + ALIGN - 1) // ALIGN * ALIGN
+
+def RecordArrays(record):
+    '''
+    return [(dtype, shape), ...] of the arrays of one record, in save order.
+    '''
+    deriv_weights = max(int(record['deriv_weights']), 0)
+    return [(numpy.float32, (int(record['rows']), int(record['cols']))),
+            (numpy.int32, (int(record['in_indexes']), 3)),
+            (numpy.int32, (int(record['out_indexes']), 3)),
+            (numpy.float32, (deriv_weights,)),
+            (numpy.int32, (int(record['num_arcs']), 2)),
+            (numpy.int32, (int(record['num_arcs']),)),
+            (numpy.float32, (int(record['num_arcs']),)),
+            (numpy.int32, (int(record['num_states']), 2))]
+
+def PackEgs(scp_file, prefix):
+    '''
+    convert egs scp to packed egs, return record number.
+    '''
+    pack_file = prefix + '.pack'
+    index = []
+    example = 0
+    with open(pack_file + '.tmp', 'wb') as data_fp, open(prefix + '.pack.scp.tmp', 'w') as scp_fp:
+        offset = 0
+        for scp_line in open(scp_file, 'r'):
+            if len(scp_line.strip()) == 0:
+                continue
+            chain_example = NnetChainExample()
+            chain_example.ReadScp(scp_line)
+            scp_fp.write('%s %s:%d\n' % (chain_example.GetKey(), pack_file, len(index)))
+            for iput, oput in zip(chain_example.Input(), chain_example.Output()):
+                feat = numpy.asarray(iput.GetFeat(), dtype=numpy.float32)
+                deriv_weights = oput.GetDerivWeights()
+                indexs, in_labels, weights, statesinfo, num_states = oput.GetSparseFst()
+                record = numpy.zeros((), dtype=PACK_INDEX_DTYPE)
+                record['example'] = example
+                record['offset'] = offset
+                record['rows'], record['cols'] = numpy.shape(feat)
+                record['in_indexes'] = len(iput.GetIndex())
+                record['out_indexes'] = len(oput.GetIndex())
+                record['deriv_weights'] = -1 if deriv_weights is None else len(deriv_weights)
+                record['num_arcs'] = len(in_labels)
+                record['num_states'] = num_states
+                record['isize'] = iput.GetSize()
+                record['osize'] = oput.GetSize()
+                arrays = [feat, iput.GetIndex(), oput.GetIndex(),
+                        [] if deriv_weights is None else deriv_weights,
+                        numpy.reshape(indexs, (-1, 2)), in_labels, weights, statesinfo]
+                for array, (dtype, shape) in zip(arrays, RecordArrays(record)):
+                    data = numpy.asarray(array, dtype=dtype).reshape(shape).tobytes()
+                    data_fp.write(data + b'\0' * (AlignSize(len(data)) - len(data)))
+                    offset += AlignSize(len(data))
+                record['size'] = offset - record['offset']
+                index.append(record)
+            example += 1
+    index = numpy.array(index, dtype=PACK_INDEX_DTYPE)
+    with open(pack_file + '.index.npy.tmp', 'wb') as fp:
+        numpy.save(fp, index)
+    os.rename(pack_file + '.tmp', pack_file)
+    os.rename(pack_file + '.index.npy.tmp', pack_file + '.index.npy')
+    os.rename(prefix + '.pack.scp.tmp', prefix + '.pack.scp')
+    logging.info('pack %d egs, %d records, %d bytes to %s' % (example, len(index), offset, pack_file))
+    return len(index)
+
+class PackedNnetIo(object):
+    def __init__(self, feat, indexes, size):
+        self.features = feat
+        self.indexes = indexes
+        self.size = size
+
+    def GetFeat(self):
+        return self.features
+
+    def GetIndex(self):
+        return self.indexes
+
+    def GetSize(self):
+        return self.size
+
+class PackedChainSupervision(object):
+    def __init__(self, indexes, sparse_fst, deriv_weights, size):
+        self.indexes = indexes
+        self.sparse_fst = sparse_fst
+        self.deriv_weights = deriv_weights
+        self.size = size
+
+    def GetSparseFst(self):
+        return self.sparse_fst
+
+    def GetDerivWeights(self):
+        return self.deriv_weights
+
+    def GetIndex(self):
+        return self.indexes
+
+    def GetSize(self):
+        return self.size
+
+class PackedChainExample(object):
+    '''
+    it's read by PackedEgs and used as NnetChainExample,
+    outputs have GetSparseFst but no GetFst.
+    '''
+    def __init__(self, key):
+        self.inputs = []
+        self.outputs = []
+        self.key = key
+
+    def GetKey(self):
+        return self.key
+
+    def Input(self):
+        return self.inputs
+
+    def Output(self):
+        return self.outputs
+
+class PackedEgs(object):
+    '''
+    reader of one .pack file, arrays are read only views of the mmap.
+    '''
+    def __init__(self, pack_file):
+        self.pack_file = pack_file
+        self.index = numpy.load(pack_file + '.index.npy')
+        self.buf = None
+
+    def ReadRecord(self, row):
+        record = self.index[row]
+        offset = int(record['offset'])
+        if self.buf is None:
+            self.buf = memoryview(GetMmap(self.pack_file))
+        # one slice of the whole record, it's no copy
+        buf = self.buf[offset : offset + int(record['size'])]
+        arrays = []
+        pos = 0
+        for dtype, shape in RecordArrays(record):
+            count = int(numpy.prod(shape))
+            arrays.append(numpy.frombuffer(buf, dtype=dtype, count=count, offset=pos).reshape(shape))
+            pos += AlignSize(count * numpy.dtype(dtype).itemsize)
+        feat, in_indexes, out_indexes, deriv_weights, indexs, in_labels, weights, statesinfo = arrays
+        if record['deriv_weights'] < 0:
+            deriv_weights = None
+        iput = PackedNnetIo(feat, in_indexes, int(record['isize']))
+        oput = PackedChainSupervision(out_indexes,
+                [indexs, in_labels, weights, statesinfo, int(record['num_states'])],
+                deriv_weights, int(record['osize']))
+        return iput, oput
+
+    def Read(self, key, row):
+        chain_example = PackedChainExample(key)
+        example = self.index[row]['example']
+        while row < len(self.index) and self.index[row]['example'] == example:
+            iput, oput = self.ReadRecord(row)
+            chain_example.inputs.append(iput)
+            chain_example.outputs.append(oput)
+            row += 1
+        return chain_example
+
+# { pack_file : PackedEgs } of this process
+packed_egs = {}
+
+def ReadChainExample(scp_line, sparse_fst_cache = None):
+    '''
+    read egs scp line or packed egs scp line,
+    return NnetChainExample or PackedChainExample.
+    sparse_fst_cache: SparseFstCache of egs, fst isn't read if it's cached.
+    '''
+    utt_id, path_pos = scp_line.replace('\n','').split(' ')
+    path, pos = path_pos.rsplit(':', 1)
+    if not path.endswith('.pack'):
+        sparse_fsts = None
+        if sparse_fst_cache is not None:
+            sparse_fsts = sparse_fst_cache.Get(path_pos)
+        chain_example = NnetChainExample()
+        chain_example.ReadScp(scp_line, read_fst = sparse_fsts is None)
+        if sparse_fsts is not None:
+            for oput, sparse_fst in zip(chain_example.Output(), sparse_fsts):
+                oput.SetSparseFst(sparse_fst)
+        elif sparse_fst_cache is not None:
+            sparse_fst_cache.Put(path_pos,
+                    [ oput.GetSparseFst() for oput in chain_example.Output() ])
+        return chain_example
+    reader = packed_egs.get(path)
+    if reader is None:
+        reader = PackedEgs(path)
+        packed_egs[path] = reader
+    return reader.Read(utt_id, int(pos))
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    if len(sys.argv) != 3:
+        print('usage: %s egs.scp out_prefix' % sys.argv[0])
+        print('write out_prefix.pack, out_prefix.pack.index.npy and out_prefix.pack.scp')
+        sys.exit(1)
+    PackEgs(sys.argv[1], sys.argv[2])
@@ -0,0 +1,159 @@
+import os
+import sys
+import ctypes
+import shutil
+import hashlib
+import logging
+import multiprocessing
+
+import numpy
+
+sys.path.extend(["../","./"])
+from io_func.segment_store import SegmentStore, MakeDirs
+
+'''
+on-disk cache of transformed and skipped features.
+cache_dir/<transform hash>-skip<skip_frame>-offset<skip_offset>-<dtype>/
+    SegmentStore of matrices, a record is one matrix, its fields are rows and cols
+    last_used       : mtime is the LRU time of this table
+the first epoch of a skip offset writes tables, next epochs read them by mmap.
+matrices are keyed by scp line, they aren't used if size or mtime of the ark file is changed.
+'''
+
+def TransformHash(feature_transform):
+    sha1 = hashlib.sha1()
+    for cal in feature_transform.trans_:
+        sha1.update(cal.GetTypeStr().encode())
+        sha1.update(numpy.ascontiguousarray(cal.data_).tobytes())
+    return sha1.hexdigest()[:16]
+
+def DirSize(path):
+    size = 0
+    for root, dirs, files in os.walk(path):
+        for name in files:
+            try:
+                size += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return size
+
+def ArkPath(scp_line):
+    # "utt path:pos"
+    return scp_line.split(' ')[1].rsplit(':', 1)[0]
+
+class FeatureCacheTable(object):
+    '''
+    cache of one (transform, skip_frame, skip_offset), it's used in one process.
+    Get return mmap view of matrix cached by previous epochs.
+    Put append matrix to the segment file of this process.
+    '''
+    def __init__(self, path, dtype, cache):
+        self.path = path
+        self.dtype = numpy.dtype(dtype)
+        self.cache = cache
+        # records are [matrix], fields are rows and cols,
+        # matrices of a changed ark file aren't used
+        self.store = SegmentStore(path, 2, ArkPath)
+        self.full = False
+
+    def __contains__(self, key):
+        return key.strip() in self.store
+
+    def Get(self, key):
+        records = self.store.Get(key.strip())
+        if records is None:
+            return None
+        mm, offset, (rows, cols) = records[0]
+        return numpy.frombuffer(mm, dtype=self.dtype, count=rows * cols,
+                offset=offset).reshape(rows, cols)
+
+    def Put(self, key, mat):
+        key = key.strip()
+        if self.full or key in self.store or key in self.store.written:
+            return
+        mat = numpy.ascontiguousarray(mat, dtype=self.dtype)
+        if not self.cache.Reserve(mat.nbytes):
+            self.full = True
+            logging.info('feature cache %s is full, stop writing' % self.path)
+            return
+        self.store.Put(key, [[[mat], mat.shape]])
+
+    def Close(self):
+        self.store.Close()
+
+class FeatureCache(object):
+    '''
+    cache_dir      :cache directory, tables of all transforms and skip offsets
+    transform_hash :TransformHash of feature transform
+    skip_frame     :skip frame number
+    max_mb         :max MB of cache_dir, least recently used tables are evicted
+                    before an epoch, writing stops when it's full.
+    dtype          :float32 or float16
+    it's made before io processes fork, used bytes is shared by them.
+    '''
+    def __init__(self, cache_dir, transform_hash, skip_frame = 1, max_mb = 10240, dtype = 'float32'):
+        self.cache_dir = cache_dir
+        self.transform_hash = transform_hash
+        self.skip_frame = skip_frame
+        self.max_bytes = max_mb * 1024 * 1024
+        self.dtype = dtype
+        self.used = multiprocessing.Value(ctypes.c_longlong, 0, lock=True)
+        # tables of this process, { skip_offset: FeatureCacheTable }
+        self.tables = {}
+
+    def TablePath(self, skip_offset):
+        return os.path.join(self.cache_dir, '%s-skip%d-offset%d-%s' %
+                (self.transform_hash, self.skip_frame, skip_offset, self.dtype))
+
+    def Table(self, skip_offset):
+        table = self.tables.get(skip_offset)
+        if table is None:
+            table = FeatureCacheTable(self.TablePath(skip_offset), self.dtype, self)
+            self.tables[skip_offset] = table
+        return table
+
+    def Reserve(self, nbytes):
+        with self.used.get_lock():
+            if self.used.value + nbytes > self.max_bytes:
+                return False
+            self.used.value += nbytes
+            return True
+
+    def Evict(self, skip_offset):
+        '''
+        called before io processes start, remove least recently used tables
+        except the table of skip_offset until cache_dir size <= max_mb.
+        '''
+        if not os.path.isdir(self.cache_dir):
+            MakeDirs(self.cache_dir)
+        path = self.TablePath(skip_offset)
+        if not os.path.isdir(path):
+            MakeDirs(path)
+        with open(os.path.join(path, 'last_used'), 'w'):
+            pass
+        tables = []
+        total = 0
+        for name in os.listdir(self.cache_dir):
+            table_path = os.path.join(self.cache_dir, name)
+            if not os.path.isdir(table_path):
+                continue
+            size = DirSize(table_path)
+            total += size
+            try:
+                last_used = os.path.getmtime(os.path.join(table_path, 'last_used'))
+            except OSError:
+                last_used = 0
+            if table_path != path:
+                tables.append([last_used, size, table_path])
+        tables.sort()
+        for last_used, size, table_path in tables:
+            if total <= self.max_bytes:
+                break
+            logging.info('evict feature cache %s, %d bytes' % (table_path, size))
+            shutil.rmtree(table_path, ignore_errors=True)
+            total -= size
+        self.used.value = total
+        # the tables of this process are read again
+        for table in self.tables.values():
+            table.Close()
+        self.tables = {}
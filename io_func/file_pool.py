@@ -0,0 +1,196 @@
+import os
+import sys
+import mmap
+import logging
+import threading
+import collections
+from contextlib import contextmanager
+
+sys.path.extend(["../","./"])
+from io_func import smart_open
+
+class FilePool(object):
+    '''
+    LRU pool of opened ark files.
+    scp reads open the same few ark files millions of times, so keep
+    the handles open and only seek.
+    A handle is taken out of the pool while it's used, so two threads
+    never share one file offset.
+    capacity    :max number of idle handles kept open
+    '''
+    def __init__(self, capacity = 128):
+        self.capacity = capacity
+        self.pid = os.getpid()
+        self.lock = threading.Lock()
+        # self.idle = { path: [fd, ...], ... } , order is LRU -> MRU
+        self.idle = collections.OrderedDict()
+        self.num_idle = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def Acquire(self, path):
+        self.lock.acquire()
+        fd_list = self.idle.get(path)
+        if fd_list:
+            fd = fd_list.pop()
+            self.num_idle -= 1
+            if len(fd_list) == 0:
+                del self.idle[path]
+            self.hits += 1
+            self.lock.release()
+            return fd
+        self.misses += 1
+        self.lock.release()
+        return smart_open(path, 'rb')
+
+    def Release(self, path, fd):
+        if self.capacity <= 0:
+            fd.close()
+            return
+        evict_fd = []
+        self.lock.acquire()
+        if path in self.idle:
+            self.idle[path].append(fd)
+            self.MoveToEnd(path)
+        else:
+            self.idle[path] = [fd]
+        self.num_idle += 1
+        # evict least recently used handles
+        while self.num_idle > self.capacity:
+            lru_path = next(iter(self.idle))
+            fd_list = self.idle[lru_path]
+            evict_fd.append(fd_list.pop(0))
+            if len(fd_list) == 0:
+                del self.idle[lru_path]
+            self.num_idle -= 1
+            self.evictions += 1
+        self.lock.release()
+        for efd in evict_fd:
+            efd.close()
+
+    def MoveToEnd(self, path):
+        try:
+            self.idle.move_to_end(path)
+        except AttributeError:
+            # python2 OrderedDict
+            self.idle[path] = self.idle.pop(path)
+
+    @contextmanager
+    def Open(self, path):
+        fd = self.Acquire(path)
+        try:
+            yield fd
+        except:
+            # the offset of fd is unknown, don't reuse it.
+            fd.close()
+            raise
+        else:
+            self.Release(path, fd)
+
+    def Clear(self):
+        self.lock.acquire()
+        idle = self.idle
+        self.idle = collections.OrderedDict()
+        self.num_idle = 0
+        self.lock.release()
+        for fd_list in idle.values():
+            for fd in fd_list:
+                fd.close()
+
+    def Stats(self):
+        return {'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions, 'idle': self.num_idle}
+
+    def __repr__(self):
+        stats = self.Stats()
+        return 'FilePool(pid %d) capacity %d idle %d hits %d misses %d evictions %d' % (
+                self.pid, self.capacity, stats['idle'], stats['hits'],
+                stats['misses'], stats['evictions'])
+
+
+_file_pool = None
+_file_pool_capacity = 128
+_file_pool_lock = threading.Lock()
+
+def _ResetAfterFork():
+    # the lock maybe hold by another thread when fork.
+    global _file_pool_lock
+    _file_pool_lock = threading.Lock()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_ResetAfterFork)
+
+def GetFilePool():
+    '''
+    return the file pool of current process.
+    handles opened by parent process share offset with child process
+    after fork, so child process don't reuse them and create a new pool.
+    '''
+    global _file_pool
+    pool = _file_pool
+    if pool is not None and pool.pid == os.getpid():
+        return pool
+    _file_pool_lock.acquire()
+    if _file_pool is None or _file_pool.pid != os.getpid():
+        # the fd is dup after fork, close child copy only.
+        # parent pool lock maybe hold, so don't use Clear().
+        if _file_pool is not None:
+            logging.debug('new file pool after fork, parent %s' % str(_file_pool))
+            for fd_list in list(_file_pool.idle.values()):
+                for fd in fd_list:
+                    fd.close()
+        _file_pool = FilePool(_file_pool_capacity)
+    pool = _file_pool
+    _file_pool_lock.release()
+    return pool
+
+def SetFilePoolCapacity(capacity):
+    '''
+    capacity <= 0 disable pool, every read open and close file.
+    '''
+    global _file_pool_capacity
+    _file_pool_capacity = capacity
+    pool = GetFilePool()
+    pool.capacity = capacity
+    if capacity <= 0:
+        pool.Clear()
+
+def PoolOpen(path):
+    '''
+    with PoolOpen(path) as fd:
+        fd.seek(pos)
+        ...
+    '''
+    return GetFilePool().Open(path)
+
+
+_mmap_dict = {}
+_mmap_pid = None
+
+def GetMmap(path):
+    '''
+    return read only mmap of path, one mapping per ark file and process.
+    return None if it can't mmap (compressed or not exist file).
+    the mapping keep open, numpy views of it can be used all the epoch.
+    '''
+    global _mmap_dict, _mmap_pid
+    if _mmap_pid != os.getpid():
+        # mapping is read only, it's safe to use after fork,
+        # but it's no need to share dict with parent.
+        _mmap_dict = dict(_mmap_dict)
+        _mmap_pid = os.getpid()
+    try:
+        return _mmap_dict[path]
+    except KeyError:
+        pass
+    mm = None
+    if os.path.splitext(path)[1] not in ('.gz', '.bz2') and os.path.isfile(path):
+        with open(path, 'rb') as fd:
+            try:
+                mm = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+            except (ValueError, mmap.error):
+                # empty file or file system don't support mmap
+                mm = None
+    _mmap_dict[path] = mm
+    return mm
@@ -6,8 +6,11 @@ import sys
 
 sys.path.extend(["../","./"])
 from fst.fst_base import *
+from fst import SparseFst
+from fst.fst_reader import ReadFstArrays, SparseFstArrays
 from io_func.matio import read_token, read_matrix_or_vector
 from io_func import smart_open
+from io_func.file_pool import PoolOpen
 import numpy as np
 from six import binary_type
 
@@ -92,11 +95,25 @@ class Supervision(object):
         self.frames_per_sequence = 0
         self.label_dim = 0
         self.e2e = False
-        self.fst = Fst()
+        self.fst = None
+        # FstArrays, fst is made of it when GetFst
+        self.fst_arrays = None
 
-    def Read(self, fd, binary=True):
+    def GetFst(self):
+        if self.fst is None:
+            self.fst = Fst()
+            if self.fst_arrays is not None:
+                self.fst_arrays.ToFst(self.fst)
+        return self.fst
+
+    def GetSparseFst(self):
+        if self.fst is None and self.fst_arrays is not None:
+            return SparseFstArrays(self.fst_arrays)
+        return SparseFst(self.GetFst())
+
+    def Read(self, fd, binary=True, read_fst=True):
         '''
-        read supervision
+        read supervision, fst is skipped if read_fst is False.
         '''
         ExpectToken(fd, "<Supervision>")
         
@@ -117,8 +134,10 @@ class Supervision(object):
 
         if self.e2e == b'F':
             # read fst
-            if binary:
-                self.fst.Read(fd)
+            if binary and read_fst:
+                self.fst_arrays = ReadFstArrays(fd)
+            elif binary:
+                Fst().Skip(fd)
         elif self.e2e == b'T':
             pass
         else:
@@ -134,7 +153,7 @@ class Supervision(object):
                     " <FramesPerSeq> " + str(self.num_sequences) +
                     " <LabelDim> " + str(self.label_dim) + 
                     "<End2End>" + self.e2e.decode() )
-            self.fst.Write(fd)
+            self.GetFst().Write(fd)
             print("</Supervision>")
         else:
             pass
@@ -251,9 +270,19 @@ class NnetChainSupervision(object):
         self.supervision = None
         self.deriv_weights = None
         self.size = None
+        self.sparse_fst = None
 
     def GetFst(self):
-        return self.supervision.fst
+        return self.supervision.GetFst()
+
+    def GetSparseFst(self):
+        # SparseFst changes fst, it's done once
+        if self.sparse_fst is None:
+            self.sparse_fst = self.supervision.GetSparseFst()
+        return self.sparse_fst
+
+    def SetSparseFst(self, sparse_fst):
+        self.sparse_fst = sparse_fst
 
     def GetDerivWeights(self):
         return self.deriv_weights
@@ -264,7 +293,7 @@ class NnetChainSupervision(object):
     def GetSize(self):
         return self.size
 
-    def Read(self, fd):
+    def Read(self, fd, read_fst=True):
         '''
         Read ChainSupervision data
         '''
@@ -272,7 +301,7 @@ class NnetChainSupervision(object):
         self.name = read_token(fd)
         self.size, self.indexes = ReadIndexVector(fd)
         self.supervision = Supervision()
-        self.supervision.Read(fd)
+        self.supervision.Read(fd, read_fst=read_fst)
         token = read_token(fd)
         
         if token != "</NnetChainSup>":
@@ -324,15 +353,15 @@ class NnetChainExample(object):
     def Output(self):
         return self.outputs
 
-    def ReadScp(self, scp_line):
+    def ReadScp(self, scp_line, read_fst=True):
         utt_id, path_pos = scp_line.replace('\n','').split(' ')
         path, pos = path_pos.split(':')
         self.key = utt_id
-        with open(path, 'rb') as fd:
+        with PoolOpen(path) as fd:
             fd.seek(int(pos),0)
-            return self.Read(fd, read_key=False)
+            return self.Read(fd, read_key=False, read_fst=read_fst)
 
-    def Read(self, fd, read_key=True):
+    def Read(self, fd, read_key=True, read_fst=True):
         if read_key:
             self.key = ReadKey(fd)
             if self.key in [None, '']:
@@ -362,7 +391,7 @@ class NnetChainExample(object):
             
         for i in range(size):
             nnetchainsupervision = NnetChainSupervision()
-            nnetchainsupervision.Read(fd)
+            nnetchainsupervision.Read(fd, read_fst=read_fst)
             self.outputs.append(nnetchainsupervision)
             
         ExpectToken(fd, "</Nnet3ChainEg>")
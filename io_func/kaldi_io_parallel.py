@@ -26,6 +26,9 @@ import threading
 import multiprocessing 
 import ctypes
 import time
+import atexit
+import shutil
+import tempfile
 try:
     import queue as Queue
 except ImportError:
@@ -35,9 +38,19 @@ except ImportError:
 sys.path.extend(["../","./"])
 from io_func import smart_open, skip_frame, sparse_tuple_from
 from feat_process.feature_transform import FeatureTransform
-from io_func.matio import read_next_utt
+from io_func.matio import read_next_utt, read_utt_list, scp_is_sequential, SequentialArkReader
+from io_func.file_pool import PoolOpen, GetFilePool, SetFilePoolCapacity
+from io_func.alignment_cache import LoadAlignment
+from io_func.length_index import LoadLengthIndex
+from io_func.bucket import BucketPacker
+from io_func.shm_ring import ShmRing
+from io_func.package_list import SharedPackageList
+from io_func.batch_assembler import BatchAssembler
+from io_func.feature_cache import FeatureCache, TransformHash
 from fst import *
 from io_func.kaldi_io_egs import NnetChainExample,ProcessEgsFeat
+from io_func.egs_pack import ReadChainExample
+from io_func.sparse_fst_cache import SparseFstCache
 
 
 # read the alignment of all the utterances and keep the alignment in CPU memory.
@@ -56,6 +69,14 @@ def read_alignment(ali_file):
     f_read.close()
     return alignment
 
+# ali_cache: use binary cache of ali_file, it's built at the first time.
+def LoadAlignmentDict(ali_file, ali_cache = False):
+    if ali_cache:
+        alignment = LoadAlignment(ali_file)
+        if alignment is not None:
+            return alignment
+    return read_alignment(ali_file)
+
 # read the feature matrix 
 def read_nocompression_next_utt(next_scp_line):
     # this shouldn't happen
@@ -65,23 +86,21 @@ def read_nocompression_next_utt(next_scp_line):
     utt_id, path_pos = next_scp_line.replace('\n','').split(' ')
     path, pos = path_pos.split(':')
     
-    ark_read_buffer = smart_open(path, 'rb')
-    ark_read_buffer.seek(int(pos),0)
-
-    # now start to read the feature matrix into a numpy matrix
-    header = struct.unpack('<xcccc', ark_read_buffer.read(5))
-    if header[0] != "B" and header[0] != b'B':
-        print ("Input .ark file is not binary"); 
-        exit(1)
+    with PoolOpen(path) as ark_read_buffer:
+        ark_read_buffer.seek(int(pos),0)
 
-    rows = 0; cols= 0
-    m, rows = struct.unpack('<bi', ark_read_buffer.read(5))
-    n, cols = struct.unpack('<bi', ark_read_buffer.read(5))
+        # now start to read the feature matrix into a numpy matrix
+        header = struct.unpack('<xcccc', ark_read_buffer.read(5))
+        if header[0] != "B" and header[0] != b'B':
+            print ("Input .ark file is not binary"); 
+            exit(1)
 
-    tmp_mat = numpy.frombuffer(ark_read_buffer.read(rows * cols * 4), dtype=numpy.float32)
-    utt_mat = numpy.reshape(tmp_mat, (rows, cols))
+        rows = 0; cols= 0
+        m, rows = struct.unpack('<bi', ark_read_buffer.read(5))
+        n, cols = struct.unpack('<bi', ark_read_buffer.read(5))
 
-    ark_read_buffer.close()
+        tmp_mat = numpy.frombuffer(ark_read_buffer.read(rows * cols * 4), dtype=numpy.float32)
+        utt_mat = numpy.reshape(tmp_mat, (rows, cols))
 
     return utt_id, utt_mat
 
@@ -98,13 +117,16 @@ def ReadScp(scp_file):
     f_read.close()
     return scp_dict 
 
-def PackageFeatAndAliAndLat(all_package, input_lock, package_end, feat_scp_file, ali_file, lat_scp_file, nstreams, 
-        skip_frame = 1,  max_input_seq_length = 1500, criterion = 'mmi'):
+def PackageFeatAndAliAndLat(all_package, input_lock, feat_scp_file, ali_file, lat_scp_file, nstreams, 
+        skip_frame = 1,  max_input_seq_length = 1500, criterion = 'mmi', sequential = False,
+        ali_cache = False, length_index = False, bucket = None):
     logging.info('------start PackageFeatAndAliAndLat------')
     start_package = time.time()
     # first read ali
-    alignment_dict = read_alignment(ali_file)
+    alignment_dict = LoadAlignmentDict(ali_file, ali_cache)
     lat_dict = ReadScp(lat_scp_file)
+    # only read feature header for length
+    length_dict = LoadLengthIndex(feat_scp_file, length_index, sequential)
 
     feat_list = []
     ali_list = []
@@ -112,10 +134,10 @@ def PackageFeatAndAliAndLat(all_package, input_lock, package_end, feat_scp_file,
 
     with open(feat_scp_file, 'r') as feat_fp:
         for line in feat_fp:
-            utt_id, utt_mat = read_next_utt(line)
-            logging.debug(utt_id + ' read ok.')
-            if int(len(utt_mat)/skip_frame) + 1 > max_input_seq_length:
-                logging.info(utt_id + ' length '+ str(int(len(utt_mat)/skip_frame)+1) + ' > ' + str(max_input_seq_length))
+            utt_id = line.replace('\n','').split(' ')[0]
+            utt_len = length_dict[utt_id]
+            if int(utt_len/skip_frame) + 1 > max_input_seq_length:
+                logging.info(utt_id + ' length '+ str(int(utt_len/skip_frame)+1) + ' > ' + str(max_input_seq_length))
                 continue
             try:
                 ali_utt = alignment_dict[utt_id]
@@ -130,6 +152,9 @@ def PackageFeatAndAliAndLat(all_package, input_lock, package_end, feat_scp_file,
 
             # should check length is equal.
             # but because of time question , now it's not check length.
+            if bucket is not None:
+                bucket.Add(utt_len, [line, ali_utt, lat_scp_line])
+                continue
             feat_list.append(line)
             ali_list.append(ali_utt)
             lat_list.append(lat_scp_line)
@@ -151,30 +176,37 @@ def PackageFeatAndAliAndLat(all_package, input_lock, package_end, feat_scp_file,
         all_package.append([feat_list, ali_list, lat_list])
         input_lock.release()
 
-    input_lock.acquire()
-    package_end.append(True)
-    input_lock.release()
+    if bucket is not None:
+        packages = bucket.Packages()
+        input_lock.acquire()
+        all_package.extend(packages)
+        input_lock.release()
+
+    all_package.End()
     
     end_package = time.time()
     logging.info('------PackageFeatAndAliAndLat end. Package time is : %f s, batch number : %d' % (end_package - start_package, len(all_package)))
 
 
-def PackageFeatAndAli(all_package, input_lock, package_end, scp_file, ali_file, nstreams, skip_frame = 1,  max_input_seq_length = 1500, criterion = 'ce'):
+def PackageFeatAndAli(all_package, input_lock, scp_file, ali_file, nstreams, skip_frame = 1,  max_input_seq_length = 1500, criterion = 'ce',
+        sequential = False, ali_cache = False, length_index = False, bucket = None):
     logging.info('------start PackageFeatAndAli------')
     start_package = time.time()
     #all_package = []
     # first read ali
-    alignment_dict = read_alignment(ali_file)
+    alignment_dict = LoadAlignmentDict(ali_file, ali_cache)
+    # only read feature header for length
+    length_dict = LoadLengthIndex(scp_file, length_index, sequential)
 
     scp_list = []
     ali_list = []
     # second read feature scp file and package feature and ali
     for line in open(scp_file, 'r'):
-        utt_id, utt_mat = read_next_utt(line)
-        logging.debug(utt_id + ' read ok.')
+        utt_id = line.replace('\n','').split(' ')[0]
+        utt_len = length_dict[utt_id]
         # overlength
-        if int(len(utt_mat)/skip_frame) + 1 > max_input_seq_length:
-            logging.info(utt_id + ' length '+ str(int(len(utt_mat)/skip_frame)+1) + ' > ' + str(max_input_seq_length))
+        if int(utt_len/skip_frame) + 1 > max_input_seq_length:
+            logging.info(utt_id + ' length '+ str(int(utt_len/skip_frame)+1) + ' > ' + str(max_input_seq_length))
             continue
 
         try:
@@ -183,18 +215,21 @@ def PackageFeatAndAli(all_package, input_lock, package_end, scp_file, ali_file,
             logging.info('no '+ utt_id + ' align')
             continue
         if 'ce' in criterion:
-            if len(utt_mat) != len(ali_utt):
+            if utt_len != len(ali_utt):
                 # delete one frame ali in utt_mat
-                if len(ali_utt) - len(utt_mat) == 1:
+                if len(ali_utt) - utt_len == 1:
                     #logging.warn(utt_id + ' feat length + 1 = ali length , and delete one ali label')
                     ali_utt = numpy.delete(ali_utt, -1)
                 else:
                     logging.info(utt_id + ' feat and ali isn\'t equal length')
                     continue
         elif 'ctc' in criterion :
-            if len(utt_mat) < len(ali_utt) * 2 - 1:
-                logging.info(utt_id + ' feat < ali * 2 - 1 :%d < %d * 2 - 1' % (len(utt_mat), len(ali_utt)))
+            if utt_len < len(ali_utt) * 2 - 1:
+                logging.info(utt_id + ' feat < ali * 2 - 1 :%d < %d * 2 - 1' % (utt_len, len(ali_utt)))
                 continue
+        if bucket is not None:
+            bucket.Add(utt_len, [line, ali_utt])
+            continue
         scp_list.append(line)
         ali_list.append(ali_utt)
         if len(scp_list) == nstreams:
@@ -210,16 +245,20 @@ def PackageFeatAndAli(all_package, input_lock, package_end, scp_file, ali_file,
         input_lock.acquire()
         all_package.append([scp_list, ali_list])
         input_lock.release()
-    
-    input_lock.acquire()
-    package_end.append(True)
-    input_lock.release()
+
+    if bucket is not None:
+        packages = bucket.Packages()
+        input_lock.acquire()
+        all_package.extend(packages)
+        input_lock.release()
+
+    all_package.End()
 
     end_package = time.time()
     logging.info('------PackageFeatAndAli end. Package time is : %f s, batch number : %d' % (end_package - start_package, len(all_package)))
     return True
 
-def PackageEgs(all_package, input_lock, package_end, scp_file, nstreams):
+def PackageEgs(all_package, input_lock, scp_file, nstreams):
     logging.info('------start PackageEgs------')
     start_package = time.time()
     #all_package = []
@@ -239,15 +278,34 @@ def PackageEgs(all_package, input_lock, package_end, scp_file, nstreams):
         all_package.append([scp_list])
         input_lock.release()
     
-    input_lock.acquire()
-    package_end.append(True)
-    input_lock.release()
+    all_package.End()
 
     end_package = time.time()
     logging.info('------PackageFeatAndAli end. Package time is : %f s, batch number : %d' % (end_package - start_package, len(all_package)))
     #print("********************")
     return True
 
+def SliceLabel(label, max_frame_num, num_frames_batch, overlap = 0):
+    '''
+    cut labels of every stream to max_frame_num / num_frames_batch chunks.
+    return label [num_chunks, batch, num_frames_batch] int32, zero padded,
+    and length [num_chunks, batch], it's the remain label length of every
+    chunk but at most num_frames_batch + overlap.
+    '''
+    num_chunks = int(max_frame_num / num_frames_batch)
+    frames = num_chunks * num_frames_batch
+    label_mat = numpy.zeros((len(label), frames), dtype=numpy.int32)
+    label_len = numpy.zeros(len(label), dtype=numpy.int64)
+    for i, lab in enumerate(label):
+        label_len[i] = len(lab)
+        label_mat[i, :min(len(lab), frames)] = lab[:frames]
+    # [batch, num_chunks, num_frames_batch] -> [num_chunks, batch, num_frames_batch]
+    array_label = numpy.ascontiguousarray(
+            label_mat.reshape(len(label), num_chunks, num_frames_batch).transpose(1, 0, 2))
+    offset = numpy.arange(num_chunks, dtype=numpy.int64) * num_frames_batch
+    array_length = numpy.clip(label_len[None, :] - offset[:, None], 0, num_frames_batch + overlap)
+    return array_label, array_length
+
 class KaldiDataReadParallel(object):
     '''
     kaldi i.
@@ -257,6 +315,25 @@ class KaldiDataReadParallel(object):
     skip_frame           :skip frame number
     skip_offset          :skip_offset
     shuffle              :shuffle data
+    file_pool_size       :max opened ark files per process, <= 0 disable
+    read_mmap            :read FM/FV/DM/DV features as views of mmap ark
+    read_lookahead       :packages claimed and read together by ark offset order
+    sequential_read      :stream arks when scp order is the same as ark order,
+                          packages are streamed only by one io process without shuffle and bucket
+    ali_cache            :read label from binary cache, it's built next to label
+    length_index         :save utterance length index next to scp file
+    bucket_boundaries    :package utterances of similar length, e.g. '200,400,800'
+    bucket_frames        :max padded frames of one package, package size isn't batch_size, 0 disable,
+                          it isn't supported now, trainers feed fixed batch_size placeholders
+    shm_slots            :batch slots of shared memory transport, it replaces queue_cache, 0 disable,
+                          it must be more than the batches the trainer holds, at least 2
+    shm_slot_size        :MB of one shared memory slot
+    batch_pool           :reuse batch arrays of the same shape, it needs shared memory transport
+    feature_cache_dir    :cache transformed and skipped features on disk, None disable
+    feature_cache_size   :max MB of feature_cache_dir, least recently used caches are evicted
+    feature_cache_dtype  :float32 or float16 cached features
+    sparse_fst_cache     :number of egs sparse supervision fst in LRU memory cache, 0 disable
+    sparse_fst_cache_dir :persist sparse supervision fst in it, None is a temporary directory
     '''
     def __init__(self):
         # config
@@ -275,6 +352,38 @@ class KaldiDataReadParallel(object):
         self.queue_cache = 100
         self.io_thread_num = 1
         self.io_end_times = 0  #if self.io_end_times == self.io_thread_num,it's end
+        self.file_pool_size = 128
+        self.read_mmap = False
+        self.read_lookahead = 1
+        self.sequential_read = True
+        # it's True when sequential_read and scp is in ark order
+        self.scp_sequential = False
+        self.ali_cache = False
+        self.length_index = False
+        self.bucket_boundaries = None
+        self.bucket_frames = 0
+        self.shm_slots = 0
+        self.shm_slot_size = 64
+        self.input_ring = None
+        # BucketPacker of feature packages, packages are made again when they are shuffled
+        self.bucket = None
+        self.batch_pool = False
+        self.batch_assembler = None
+        self.feature_cache_dir = None
+        self.feature_cache_size = 10240
+        self.feature_cache_dtype = 'float32'
+        self.feature_cache = None
+        self.sparse_fst_cache = 0
+        self.sparse_fst_cache_dir = None
+        # SparseFstCache of chain egs
+        self.fst_cache = None
+        # real and zero padding frames loaded by this io process
+        self.valid_frames = 0
+        self.padding_frames = 0
+        # packages read ahead by this io process, [[package, utt_mats], ...]
+        self.pending_packages = []
+        # SequentialArkReader of this io process
+        self.ark_reader = None
         self.scp_file = None   # path to the .scp file
         self.label = None
 
@@ -286,8 +395,9 @@ class KaldiDataReadParallel(object):
         self.criterion = None
         self.feature_transform = None
 
-        # self.egs_dict = { key1: index, ...}
-        self.egs_dict = {}
+        # self.egs_keys = [isize1, osize1, isize2, osize2, ...], index is egs_queue index
+        self.egs_keys = None
+        self.egs_kind = None
         # self.egs_queue = [[queue, ...],[size, ...]]
         self.egs_queue = [[],[]]
         self.max_egs_kind = 5
@@ -322,6 +432,10 @@ class KaldiDataReadParallel(object):
         
         if not os.path.exists(self.scp_file):
             raise 'no scp file'
+        SetFilePoolCapacity(self.file_pool_size)
+        if self.sequential_read and 'chain' not in self.criterion:
+            self.scp_sequential = scp_is_sequential(self.scp_file)
+            logging.info('scp is in ark order: %s' % str(self.scp_sequential))
         #if not os.path.exists(self.label):
         #    raise 'no label file'
         # feature information
@@ -333,21 +447,45 @@ class KaldiDataReadParallel(object):
         self.package_feat_ali = []  # save format is [scp_line_list, ali_list]
 
         # Initial input queue.
-        self.input_queue = multiprocessing.Queue(self.queue_cache)
+        if self.bucket_frames > 0:
+            # packages of bucket_frames are variable streams, but X, Y and lattice
+            # placeholders and rnn states of trainers are batch_size.
+            raise ValueError('bucket_frames %d isn\'t supported, trainers need batch_size streams, '
+                    'use bucket_boundaries' % self.bucket_frames)
+        if self.shm_slots == 1:
+            # trainer holds the previous batch when it gets the next one,
+            # io process would wait a free slot forever.
+            raise ValueError('shm_slots must be 0 (queue) or >= 2, it\'s %d' % self.shm_slots)
+        if self.shm_slots > 0:
+            # GetInput return views of slot, slot is reused when views are deleted.
+            self.input_ring = ShmRing(self.shm_slots, self.shm_slot_size * 1024 * 1024)
+        else:
+            self.input_queue = multiprocessing.Queue(self.queue_cache)
+        # queue pickles batch after put return, so pool array can't be reused.
+        if self.batch_pool and self.input_ring is None:
+            logging.info('batch_pool needs shm_slots > 0, it\'s disabled.')
+        self.batch_assembler = BatchAssembler(use_pool = self.batch_pool and self.input_ring is not None)
 
         # shared memery
         if 'chain' in self.criterion:
-            # self.egs_dict = { key1: index, ...}
-            self.egs_dict = multiprocessing.Manager().dict()
+            self.egs_keys = multiprocessing.RawArray(ctypes.c_int, 2 * self.max_egs_kind)
+            self.egs_kind = multiprocessing.RawValue(ctypes.c_int, 0)
             #self.max_egs_kind = multiprocessing.Value(ctypes.c_int, self.max_egs_kind, lock=True)
             # self.egs_queue = [[queue, ...],[size, ...]]
             for i in range(self.max_egs_kind):
                 self.egs_queue[0].append(multiprocessing.Value(ctypes.c_int, 0, lock=True))
                 self.egs_queue[1].append(multiprocessing.Queue(maxsize=0))
+            if self.sparse_fst_cache > 0:
+                # io processes are forked every epoch, so sparse fst of
+                # previous epochs are read from cache_dir.
+                cache_dir = self.sparse_fst_cache_dir
+                if cache_dir is None:
+                    cache_dir = tempfile.mkdtemp(prefix='sparse_fst_cache.')
+                    atexit.register(shutil.rmtree, cache_dir, True)
+                self.fst_cache = SparseFstCache(self.sparse_fst_cache, cache_dir)
         
-        self.package_feat_ali = multiprocessing.Manager().list([])
-        self.read_offset = multiprocessing.Value(ctypes.c_int, 0, lock=True)
-        self.package_end = multiprocessing.Manager().list([False])
+        # packages and read offset shared by io processes
+        self.package_feat_ali = SharedPackageList()
 
         # read feature transform parameter
         if feature_transform != None:
@@ -355,6 +493,13 @@ class KaldiDataReadParallel(object):
             self.input_feat_dim = self.feature_transform.GetInDim()
             self.output_feat_dim = self.feature_transform.GetOutDim()
             self.output_dim = self.output_feat_dim
+            # fused transform, scratch buffer is for the longest utterance
+            self.feature_transform.Compile((self.max_input_seq_length + 1) * max(self.skip_frame, 1))
+            if self.feature_cache_dir is not None and 'chain' not in self.criterion:
+                self.feature_cache = FeatureCache(self.feature_cache_dir,
+                        TransformHash(self.feature_transform), max(self.skip_frame, 1),
+                        self.feature_cache_size, self.feature_cache_dtype)
+                self.feature_cache.Evict(self.skip_offset)
             # cnn must be in nnet the first layer!!!
             if 'cnn' in self.criterion:
                 self.output_feat_dim = [int(self.output_feat_dim/self.input_feat_dim), self.input_feat_dim]
@@ -383,29 +528,37 @@ class KaldiDataReadParallel(object):
     # package input feats.scp, label and lattice.
     # save index to self.package_feat_ali
     def ThreadPackageFeatAndAli(self):
+        if 'chain' not in self.criterion:
+            self.bucket = self.NewBucketPacker()
         if 'chain' in self.criterion:
             load_thread = threading.Thread(group=None, target=PackageEgs,
-                    args=(self.package_feat_ali, self.input_lock, self.package_end,
+                    args=(self.package_feat_ali, self.input_lock,
                         self.scp_file, self.batch_size),
                     kwargs={}, name='PackageEgs_thread')
             logging.info('PackageEgs thread start.')
 
         elif self.lat_scp_file is None and 'mmi' not in self.criterion: 
             load_thread = threading.Thread(group=None, target=PackageFeatAndAli,
-                    args=(self.package_feat_ali, self.input_lock, self.package_end, 
+                    args=(self.package_feat_ali, self.input_lock,
                         self.scp_file, self.label, 
                         self.batch_size, self.skip_frame, 
                         self.max_input_seq_length, self.criterion,),
-                    kwargs={}, name='PackageFeatAndAli_thread')
+                    kwargs={'sequential': self.scp_sequential,
+                        'ali_cache': self.ali_cache,
+                        'length_index': self.length_index,
+                        'bucket': self.bucket}, name='PackageFeatAndAli_thread')
             logging.info('PackageFeatAndAli thread start.')
 
         else:
             load_thread = threading.Thread(group=None, target=PackageFeatAndAliAndLat,
-                    args=(self.package_feat_ali, self.input_lock, self.package_end,
+                    args=(self.package_feat_ali, self.input_lock,
                         self.scp_file, self.label, self.lat_scp_file,
                         self.batch_size, self.skip_frame,
                         self.max_input_seq_length, self.criterion,),
-                    kwargs={}, name='PackageFeatAndAliAndLat_thread')
+                    kwargs={'sequential': self.scp_sequential,
+                        'ali_cache': self.ali_cache,
+                        'length_index': self.length_index,
+                        'bucket': self.bucket}, name='PackageFeatAndAliAndLat_thread')
             logging.info('PackageFeatAndAliAndLat thread start.')
 
         load_thread.start()
@@ -414,28 +567,52 @@ class KaldiDataReadParallel(object):
         if self.shuffle is True:
             logging.info('Wait Package thread end and shuffle package')
             load_thread.join()
-            assert self.package_end[-1] is True
+            assert self.package_feat_ali.Ended()
             logging.info('Shuffle package_feat_ali')
-            random.shuffle(self.package_feat_ali)
+            self.package_feat_ali.Shuffle()
 
 
+    def NewBucketPacker(self):
+        if not self.bucket_boundaries and self.bucket_frames <= 0:
+            return None
+        boundaries = self.bucket_boundaries
+        if isinstance(boundaries, str):
+            boundaries = [ int(x) for x in boundaries.split(',') if x.strip() != '' ]
+        return BucketPacker(self.batch_size, boundaries, self.bucket_frames,
+                shuffle = self.shuffle, skip_frame = self.skip_frame)
+
+    # packages are read in ark order only when scp is in ark order, they aren't
+    # shuffled or bucketed and one io process claims all of them. else every
+    # backward seek of SequentialArkReader refills its buffer, so file pool is used.
+    def StreamPackages(self):
+        return (self.scp_sequential and self.shuffle is False and self.io_thread_num == 1
+                and not self.bucket_boundaries and self.bucket_frames <= 0)
+
     def Reset(self, shuffle = False, skip_offset = 0 ):
+        start_input = False
         if len(self.input_thread) == 0:
             self.skip_offset = skip_offset % self.skip_frame
-            self.read_offset.value = 0
+            self.package_feat_ali.Reset()
             self.io_end_times = 0
-            self.ThreadPackageInput()
-        logging.info('self.skip_offset:%d, self.read_offset:%d' %(self.skip_offset, self.read_offset.value))
-        if shuffle is True or self.shuffle is True:
+            start_input = True
+        logging.info('self.skip_offset:%d, self.read_offset:%d' %(self.skip_offset, self.package_feat_ali.Offset()))
+        # shuffle before io processes start, else only unread packages are shuffled.
+        if (shuffle is True or self.shuffle is True) and self.package_feat_ali.Ended():
             self.shuffle = True
-            self.input_lock.acquire()
-            if self.package_end[-1] is True:
-                random.shuffle(self.package_feat_ali)
-                logging.info('Reset and shuffle package_feat_ali')
-                self.input_lock.release()
-                return 
-            self.input_lock.release()
-        logging.info('Reset and no shuffle package_feat_ali')
+            if start_input and self.bucket is not None:
+                # utterances are shuffled in buckets again, so packages are new every epoch
+                self.bucket.shuffle = True
+                self.package_feat_ali.Clear()
+                self.package_feat_ali.extend(self.bucket.Packages())
+                self.package_feat_ali.End()
+            self.package_feat_ali.Shuffle()
+            logging.info('Reset and shuffle package_feat_ali')
+        else:
+            logging.info('Reset and no shuffle package_feat_ali')
+        if start_input:
+            if self.feature_cache is not None:
+                self.feature_cache.Evict(self.skip_offset)
+            self.ThreadPackageInput()
 
     def PackBatchEgs(self):
         name_list = []
@@ -458,7 +635,7 @@ class KaldiDataReadParallel(object):
                 self.input_lock.release()
                 max_frame_num = len(feat_mat[0])
                 valid_length = osize
-                fst_list = PackageFst(fst_list)
+                fst_list = PackageSparseFst(fst_list)
                 return feat_mat, deriv_weights_list, valid_length, max_frame_num, fst_list
 
         self.input_lock.release()
@@ -467,94 +644,112 @@ class KaldiDataReadParallel(object):
     # load chain egs
     def LoadOnePackageEgs(self):
         while True:
-            self.input_lock.acquire()
-            if self.read_offset.value >= len(self.package_feat_ali):
-                self.input_lock.release()
+            packages = self.package_feat_ali.Claim(1, block = False)
+            if len(packages) == 0:
                 packfst = self.PackBatchEgs()
                 if packfst is not None:
                     return packfst
-                self.input_lock.acquire()
-                if self.package_end[-1] is True:
-                    self.input_lock.release()
+                # wait for package or end
+                packages = self.package_feat_ali.Claim(1)
+                if len(packages) == 0:
                     return None, None, None, None, None
-                else:
-                    self.input_lock.release()
-                    time.sleep(0.01)
-                    continue
-            else:
-                package = self.package_feat_ali[self.read_offset.value]
-                self.read_offset.value += 1
-                self.input_lock.release()
-                
-                # read one batch egs
-                egs_scp = package[0]
-                splice_info = self.feature_transform.GetSplice()
-                for scp_line in egs_scp:
-                    chain_example = NnetChainExample()
-                    chain_example.ReadScp(scp_line)
-                    # process input features
-                    name = chain_example.GetKey()
-                    inputs = chain_example.Input()
-                    outputs = chain_example.Output()
-                    for iput,oput in zip(inputs,outputs):
-                        feat = iput.GetFeat()
-                        isize = iput.GetSize()
-                        # feature_transform
-                        feat = self.feature_transform.Propagate(feat)
-                        assert isize == np.shape(feat)[0]
-                        #  skip frame  
-                        feat = ProcessEgsFeat(feat, iput.GetIndex(), oput.GetIndex(), 
-                                self.feature_transform.GetSplice(), self.skip_offset)
-                        
-                        ofst = oput.GetFst()
-                        osize = oput.GetSize()
-
-                        deriv_weights = oput.GetDerivWeights()
-                        
-                        def EgsKey(isize, osize):
-                            return str(isize) + '-' + str(osize)
-                        egskey = EgsKey(isize, osize)
-                        #print('name',name)
-                        self.input_lock.acquire()
-                        if egskey in self.egs_dict.keys():
-                            index = self.egs_dict[egskey]
-                            self.egs_queue[0][index].value += 1
-                            self.egs_queue[1][index].put([name, feat, ofst, osize, deriv_weights])
-                            self.input_lock.release()
-                        else:
-                            index = len(self.egs_dict.keys())
-                            self.egs_dict[egskey] = index
-                            assert index < self.max_egs_kind
-                            self.egs_queue[0][index].value += 1
-                            self.egs_queue[1][index].put([name, feat, ofst, osize, deriv_weights])
-
-                            self.input_lock.release()
-                    # end one NnetChainExample
-
-                packfst = self.PackBatchEgs()
-                if packfst is not None:
-                    # end one batch egs scp
-                    return packfst
-                else:
-                    continue
-                # continue next bacth egs scp
+            package = packages[0]
+            
+            # read one batch egs
+            egs_scp = package[0]
+            splice_info = self.feature_transform.GetSplice()
+            for scp_line in egs_scp:
+                # egs or packed egs
+                chain_example = ReadChainExample(scp_line, self.fst_cache)
+                # process input features
+                name = chain_example.GetKey()
+                inputs = chain_example.Input()
+                outputs = chain_example.Output()
+                for iput,oput in zip(inputs,outputs):
+                    feat = iput.GetFeat()
+                    isize = iput.GetSize()
+                    # feature_transform
+                    feat = self.feature_transform.Propagate(feat)
+                    assert isize == np.shape(feat)[0]
+                    #  skip frame  
+                    feat = ProcessEgsFeat(feat, iput.GetIndex(), oput.GetIndex(), 
+                            self.feature_transform.GetSplice(), self.skip_offset)
+                    
+                    # sparse fst is smaller than Fst to send by egs_queue
+                    ofst = oput.GetSparseFst()
+                    osize = oput.GetSize()
 
-    def LoadOnePackage(self):
-        while True:
-            self.input_lock.acquire()
-            if self.read_offset.value >= len(self.package_feat_ali):
-                if self.package_end[-1] is True:
-                    self.input_lock.release()
-                    return None, None, None, None, None
-                else:
+                    deriv_weights = oput.GetDerivWeights()
+                    
+                    #print('name',name)
+                    self.input_lock.acquire()
+                    index = self.EgsQueueIndex(isize, osize)
+                    self.egs_queue[0][index].value += 1
+                    self.egs_queue[1][index].put([name, feat, ofst, osize, deriv_weights])
                     self.input_lock.release()
-                    time.sleep(0.05)
-                    continue
+                # end one NnetChainExample
+
+            packfst = self.PackBatchEgs()
+            if packfst is not None:
+                # end one batch egs scp
+                return packfst
             else:
-                package = self.package_feat_ali[self.read_offset.value]
-                self.read_offset.value += 1
-                self.input_lock.release()
-                break
+                continue
+            # continue next bacth egs scp
+
+    # egs_queue index of egs size, it's called with input_lock.
+    def EgsQueueIndex(self, isize, osize):
+        for index in range(self.egs_kind.value):
+            if self.egs_keys[2 * index] == isize and self.egs_keys[2 * index + 1] == osize:
+                return index
+        index = self.egs_kind.value
+        assert index < self.max_egs_kind
+        self.egs_keys[2 * index] = isize
+        self.egs_keys[2 * index + 1] = osize
+        self.egs_kind.value += 1
+        return index
+
+    # claim at most num packages, return [] if all packages are read.
+    def ClaimPackages(self, num = 1):
+        return self.package_feat_ali.Claim(num)
+
+    # read read_lookahead packages features together,
+    # all utterances are read by ark path and offset order.
+    def ReadAheadPackages(self):
+        packages = self.ClaimPackages(max(self.read_lookahead, 1))
+        scp_lines = []
+        for package in packages:
+            scp_lines.extend(package[0])
+        if self.feature_cache is not None:
+            # cached utterances aren't read
+            table = self.feature_cache.Table(self.skip_offset)
+            all_lines = scp_lines
+            scp_lines = [ line for line in all_lines if line not in table ]
+        ark_reader = None
+        if self.StreamPackages():
+            if self.ark_reader is None:
+                # every io process has itself reader
+                self.ark_reader = SequentialArkReader()
+            ark_reader = self.ark_reader
+        utt_mats = read_utt_list(scp_lines, use_mmap = self.read_mmap,
+                ark_reader = ark_reader)
+        if self.feature_cache is not None:
+            read_mats = dict(zip(scp_lines, utt_mats))
+            utt_mats = [ read_mats.get(line) for line in all_lines ]
+        offset = 0
+        for package in packages:
+            num = len(package[0])
+            self.pending_packages.append([package, utt_mats[offset : offset + num]])
+            offset += num
+
+    # feat is zero padded [max_frames, batch, dim],
+    # max_frames is rounded up to round_frames, head and tail frames are repeated.
+    def LoadOnePackage(self, round_frames = 1, head_frames = 0, tail_frames = 0):
+        if len(self.pending_packages) == 0:
+            self.ReadAheadPackages()
+        if len(self.pending_packages) == 0:
+            return None, None, None, None, None
+        package, utt_mats = self.pending_packages.pop(0)
 
         feat_scp = package[0]
         label = package[1]
@@ -565,20 +760,17 @@ class KaldiDataReadParallel(object):
             # indexs_info_list, pdf_values_list, lmweight_values_list, amweight_values_list, statesinfo_list, statenum_list, time_list
             lat_list = PackageLattice(lat_scp, map_pdf_phone = self.ali_to_pdf_phone)
 
-        max_frame_num = 0
-        length = []
-        feat_mat = []
-        
-        for feat_line in feat_scp:
-            utt_id, utt_mat = read_next_utt(feat_line)
-            # do feature transform
-            if self.feature_transform != None:
-                utt_mat = self.feature_transform.Propagate(utt_mat)
-                feat_mat.append(
-                        skip_frame(utt_mat ,self.skip_frame, self.skip_offset))
-            length.append(len(feat_mat[-1]))
-            if max_frame_num < length[-1]:
-                max_frame_num = length[-1]
+        if self.feature_cache is not None:
+            feat_mat, length = self.AssembleCached(feat_scp, utt_mats,
+                    round_frames, head_frames, tail_frames)
+        else:
+            # feature transform and skip frame into batch array
+            feat_mat, length = self.batch_assembler.AssembleTransform(self.feature_transform,
+                    utt_mats, self.skip_frame, self.skip_offset,
+                    round_frames, head_frames, tail_frames)
+        max_frame_num = max(length)
+        self.valid_frames += sum(length)
+        self.padding_frames += max_frame_num * len(length) - sum(length)
 
         if self.do_skip_lab and self.skip_frame > 1:
             process_lab = []
@@ -598,6 +790,19 @@ class KaldiDataReadParallel(object):
     
         return feat_mat, label, length, max_frame_num, lat_list
     
+    # utt_mat is None if it's in feature cache, else it's transformed and cached.
+    def AssembleCached(self, feat_scp, utt_mats, round_frames, head_frames, tail_frames):
+        table = self.feature_cache.Table(self.skip_offset)
+        mats = []
+        for line, utt_mat in zip(feat_scp, utt_mats):
+            mat = table.Get(line)
+            if mat is None:
+                mat = self.feature_transform.Propagate(utt_mat,
+                        skip = self.skip_frame, skip_offset = self.skip_offset)
+                table.Put(line, mat)
+            mats.append(mat)
+        return self.batch_assembler.Assemble(mats, round_frames, head_frames, tail_frames)
+
     # load batch frames features train.The order it's not important.
     def LoadBatch(self):
         while True:
@@ -618,7 +823,7 @@ class KaldiDataReadParallel(object):
             if label is not None:
                 if 'ctc' in self.criterion:
                     label = sparse_tuple_from(label)
-            self.input_queue.put((feat,label,length,lattice))
+            self.PutInput((feat,label,length,lattice))
             
             if feat is not None:
                 print(numpy.shape(feat))
@@ -626,6 +831,12 @@ class KaldiDataReadParallel(object):
                 print(feat)
             if feat is None:
                 break
+        logging.info('end LoadBatch, %s' % str(GetFilePool()))
+        if self.fst_cache is not None:
+            self.fst_cache.Close()
+        if self.valid_frames > 0:
+            logging.info('end LoadBatch, padding ratio %f' %
+                    (float(self.padding_frames) / (self.padding_frames + self.valid_frames)))
         print('end LoadBatch')
 
     # because efficiency, so should use multiprocessing
@@ -658,10 +869,19 @@ class KaldiDataReadParallel(object):
         self.input_thread = []
 
 
+    def PutInput(self, batch):
+        if self.input_ring is not None:
+            self.input_ring.Put(batch)
+        else:
+            self.input_queue.put(batch)
+
     def GetInput(self):
         # if end
         while True:
-            feat,label,length,lattice = self.input_queue.get()
+            if self.input_ring is not None:
+                feat,label,length,lattice = self.input_ring.Get()
+            else:
+                feat,label,length,lattice = self.input_queue.get()
             if feat is None:
                 self.io_end_times += 1
                 # end
@@ -679,24 +899,11 @@ class KaldiDataReadParallel(object):
     
     # Tdnn frames features train.
     def TdnnLoadNextNstreams(self):
-        feat , label , length, lat_list = self.WholeLoadNextNstreams()
+        # start and end frames repeat the first and the last frame
+        feat , label , length, lat_list = self.WholeLoadNextNstreams(
+                self.tdnn_start_frames, self.tdnn_end_frames)
         if feat is None:
             return None, None, None, None
-                    
-        outdim = self.feature_transform.GetOutDim()
-        inputdim = self.feature_transform.GetInDim()
-        head = feat[:1]
-        tail = feat[-1:]
-        # add start frames
-        i = 0
-        while i < self.tdnn_start_frames:
-            feat = numpy.vstack((head, feat))
-            i += 1
-        # add end frames
-        i = 0
-        while i < self.tdnn_end_frames:
-            feat = numpy.vstack((feat, tail))
-            i += 1
         return feat , label , length, lat_list
 
     # Cnn frames features train.
@@ -736,7 +943,8 @@ class KaldiDataReadParallel(object):
         if feat_mat is None:
             return None, None, None, None
         if feat_mat.__len__() == self.batch_size:
-            feat_mat_nstream = numpy.hstack(feat_mat).reshape(-1, self.batch_size, self.output_dim)
+            # egs of one batch are the same length
+            feat_mat_nstream, length = self.batch_assembler.Assemble(feat_mat)
             # feature, deriv_weights, valid_length, fst_list
             return feat_mat_nstream , deriv_weights_list, valid_length, fst_list
         else:
@@ -744,31 +952,24 @@ class KaldiDataReadParallel(object):
 
 
     # load batch_size features and labels, it's whole sentence train.
-    def LoadNextNstreams(self):
-        feat_mat, label, length, max_frame_num , lat_list = self.LoadOnePackage()
+    def LoadNextNstreams(self, head_frames = 0, tail_frames = 0):
+        feat_mat, label, length, max_frame_num , lat_list = self.LoadOnePackage(
+                head_frames = head_frames, tail_frames = tail_frames)
         if feat_mat is None:
             return None, None, None, None
-        # zero fill
-        i = 0
-        while i < self.batch_size:
-            if max_frame_num != length[i]:
-                feat_mat[i] = numpy.vstack((feat_mat[i], numpy.zeros((max_frame_num-length[i], feat_mat[i].shape[1]),dtype=numpy.float32)))
-            i += 1
-        
-        if feat_mat.__len__() == self.batch_size:
-            feat_mat_nstream = numpy.hstack(feat_mat).reshape(-1, self.batch_size, self.output_dim)
-            np_length = numpy.vstack(length).reshape(-1)
-            return feat_mat_nstream , label , np_length, lat_list
+        # feat_mat is zero padded [time, batch, dim]
+        if feat_mat.shape[1] == self.batch_size:
+            return feat_mat , label , length, lat_list
         else:
             logging.info('It\'s shouldn\'t happen. feat is less then batch_size.')
             return None, None, None, None
 
     # load batch_size features and labels, it's whole sentence train.
-    def WholeLoadNextNstreams(self):
-        feat, label, length, lat_list = self.LoadNextNstreams()
+    def WholeLoadNextNstreams(self, head_frames = 0, tail_frames = 0):
+        feat, label, length, lat_list = self.LoadNextNstreams(head_frames, tail_frames)
         if feat is None:
             return None, None, None, None
-        max_frame_num = numpy.shape(feat)[0]
+        max_frame_num = numpy.shape(feat)[0] - head_frames - tail_frames
         nsent = 0
         while nsent < numpy.shape(label)[0]:
             numzeros = max_frame_num - numpy.shape(label[nsent])[0]
@@ -780,24 +981,18 @@ class KaldiDataReadParallel(object):
 
     # load batch size features and labels,it's ce train, cut sentence.
     def SliceLoadNextNstreams(self):
-        feat_mat, label, length, max_frame_num, lat_list = self.LoadOnePackage()
+        feat_mat, label, length, max_frame_num, lat_list = self.LoadOnePackage(
+                round_frames = self.num_frames_batch)
         if feat_mat is None:
             return None, None, None, None
         
-        if max_frame_num % self.num_frames_batch != 0:
-            max_frame_num = self.num_frames_batch * (int(max_frame_num / self.num_frames_batch) + 1)
-
-        # zero fill
-        i = 0
-        while i < self.batch_size:
-            if max_frame_num != length[i]:
-                feat_mat[i] = numpy.vstack((feat_mat[i], numpy.zeros((max_frame_num-length[i], feat_mat[i].shape[1]),dtype=numpy.float32)))
-            i += 1
+        # feat_mat is zero padded to multiple of num_frames_batch
+        max_frame_num = len(feat_mat)
+
         # process package data, slice
-        if feat_mat.__len__() == self.batch_size:
-            # process feat_mat(list) to time_major numpy [time, batch, dim]
-            feat_mat_nstream = numpy.hstack(feat_mat).reshape(-1, self.batch_size, self.output_dim)
-            np_length = numpy.vstack(length).reshape(-1)
+        if feat_mat.shape[1] == self.batch_size:
+            # time_major numpy [time, batch, dim]
+            feat_mat_nstream = feat_mat
             # slice feat matrix
             if self.overlap == 0:
                 array_feat = numpy.split(feat_mat_nstream, int(max_frame_num / self.num_frames_batch))
@@ -813,37 +1008,8 @@ class KaldiDataReadParallel(object):
                     array_feat.append(slice_f)
                 array_feat = numpy.array(array_feat)
 
-            array_label = []
-            array_length = []
-            # all batch
-            for nbatch in range(int(max_frame_num / self.num_frames_batch)):
-                array_label.append([])
-                tmp_length = []
-                offset_n = nbatch * self.num_frames_batch
-                # one batch
-                # every sentence cut
-                for i in range(len(label)):
-                    tmp_label = []
-                    j = 0
-                    # slice one sentence label
-                    while j < self.num_frames_batch :
-                        if j < len(label[i])-offset_n:
-                            tmp_label.append(label[i][j+offset_n])
-                        else:
-                            tmp_label.append(0)
-                        j += 1
-
-                    # record feature length
-                    if len(label[i])-offset_n > 0:
-                        if j + self.overlap > len(label[i])-offset_n:
-                            tmp_length.append(len(label[i])-offset_n)
-                        else:
-                            tmp_length.append(j + self.overlap)
-                    else:
-                        tmp_length.append(0)
-
-                    array_label[nbatch].append(tmp_label)
-                array_length.append(numpy.vstack(tmp_length).reshape(-1))
+            array_label, array_length = SliceLabel(label, max_frame_num,
+                    self.num_frames_batch, self.overlap)
             return array_feat , array_label , array_length, lat_list
         else:
             logging.info('It\'s shouldn\'t happen. feat is less then batch_size.')
@@ -0,0 +1,86 @@
+import os
+import sys
+import logging
+
+sys.path.extend(["../","./"])
+from io_func.matio import read_next_utt_rows, SequentialArkReader
+
+'''
+utterance frames index of scp file, it's saved as scp_file.len:
+    #size mtime          : scp file size and mtime, check index is valid
+    utt_id frames
+    ...
+'''
+
+def LengthIndexFile(scp_file):
+    return scp_file + '.len'
+
+def ScpFileStat(scp_file):
+    st = os.stat(scp_file)
+    return '#%d %d' % (st.st_size, int(st.st_mtime))
+
+def ReadLengthIndex(scp_file):
+    '''
+    return { utt_id: frames, ...}, None if index isn't exist or valid.
+    '''
+    index_file = LengthIndexFile(scp_file)
+    if not os.path.exists(index_file):
+        return None
+    length_dict = {}
+    with open(index_file, 'r') as index_fp:
+        if index_fp.readline().strip() != ScpFileStat(scp_file):
+            return None
+        for line in index_fp:
+            utt_id, frames = line.split()
+            length_dict[utt_id] = int(frames)
+    return length_dict
+
+def BuildLengthIndex(scp_file, sequential = False):
+    '''
+    read matrix header of all utterances in scp.
+    sequential: scp is in ark order, read header by SequentialArkReader.
+    '''
+    if sequential:
+        ark_reader = SequentialArkReader()
+        read_rows = ark_reader.ReadRows
+    else:
+        read_rows = read_next_utt_rows
+    length_dict = {}
+    with open(scp_file, 'r') as scp_fp:
+        for line in scp_fp:
+            if len(line.strip()) < 1:
+                continue
+            utt_id, frames = read_rows(line)
+            length_dict[utt_id] = frames
+    if sequential:
+        ark_reader.Close()
+    return length_dict
+
+def WriteLengthIndex(scp_file, length_dict, stat):
+    index_file = LengthIndexFile(scp_file)
+    tmp = index_file + '.tmp.%d' % os.getpid()
+    with open(tmp, 'w') as index_fp:
+        index_fp.write(stat + '\n')
+        for utt_id, frames in length_dict.items():
+            index_fp.write('%s %d\n' % (utt_id, frames))
+    os.rename(tmp, index_file)
+
+def LoadLengthIndex(scp_file, persist = False, sequential = False):
+    '''
+    return { utt_id: frames, ...} of scp file by header only read.
+    persist: load index from scp_file.len, and save it if it isn't valid.
+    '''
+    if persist:
+        length_dict = ReadLengthIndex(scp_file)
+        if length_dict is not None:
+            logging.info('load length index %s' % LengthIndexFile(scp_file))
+            return length_dict
+    stat = ScpFileStat(scp_file)
+    length_dict = BuildLengthIndex(scp_file, sequential)
+    if persist:
+        try:
+            WriteLengthIndex(scp_file, length_dict, stat)
+            logging.info('save length index %s' % LengthIndexFile(scp_file))
+        except (IOError, OSError) as e:
+            logging.info('length index %s can\'t be saved: %s' % (LengthIndexFile(scp_file), str(e)))
+    return length_dict
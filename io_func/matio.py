@@ -3,6 +3,7 @@ from __future__ import unicode_literals
 from functools import partial
 from io import BytesIO
 from io import StringIO
+import io
 import os
 import re
 import struct
@@ -18,16 +19,31 @@ from six import string_types
 sys.path.append("../")
 from io_func.compression_header import GlobalHeader
 from io_func.compression_header import PerColHeader
-from io_func import smart_open
+from io_func import smart_open, readers
+from io_func.file_pool import PoolOpen, GetMmap
 
 PY3 = sys.version_info[0] == 3
 
-def read_token(fd, flag=set(' ')):
-    """Read token
+_token_end_pattern = {}
+
+def token_end_pattern(flag):
+    """compiled bytes regex matching any char of flag"""
+    key = frozenset(flag)
+    try:
+        return _token_end_pattern[key]
+    except KeyError:
+        chars = b''.join(re.escape(c.encode()) for c in key if c != '')
+        pattern = re.compile(b'[' + chars + b']')
+        _token_end_pattern[key] = pattern
+        return pattern
+
+def read_token_bytewise(fd, flag=frozenset(' ')):
+    """Read token one byte a time, for file without peek()
     Args:
         fd (file):
     """
     # add end flag ''
+    flag = set(flag)
     flag.add('') 
     token = []
     while True:
@@ -42,7 +58,35 @@ def read_token(fd, flag=set(' ')):
         return None
     return ''.join(token)
 
-def read_matrix_or_vector(fd, endian='<', return_size=False, read_binary_flag = True):
+def read_token(fd, flag=frozenset(' ')):
+    """Read token
+    Scan the read buffer of fd by peek() and consume the token and
+    its end flag with one read(), plain file and gzip/bz2 file are buffered.
+    Args:
+        fd (file):
+        flag (set): token end chars
+    """
+    if not hasattr(fd, 'peek'):
+        return read_token_bytewise(fd, flag)
+    pattern = token_end_pattern(flag)
+    token = bytearray()
+    while True:
+        buf = fd.peek(1)
+        if len(buf) == 0:  # End of file
+            break
+        match = pattern.search(buf)
+        if match is not None:
+            end = match.start()
+            token += buf[:end]
+            fd.read(end + 1)
+            break
+        token += buf
+        fd.read(len(buf))
+    if len(token) == 0:  # End of file
+        return None
+    return token.decode()
+
+def read_matrix_or_vector(fd, endian='<', return_size=False, read_binary_flag = True, out=None):
     """Call from load_kaldi_ark
     
     Args:
@@ -50,6 +94,8 @@ def read_matrix_or_vector(fd, endian='<', return_size=False, read_binary_flag =
         endian (str):
         return_size (bool):
         read_binary_flag (boo): read binary flag
+        out (np.ndarray): (rows, cols) float32 buffer, compressed matrix
+            is decompressed into it.
     """
     size = 0
     if read_binary_flag:
@@ -73,22 +119,29 @@ def read_matrix_or_vector(fd, endian='<', return_size=False, read_binary_flag =
         array = np.frombuffer(buf, dtype=np.dtype(str(endian + 'u1')))
         array = array.reshape((global_header.cols, global_header.rows))
 
-        # Decompress
-        array = per_col_header.char_to_float(array)
-        array = array.T
+        # Decompress, data is column major
+        if out is None:
+            out = np.empty((global_header.rows, global_header.cols), dtype=np.float32)
+        per_col_header.char_to_float_lut(array, out=out.T)
+        array = out
 
-    elif 'CM2' == Type:
+    elif 'CM2' == Type or 'CM3' == Type:
         # Read GlobalHeader
         global_header = GlobalHeader.read(fd, Type, str(endian))
         size += global_header.size
         
-        # Read matrix
-        buf = fd.read(global_header.rows * global_header.cols)
-        array = np.frombuffer(buf, dtype=np.dtype(str(endian + 'u1')))
+        # Read matrix, CM2 is uint16 and CM3 is uint8
+        if 'CM2' == Type:
+            dtype = np.dtype(str(endian + 'u2'))
+        else:
+            dtype = np.dtype(str(endian + 'u1'))
+        buf = fd.read(global_header.rows * global_header.cols * dtype.itemsize)
+        size += global_header.rows * global_header.cols * dtype.itemsize
+        array = np.frombuffer(buf, dtype=dtype)
         array = array.reshape((global_header.rows, global_header.cols))
 
         # Decompress
-        array = global_header.uint_to_float(array)
+        array = global_header.uint_to_float(array, out=out)
 
     else:
         if Type == 'FM' or Type == 'FV':
@@ -126,6 +179,52 @@ def read_matrix_or_vector(fd, endian='<', return_size=False, read_binary_flag =
     else:
         return array
 
+def read_mmap_matrix_or_vector(buf, pos, endian='<', return_size=False):
+    """Read FM, FV, DM, DV from mmap without copy.
+    
+    Args:
+        buf (mmap): read only mmap of ark file
+        pos (int): offset of binary flag '\\0B'
+        endian (str):
+        return_size (bool):
+    Returns:
+        read only numpy view of buf, or None if it's other type(CM, ascii ...),
+        then it should be read by read_matrix_or_vector.
+    """
+    if buf[pos:pos+2] != b'\0B':
+        return None
+    end = buf.find(b' ', pos + 2, pos + 8)
+    if end < 0:
+        return None
+    Type = buf[pos+2:end].decode()
+    if Type == 'FM' or Type == 'FV':
+        dtype = str(endian) + 'f'
+        bytes_per_sample = 4
+    elif Type == 'DM' or Type == 'DV':
+        dtype = str(endian) + 'd'
+        bytes_per_sample = 8
+    else:
+        return None
+
+    offset = end + 1
+    assert buf[offset:offset+1] == b'\4'
+    rows = struct.unpack_from(str(endian + 'i'), buf, offset + 1)[0]
+    offset += 5
+    dim = rows
+    if 'M' in Type:  # As matrix
+        assert buf[offset:offset+1] == b'\4'
+        cols = struct.unpack_from(str(endian + 'i'), buf, offset + 1)[0]
+        offset += 5
+        dim = rows * cols
+
+    array = np.frombuffer(buf, dtype=np.dtype(dtype), count=dim, offset=offset)
+    if 'M' in Type:  # As matrix
+        array = array.reshape((rows, cols))
+    if return_size:
+        return array, offset + dim * bytes_per_sample - pos
+    else:
+        return array
+
 def read_ascii_mat(fd, return_size=False):
     """Call from load_kaldi_ark
 
@@ -228,22 +327,108 @@ def read_kaldi(fd, endian='<', return_size=False):
         return array
 
 
-def read_ark(ark_file, endian='<', return_position=False):
+def open_buffered(ark_file, bufsize = 4 * 1024 * 1024):
+    '''
+    open ark file with a large read buffer, gz and bz2 are supported.
+    '''
+    if os.path.splitext(ark_file)[1] in readers or not os.path.exists(ark_file):
+        return io.BufferedReader(smart_open(ark_file, 'rb'), buffer_size = bufsize)
+    return open(ark_file, 'rb', bufsize)
+
+def iter_ark(ark_file, endian='<', bufsize = 4 * 1024 * 1024):
+    '''
+    sequential read ark, yield (key, matrix) without scp seek.
+    '''
     assert str(endian) in ('<', '>'), endian
-    size = 0
-    fd = smart_open(ark_file, 'rb')
-    while True:
-        key = read_token(fd)
-        if key is None:
-            break
-        size += len(key) + 1
-        array, _size = read_kaldi(fd, str(endian), return_size=True)
-        #print(key, array)
-        size += _size
+    fd = open_buffered(ark_file, bufsize)
+    try:
+        while True:
+            key = read_token(fd)
+            if key is None:
+                break
+            array = read_kaldi(fd, str(endian))
+            yield key, array
+    finally:
+        fd.close()
+
+def read_ark(ark_file, endian='<', return_position=False):
+    num = 0
+    for key, array in iter_ark(ark_file, endian):
+        num += 1
+    return num
+
+def scp_is_sequential(scp_file):
+    '''
+    True if scp is a linear listing of arks: every ark is listed
+    once, and offsets in one ark are increasing.
+    '''
+    done_path = set()
+    cur_path = None
+    cur_pos = -1
+    with open(scp_file, 'r') as scp_fp:
+        for line in scp_fp:
+            line = line.strip()
+            if len(line) < 1:
+                continue
+            path, pos = line.split(' ')[1].rsplit(':', 1)
+            pos = int(pos)
+            if path != cur_path:
+                if path in done_path:
+                    return False
+                done_path.add(cur_path)
+                cur_path = path
+            elif pos <= cur_pos:
+                return False
+            cur_pos = pos
+    return True
+
+class SequentialArkReader(object):
+    '''
+    read scp lines which are in ark order.
+    it keeps one large buffered handle of current ark, so when the next
+    utterance is at the current position, it is read without seek,
+    and a short forward seek is served from the read buffer.
+    lines out of ark order refill the buffer at every seek, don't use it for them.
+    '''
+    def __init__(self, bufsize = 4 * 1024 * 1024):
+        self.bufsize = bufsize
+        self.path = None
+        self.fd = None
+
+    def Seek(self, next_scp_line):
+        utt_id, path_pos = next_scp_line.replace('\n','').split(' ')
+        path, pos = path_pos.split(':')
+        pos = int(pos)
+        if path != self.path:
+            self.Close()
+            self.fd = open_buffered(path, self.bufsize)
+            self.path = path
+        if self.fd.tell() != pos:
+            self.fd.seek(pos, 0)
+        return utt_id
+
+    def Read(self, next_scp_line):
+        if next_scp_line == '' or next_scp_line == None:
+            return '', None
+        utt_id = self.Seek(next_scp_line)
+        array = read_kaldi(self.fd)
+        return utt_id, array
+
+    # only read matrix header
+    def ReadRows(self, next_scp_line):
+        utt_id = self.Seek(next_scp_line)
+        return utt_id, read_matrix_rows(self.fd)
+
+    def Close(self):
+        if self.fd is not None:
+            self.fd.close()
+        self.fd = None
+        self.path = None
 
 
 # read the feature matrix
-def read_next_utt(next_scp_line):
+# use_mmap: FM, FV, DM, DV return read only view of the mapped ark
+def read_next_utt(next_scp_line, use_mmap = False):
     # this shouldn't happen
     if next_scp_line == '' or next_scp_line == None:    # we are reaching the end of one epoch
         return '', None
@@ -251,26 +436,94 @@ def read_next_utt(next_scp_line):
     utt_id, path_pos = next_scp_line.replace('\n','').split(' ')
     path, pos = path_pos.split(':')
 
-    ark_read_buffer = smart_open(path, 'rb')
-    ark_read_buffer.seek(int(pos),0)
+    if use_mmap:
+        buf = GetMmap(path)
+        if buf is not None:
+            array = read_mmap_matrix_or_vector(buf, int(pos))
+            if array is not None:
+                return utt_id, array
 
-    endian='<'
+    with PoolOpen(path) as ark_read_buffer:
+        ark_read_buffer.seek(int(pos),0)
 
-    binary_flag = ark_read_buffer.read(4)
-    assert isinstance(binary_flag, binary_type), type(binary_flag)
+        endian='<'
 
-    ark_read_buffer.seek(int(pos),0)
-    # Load as binary
-    if binary_flag[:2] == b'\0B':
-        array, size = read_matrix_or_vector(ark_read_buffer, endian=str(endian), return_size=True)
-        
-    # Load as ascii
-    else:
-        array, size = read_ascii_mat(ark_read_buffer, return_size=True)
+        binary_flag = ark_read_buffer.read(4)
+        assert isinstance(binary_flag, binary_type), type(binary_flag)
+
+        ark_read_buffer.seek(int(pos),0)
+        # Load as binary
+        if binary_flag[:2] == b'\0B':
+            array, size = read_matrix_or_vector(ark_read_buffer, endian=str(endian), return_size=True)
+            
+        # Load as ascii
+        else:
+            array, size = read_ascii_mat(ark_read_buffer, return_size=True)
     
-    ark_read_buffer.close()
     return utt_id, array
 
+def read_matrix_rows(fd, endian='<'):
+    """Read rows of matrix (or size of vector) from the header only.
+    
+    Args:
+        fd (file): position at binary flag '\\0B'
+        endian (str):
+    """
+    pos = fd.tell()
+    binary_flag = fd.read(2)
+    if binary_flag != b'\0B':
+        # ascii has no header, read all
+        fd.seek(pos, 0)
+        return len(read_ascii_mat(fd))
+    Type = str(read_token(fd))
+    if Type in ('CM', 'CM2', 'CM3'):
+        # GlobalHeader min_value, range, rows, cols
+        fd.read(8)
+        return struct.unpack(str(endian + 'i'), fd.read(4))[0]
+    elif Type in ('FM', 'FV', 'DM', 'DV'):
+        assert fd.read(1) == b'\4'
+        return struct.unpack(str(endian + 'i'), fd.read(4))[0]
+    else:
+        raise ValueError(
+                'Unexpected format: "{}". Now FM, FV, DM, DV, '
+                'CM, CM2, CM3 are supported.'.format(Type))
+
+def read_next_utt_rows(next_scp_line):
+    '''
+    return utt_id and frames number of scp line, only header is read.
+    '''
+    utt_id, path_pos = next_scp_line.replace('\n','').split(' ')
+    path, pos = path_pos.split(':')
+    with PoolOpen(path) as ark_read_buffer:
+        ark_read_buffer.seek(int(pos),0)
+        rows = read_matrix_rows(ark_read_buffer)
+    return utt_id, rows
+
+def scp_read_order(scp_lines):
+    '''
+    return scp line index list sorted by ark path and offset,
+    so read utterances in this order is sequential in ark.
+    '''
+    keys = []
+    for i, line in enumerate(scp_lines):
+        path, pos = line.replace('\n','').split(' ')[1].rsplit(':', 1)
+        keys.append((path, int(pos), i))
+    keys.sort()
+    return [ key[2] for key in keys ]
+
+def read_utt_list(scp_lines, use_mmap = False, ark_reader = None):
+    '''
+    read all scp lines by ark offset order, return utt_mat list in scp order.
+    ark_reader: SequentialArkReader, used when it isn't mmap.
+    '''
+    utt_mats = [ None ] * len(scp_lines)
+    for i in scp_read_order(scp_lines):
+        if ark_reader is not None and not use_mmap:
+            utt_id, utt_mats[i] = ark_reader.Read(scp_lines[i])
+        else:
+            utt_id, utt_mats[i] = read_next_utt(scp_lines[i], use_mmap = use_mmap)
+    return utt_mats
+
 if __name__ == '__main__':
     read_ark('../train-data/cv.ark')
     #read_ark('cv.compress.ark')
@@ -0,0 +1,166 @@
+import os
+import sys
+import ctypes
+import pickle
+import random
+import tempfile
+import threading
+import multiprocessing
+
+import numpy
+
+sys.path.extend(["../","./"])
+
+class SharedPackageList(object):
+    '''
+    package list shared by the packaging thread and io processes,
+    it replaces Manager().list() and the polling of package_end.
+    packages are pickled once to an unlinked temporary file,
+    io processes read them by offset, it's no proxy round trip.
+    the file offset is shared by the forked processes, so seek and
+    read or write are under cond (RLock).
+    index file is [[offset, size], ...] int64 of every package.
+    claim offset is a shared counter, io processes wait on condition
+    and are woken up when packages are added or the list is end.
+    '''
+    def __init__(self):
+        self.data_fp = tempfile.TemporaryFile()
+        self.index_fp = tempfile.TemporaryFile()
+        # only the process create the list write it
+        self.data_size = 0
+        self.write_lock = threading.Lock()
+        self.num = multiprocessing.RawValue(ctypes.c_long, 0)
+        self.ended = multiprocessing.RawValue(ctypes.c_int, 0)
+        self.offset = multiprocessing.RawValue(ctypes.c_long, 0)
+        self.cond = multiprocessing.Condition()
+
+    def append(self, package):
+        self.extend([package])
+
+    def extend(self, packages):
+        data = []
+        index = numpy.zeros((len(packages), 2), dtype=numpy.int64)
+        self.write_lock.acquire()
+        offset = self.data_size
+        for i, package in enumerate(packages):
+            data.append(pickle.dumps(package, pickle.HIGHEST_PROTOCOL))
+            index[i] = [offset, len(data[-1])]
+            offset += len(data[-1])
+        # index is written under cond, so Shuffle and Claim see whole records
+        self.cond.acquire()
+        self.Write(self.data_fp, b''.join(data), self.data_size)
+        self.data_size = offset
+        self.Write(self.index_fp, index.tobytes(), self.num.value * 16)
+        self.num.value += len(packages)
+        self.cond.notify_all()
+        self.cond.release()
+        self.write_lock.release()
+
+    def Clear(self):
+        '''
+        remove all packages, it's called when no io process reads the list.
+        '''
+        self.write_lock.acquire()
+        self.cond.acquire()
+        os.ftruncate(self.data_fp.fileno(), 0)
+        os.ftruncate(self.index_fp.fileno(), 0)
+        self.data_size = 0
+        self.num.value = 0
+        self.offset.value = 0
+        self.ended.value = 0
+        self.cond.release()
+        self.write_lock.release()
+
+    def End(self):
+        self.cond.acquire()
+        self.ended.value = 1
+        self.cond.notify_all()
+        self.cond.release()
+
+    def Ended(self):
+        return self.ended.value == 1
+
+    def __len__(self):
+        return self.num.value
+
+    def Read(self, fp, size, offset):
+        self.cond.acquire()
+        os.lseek(fp.fileno(), offset, os.SEEK_SET)
+        bufs = []
+        while size > 0:
+            buf = os.read(fp.fileno(), size)
+            if len(buf) == 0:
+                break
+            bufs.append(buf)
+            size -= len(buf)
+        self.cond.release()
+        return b''.join(bufs)
+
+    def Write(self, fp, data, offset):
+        self.cond.acquire()
+        os.lseek(fp.fileno(), offset, os.SEEK_SET)
+        while len(data) > 0:
+            data = data[os.write(fp.fileno(), data):]
+        self.cond.release()
+
+    def ReadIndex(self, start, end):
+        buf = self.Read(self.index_fp, (end - start) * 16, start * 16)
+        return numpy.frombuffer(buf, dtype=numpy.int64).reshape(-1, 2)
+
+    def WriteIndex(self, start, index):
+        self.Write(self.index_fp, index.tobytes(), start * 16)
+
+    def Load(self, index):
+        # packages are read under one lock and unpickled out of it
+        self.cond.acquire()
+        bufs = [ self.Read(self.data_fp, int(size), int(offset)) for offset, size in index ]
+        self.cond.release()
+        return [ pickle.loads(buf) for buf in bufs ]
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            start, end, step = i.indices(len(self))
+            return self.Load(self.ReadIndex(start, end)[::step])
+        if i < 0:
+            i += len(self)
+        if i < 0 or i >= len(self):
+            raise IndexError('package index out of range')
+        return self.Load(self.ReadIndex(i, i + 1))[0]
+
+    def Claim(self, num = 1, block = True):
+        '''
+        claim at most num packages, return [] if all packages are claimed
+        and the list is end, or no package now and block is False.
+        '''
+        self.cond.acquire()
+        while self.offset.value >= self.num.value:
+            if self.ended.value == 1 or not block:
+                self.cond.release()
+                return []
+            self.cond.wait()
+        start = self.offset.value
+        end = min(start + num, self.num.value)
+        self.offset.value = end
+        index = self.ReadIndex(start, end)
+        self.cond.release()
+        return self.Load(index)
+
+    def Offset(self):
+        return self.offset.value
+
+    def Reset(self):
+        self.cond.acquire()
+        self.offset.value = 0
+        self.cond.release()
+
+    def Shuffle(self):
+        '''
+        shuffle the packages which aren't claimed.
+        '''
+        self.cond.acquire()
+        start = self.offset.value
+        index = self.ReadIndex(start, self.num.value)
+        order = list(range(len(index)))
+        random.shuffle(order)
+        self.WriteIndex(start, index[order])
+        self.cond.release()
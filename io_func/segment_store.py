@@ -0,0 +1,158 @@
+import os
+import sys
+import mmap
+import errno
+
+import numpy
+
+sys.path.extend(["../","./"])
+
+'''
+append only store of arrays, it's written by io processes and read by mmap in next epochs.
+path/
+    seg.<pid>.data  : arrays of one io process, concatenate
+    seg.<pid>.index : "offset nbytes record size mtime field... key" per array
+a key has records 0, 1, ... which are written together.
+size and mtime (us) are of the source file of key when it's written,
+records are dropped if the source file is changed, e.g. features are made again.
+'''
+
+def MakeDirs(path):
+    try:
+        os.makedirs(path)
+    except OSError as e:
+        if e.errno != errno.EEXIST or not os.path.isdir(path):
+            raise
+
+class SegmentStore(object):
+    '''
+    path       :directory of segment files
+    num_fields :number of int fields of a record, e.g. rows and cols
+    source     :source(key) is the file path key is read from, None isn't checked
+    it's used in one process, files of parent process are dropped after fork.
+    '''
+    def __init__(self, path, num_fields, source = None):
+        self.path = path
+        self.num_fields = num_fields
+        self.source = source
+        # { source path: [size, mtime] }
+        self.stamps = {}
+        # { key: [[mm, offset, fields], ...] }, it's None until Load
+        self.index = None
+        self.mmaps = {}
+        self.data_fp = None
+        self.index_fp = None
+        # keys written by this process, they are in index of next epochs
+        self.written = set()
+        self.pid = os.getpid()
+
+    def CheckPid(self):
+        if self.pid != os.getpid():
+            # files of parent process aren't used after fork,
+            # path is read again
+            self.data_fp = None
+            self.index_fp = None
+            self.index = None
+            self.written = set()
+            self.stamps = {}
+            self.pid = os.getpid()
+
+    def Stamp(self, key):
+        '''
+        return [size, mtime] of the source file of key, [-1, -1] if it isn't a file.
+        '''
+        if self.source is None:
+            return [-1, -1]
+        path = self.source(key)
+        stamp = self.stamps.get(path)
+        if stamp is None:
+            try:
+                st = os.stat(path)
+                stamp = [st.st_size, int(st.st_mtime * 1000000)]
+            except OSError:
+                stamp = [-1, -1]
+            self.stamps[path] = stamp
+        return stamp
+
+    def Load(self):
+        self.CheckPid()
+        if self.index is not None:
+            return
+        self.index = {}
+        if not os.path.isdir(self.path):
+            return
+        for name in os.listdir(self.path):
+            if not name.endswith('.index'):
+                continue
+            data_file = os.path.join(self.path, name[:-len('.index')] + '.data')
+            if not os.path.exists(data_file) or os.path.getsize(data_file) == 0:
+                continue
+            with open(data_file, 'rb') as fd:
+                mm = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+            self.mmaps[data_file] = mm
+            with open(os.path.join(self.path, name), 'r') as fp:
+                for line in fp:
+                    # the last line maybe half written
+                    if not line.endswith('\n'):
+                        break
+                    values = line.rstrip('\n').split(' ', 5 + self.num_fields)
+                    offset, nbytes, record = int(values[0]), int(values[1]), int(values[2])
+                    key = values[-1]
+                    if offset + nbytes > len(mm):
+                        continue
+                    if [ int(x) for x in values[3:5] ] != self.Stamp(key):
+                        # the source file is changed after it's written
+                        continue
+                    records = self.index.setdefault(key, [])
+                    # records of a key written by another process are dropped
+                    if record == len(records):
+                        records.append([mm, offset, [ int(x) for x in values[5:-1] ]])
+
+    def __contains__(self, key):
+        self.Load()
+        return key in self.index
+
+    def Get(self, key):
+        '''
+        return [[mm, offset, fields], ...] of key, or None if it isn't stored,
+        keys written by this process are stored in next epochs.
+        '''
+        self.Load()
+        return self.index.get(key)
+
+    def Put(self, key, records):
+        '''
+        records is [[arrays, fields], ...], arrays of a record are concatenated.
+        '''
+        self.Load()
+        if key in self.index or key in self.written:
+            return
+        if self.data_fp is None:
+            if not os.path.isdir(self.path):
+                MakeDirs(self.path)
+            seg = os.path.join(self.path, 'seg.%d' % os.getpid())
+            self.data_fp = open(seg + '.data', 'ab')
+            self.index_fp = open(seg + '.index', 'a')
+        lines = []
+        size, mtime = self.Stamp(key)
+        for record, (arrays, fields) in enumerate(records):
+            offset = self.data_fp.tell()
+            nbytes = 0
+            for array in arrays:
+                data = numpy.ascontiguousarray(array).tobytes()
+                self.data_fp.write(data)
+                nbytes += len(data)
+            lines.append('%d %d %d %d %d %s%s\n' % (offset, nbytes, record, size, mtime,
+                ''.join([ '%d ' % x for x in fields ]), key))
+        self.data_fp.flush()
+        # index lines are written after data, a stored key is always whole
+        self.index_fp.write(''.join(lines))
+        self.index_fp.flush()
+        self.written.add(key)
+
+    def Close(self):
+        if self.data_fp is not None:
+            self.data_fp.close()
+            self.index_fp.close()
+            self.data_fp = None
+            self.index_fp = None
@@ -0,0 +1,130 @@
+import sys
+import mmap
+import logging
+import weakref
+import collections
+import multiprocessing
+
+import numpy
+
+sys.path.extend(["../","./"])
+
+'''
+shared memory batch transport between io processes and trainer.
+the ring is created before io processes fork, so every process maps the
+same anonymous shared memory. io process copies the numpy arrays of a
+batch into a free slot and only sends slot index, shapes and the small
+python objects by queue. trainer gets numpy views of the slot, the slot
+is free again when all the views are released and the next batch is got.
+trainer holds a batch while it gets the next one, so num_slots must be
+more than the batches trainer holds, it's at least 2.
+'''
+
+ALIGN = 64
+
+def AlignSize(nbytes):
+    return (nbytes + ALIGN - 1) // ALIGN * ALIGN
+
+class SlotArray(object):
+    '''
+    place holder of the i-th array in a slot.
+    '''
+    def __init__(self, index):
+        self.index = index
+
+def IsSlotArray(array):
+    return isinstance(array, numpy.ndarray) and array.dtype.kind in 'biuf'
+
+def FlattenBatch(batch, arrays):
+    '''
+    replace numpy arrays of batch by SlotArray, arrays are appended to arrays.
+    '''
+    if IsSlotArray(batch):
+        arrays.append(batch)
+        return SlotArray(len(arrays) - 1)
+    if isinstance(batch, list):
+        return [ FlattenBatch(x, arrays) for x in batch ]
+    if isinstance(batch, tuple):
+        return tuple([ FlattenBatch(x, arrays) for x in batch ])
+    return batch
+
+def RestoreBatch(batch, arrays):
+    if isinstance(batch, SlotArray):
+        return arrays[batch.index]
+    if isinstance(batch, list):
+        return [ RestoreBatch(x, arrays) for x in batch ]
+    if isinstance(batch, tuple):
+        return tuple([ RestoreBatch(x, arrays) for x in batch ])
+    return batch
+
+class ShmRing(object):
+    '''
+    num_slots  :number of batch slots, io processes wait when all slots are used.
+    slot_bytes :bytes of one slot, bigger batch is sent by queue.
+    '''
+    def __init__(self, num_slots, slot_bytes):
+        assert num_slots >= 2 and 'trainer holds a slot while it gets the next batch'
+        self.num_slots = num_slots
+        self.slot_bytes = AlignSize(slot_bytes)
+        # anonymous mmap is MAP_SHARED, it's shared with forked processes.
+        self.buf = mmap.mmap(-1, self.num_slots * self.slot_bytes)
+        self.free_queue = multiprocessing.Queue()
+        for i in range(self.num_slots):
+            self.free_queue.put(i)
+        self.ready_queue = multiprocessing.Queue()
+        # slots released by trainer, they are put to free_queue in Get.
+        # finalizer don't put queue, it maybe run in queue lock.
+        self.released = collections.deque()
+        # { slot: weakref of slot base }, weakref.finalize isn't in python2,
+        # weakref callback is called only if weakref is alive.
+        self.base_refs = {}
+        self.oversize = 0
+
+    def Put(self, batch):
+        '''
+        io process: copy batch into a free slot and send it.
+        '''
+        arrays = []
+        meta = FlattenBatch(batch, arrays)
+        nbytes = sum([ AlignSize(a.nbytes) for a in arrays ])
+        if len(arrays) == 0 or nbytes > self.slot_bytes:
+            if nbytes > self.slot_bytes:
+                if self.oversize == 0:
+                    logging.info('batch %d bytes > shm slot %d bytes, send it by queue' %
+                            (nbytes, self.slot_bytes))
+                self.oversize += 1
+            self.ready_queue.put((-1, batch, None))
+            return
+        slot = self.free_queue.get()
+        offset = slot * self.slot_bytes
+        specs = []
+        for array in arrays:
+            dst = numpy.frombuffer(self.buf, dtype=array.dtype,
+                    count=array.size, offset=offset).reshape(array.shape)
+            dst[...] = array
+            specs.append((offset - slot * self.slot_bytes, array.shape, array.dtype.str))
+            offset += AlignSize(array.nbytes)
+        self.ready_queue.put((slot, meta, specs))
+
+    def Release(self, slot):
+        self.released.append(slot)
+
+    def Get(self):
+        '''
+        trainer: return the next batch, arrays are views of the slot.
+        '''
+        while len(self.released) != 0:
+            self.free_queue.put(self.released.popleft())
+        slot, meta, specs = self.ready_queue.get()
+        if slot < 0:
+            return meta
+        base = numpy.frombuffer(self.buf, dtype=numpy.uint8,
+                count=self.slot_bytes, offset=slot * self.slot_bytes)
+        # views keep base alive, the slot is free when all views are deleted.
+        self.base_refs[slot] = weakref.ref(base, lambda ref, slot=slot: self.Release(slot))
+        arrays = []
+        for offset, shape, dtype in specs:
+            dtype = numpy.dtype(dtype)
+            nbytes = int(numpy.prod(shape)) * dtype.itemsize
+            arrays.append(base[offset : offset + nbytes].view(dtype).reshape(shape))
+        return RestoreBatch(meta, arrays)
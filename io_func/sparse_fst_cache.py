@@ -0,0 +1,84 @@
+import sys
+import logging
+import collections
+
+import numpy
+
+sys.path.extend(["../","./"])
+from io_func.segment_store import SegmentStore
+
+'''
+memoization of SparseFst of chain supervision, key is egs scp position "path:pos".
+value is [[indexs, in_labels, weights, statesinfo, num_states], ...] of every output.
+cache_dir is a SegmentStore, a record is one output, its fields are num_arcs and num_states.
+egs are read without fst if it's cached, so Fst objects aren't made.
+'''
+
+def EgsPath(path_pos):
+    return path_pos.rsplit(':', 1)[0]
+
+class SparseFstCache(object):
+    '''
+    capacity  :max number of examples in the LRU memory cache of one process.
+    cache_dir :persist sparse fst in it, next epochs read it by mmap, None disable.
+    '''
+    def __init__(self, capacity = 100000, cache_dir = None):
+        self.capacity = capacity
+        self.cache_dir = cache_dir
+        # { key: value }, order is LRU -> MRU
+        self.lru = collections.OrderedDict()
+        # records are outputs, fields are num_arcs and num_states
+        self.store = None
+        if cache_dir is not None:
+            self.store = SegmentStore(cache_dir, 2, EgsPath)
+        self.hits = 0
+        self.misses = 0
+
+    def Read(self, mm, offset, num_arcs, num_states):
+        indexs = numpy.frombuffer(mm, dtype=numpy.int32, count=num_arcs * 2,
+                offset=offset).reshape(num_arcs, 2)
+        offset += indexs.nbytes
+        in_labels = numpy.frombuffer(mm, dtype=numpy.int32, count=num_arcs, offset=offset)
+        offset += in_labels.nbytes
+        weights = numpy.frombuffer(mm, dtype=numpy.float32, count=num_arcs, offset=offset)
+        offset += weights.nbytes
+        statesinfo = numpy.frombuffer(mm, dtype=numpy.int32, count=num_states * 2,
+                offset=offset).reshape(num_states, 2)
+        return [indexs, in_labels, weights, statesinfo, num_states]
+
+    def Get(self, key):
+        '''
+        return sparse fst list of key, or None if it isn't cached.
+        '''
+        value = self.lru.pop(key, None)
+        if value is None and self.store is not None:
+            records = self.store.Get(key)
+            if records is not None:
+                value = [ self.Read(mm, offset, *fields) for mm, offset, fields in records ]
+        if value is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.lru[key] = value
+        if len(self.lru) > self.capacity:
+            self.lru.popitem(last = False)
+        return value
+
+    def Put(self, key, value):
+        self.lru[key] = value
+        if len(self.lru) > self.capacity:
+            self.lru.popitem(last = False)
+        if self.store is None:
+            return
+        records = []
+        for indexs, in_labels, weights, statesinfo, num_states in value:
+            arrays = [numpy.asarray(indexs, dtype=numpy.int32), numpy.asarray(in_labels, dtype=numpy.int32),
+                    numpy.asarray(weights, dtype=numpy.float32), numpy.asarray(statesinfo, dtype=numpy.int32)]
+            records.append([arrays, [len(in_labels), num_states]])
+        self.store.Put(key, records)
+
+    def Close(self):
+        if self.store is not None:
+            self.store.Close()
+        if self.hits + self.misses > 0:
+            logging.info('sparse fst cache hits %d, misses %d' % (self.hits, self.misses))
@@ -83,6 +83,59 @@ def parse_args(args_list):
     parser.add_argument('--io-thread-num', dest='io_thread_num', type=int, default=1,
             help='io threads number(int, default = 1)')
     
+    parser.add_argument('--file-pool-size', dest='file_pool_size', type=int, default=128,
+            help='max opened ark files per io process, <= 0 disable(int, default = 128)')
+    
+    parser.add_argument('--read-mmap', dest='read_mmap', type=bool, default=False,
+            help='read uncompressed ark features by mmap without copy(bool, default = False)')
+    
+    parser.add_argument('--read-lookahead', dest='read_lookahead', type=int, default=1,
+            help='packages read together by ark offset order(int, default = 1)')
+    
+    parser.add_argument('--sequential-read', dest='sequential_read', action='store_true', default=True,
+            help='stream ark files when scp is in ark order, it\'s only used by one io thread without shuffle and bucket(default = True)')
+    
+    parser.add_argument('--no-sequential-read', dest='sequential_read', action='store_false',
+            help='read ark files by file pool random access')
+    
+    parser.add_argument('--ali-cache', dest='ali_cache', type=bool, default=False,
+            help='read label by binary cache, it\'s built next to label file at the first time(bool, default = False)')
+    
+    parser.add_argument('--length-index', dest='length_index', type=bool, default=False,
+            help='save utterance length index next to scp file(bool, default = False)')
+    
+    parser.add_argument('--bucket-boundaries', dest='bucket_boundaries', type=str, default=None,
+            help='package utterances of similar length, length boundaries after skip frame, e.g. 200,400,800(string, default = None)')
+    
+    parser.add_argument('--bucket-frames', dest='bucket_frames', type=int, default=0,
+            help='max padded frames of one package, package utterance number is variable, 0 is batch size, '
+            'it isn\'t supported by trainers now, they need batch size streams(int, default = 0)')
+    
+    parser.add_argument('--shm-slots', dest='shm_slots', type=int, default=0,
+            help='batch slots of shared memory transport from io processes, it replaces queue cache, 0 is queue, '
+            'else it must be more than the batches the trainer holds, at least 2(int, default = 0)')
+    
+    parser.add_argument('--shm-slot-size', dest='shm_slot_size', type=int, default=64,
+            help='MB of one shared memory batch slot(int, default = 64)')
+    
+    parser.add_argument('--batch-pool', dest='batch_pool', type=bool, default=False,
+            help='reuse batch arrays of the same shape, it needs --shm-slots(bool, default = False)')
+    
+    parser.add_argument('--feature-cache-dir', dest='feature_cache_dir', type=str, default=None,
+            help='cache transformed and skipped features in this directory(string, default = None)')
+    
+    parser.add_argument('--feature-cache-size', dest='feature_cache_size', type=int, default=10240,
+            help='max MB of feature cache directory(int, default = 10240)')
+    
+    parser.add_argument('--feature-cache-dtype', dest='feature_cache_dtype', type=str, default='float32',
+            help='float32 or float16 cached features(string, default = float32)')
+    
+    parser.add_argument('--sparse-fst-cache', dest='sparse_fst_cache', type=int, default=0,
+            help='number of chain egs sparse supervision fst in memory cache, 0 disable(int, default = 0)')
+    
+    parser.add_argument('--sparse-fst-cache-dir', dest='sparse_fst_cache_dir', type=str, default=None,
+            help='persist sparse supervision fst in this directory, default is a temporary directory(string, default = None)')
+    
     parser.add_argument('--max-egs-kind', dest='max_egs_kind', type=int, default=1,
             help='max egs kind(int, default = 5)')
 